@@ -0,0 +1,434 @@
+"""
+Admission control for the scoring endpoints.
+
+A request to /sentiment, /sentiment/batch or /upload costs a VADER pass, a
+geolocation lookup and a database write per text, so `AdmissionMiddleware`
+checks it before any of that runs:
+
+1. Size: a body over ADMISSION_MAX_BODY (ADMISSION_MAX_UPLOAD for /upload)
+   is refused with 413, from its Content-Length when sent, otherwise as soon
+   as that many bytes have arrived. Texts longer than TEXT_MAX_LENGTH are
+   rejected by the endpoints themselves.
+2. Rate: every client IP and every session token has a token bucket
+   (RATE_LIMIT_*_RPS refill, RATE_LIMIT_*_BURST capacity). A request takes one
+   token from both, plus one per ADMISSION_BYTES_PER_TOKEN of body, and is
+   refused with 429 and Retry-After when either bucket is empty.
+3. Load: a request is shed with 503 and Retry-After when the query writer or
+   geolocation queue is more than ADMISSION_QUEUE_HIGH full, or when the
+   requests in flight are at the concurrency limit. Then a client that
+   still has half of its buckets left waits for a slot, first come first
+   served, up to ADMISSION_QUEUE_TIMEOUT_MS (ADMISSION_MAX_WAITING requests
+   at most); clients using more of their rate are shed at once. The limit
+   adapts, between ADMISSION_MIN_INFLIGHT and ADMISSION_MAX_INFLIGHT: it is
+   cut by ADMISSION_BACKOFF when requests take longer than
+   ADMISSION_LATENCY_MS (per token of cost), and grows back by one per
+   limit's worth of faster requests.
+
+Refusals never reach the database or the scorer, so a flooding client costs
+a few microseconds per request, and clients within their rate keep their
+throughput. /ws/sentiment handshakes are rate limited the same way, and each
+message through `allow_message`.
+
+Buckets are kept as one float per key (GCRA, the "virtual scheduling" form
+of a token bucket: the time at which the bucket will be full again). Full
+buckets are dropped first when there are more than RATE_LIMIT_MAX_KEYS.
+Limits are per worker process: with N workers a client gets up to N times
+the rate. Set ADMISSION_ENABLED=0 to turn everything off.
+"""
+import asyncio
+import collections
+import json
+import math
+import os
+import time
+from urllib.parse import parse_qs
+from starlette.exceptions import HTTPException
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") != "0"
+RATE_LIMIT_IP_RPS = float(os.getenv("RATE_LIMIT_IP_RPS", "50"))
+RATE_LIMIT_IP_BURST = float(os.getenv("RATE_LIMIT_IP_BURST", "100"))
+RATE_LIMIT_TOKEN_RPS = float(os.getenv("RATE_LIMIT_TOKEN_RPS", "10"))
+RATE_LIMIT_TOKEN_BURST = float(os.getenv("RATE_LIMIT_TOKEN_BURST", "20"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))  # buckets kept per limiter
+ADMISSION_MAX_BODY = int(os.getenv("ADMISSION_MAX_BODY", str(16 * 2 ** 20)))  # bytes, /sentiment and /sentiment/batch
+ADMISSION_MAX_FORM = 16 * 1024  # bytes of a /sentiment form, read here to find its token
+ADMISSION_MAX_UPLOAD = int(os.getenv("ADMISSION_MAX_UPLOAD", str(1024 * 2 ** 20)))  # bytes, /upload
+ADMISSION_BYTES_PER_TOKEN = int(os.getenv("ADMISSION_BYTES_PER_TOKEN", "65536"))  # body bytes per extra token
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "64"))
+ADMISSION_MIN_INFLIGHT = int(os.getenv("ADMISSION_MIN_INFLIGHT", "4"))
+ADMISSION_LATENCY_MS = float(os.getenv("ADMISSION_LATENCY_MS", "250"))
+ADMISSION_BACKOFF = float(os.getenv("ADMISSION_BACKOFF", "0.9"))  # limit multiplier on a slow request
+ADMISSION_QUEUE_HIGH = float(os.getenv("ADMISSION_QUEUE_HIGH", "0.9"))  # queue fill fraction that sheds load
+ADMISSION_MAX_WAITING = int(os.getenv("ADMISSION_MAX_WAITING", "256"))  # requests waiting for a slot
+ADMISSION_QUEUE_TIMEOUT_MS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "100"))
+ADMISSION_RETRY_AFTER = 1  # seconds, for 503 responses
+
+# POST paths that score texts, and their body size limits
+ADMISSION_PATHS = {
+    "/sentiment": ADMISSION_MAX_FORM,
+    "/sentiment/batch": ADMISSION_MAX_BODY,
+    "/upload": ADMISSION_MAX_UPLOAD,
+}
+ADMISSION_WEBSOCKETS = ("/ws/sentiment",)
+
+
+class BodyTooLarge(HTTPException):
+    """
+    Raised while a body streams in past its limit. An HTTPException, so
+    FastAPI's body parsing passes it on (main.py renders it as a 413).
+    """
+
+    def __init__(self, max_body: int):
+        super().__init__(413, f"Request body too large (max {max_body} bytes).")
+
+
+class RateLimiter:
+    """
+    Token buckets keyed by a string, stored as one float per key: the time
+    at which the key's bucket is full again (GCRA). Not thread-safe; used
+    from the event loop.
+
+    Args:
+        rate (float): Tokens added per second.
+        burst (float): Bucket capacity.
+        max_keys (int): Buckets kept before full ones are dropped.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.interval = 1.0 / rate
+        self.burst = burst
+        self.tolerance = burst * self.interval
+        self.max_keys = max_keys
+        self._full_at = {}
+
+    def wait(self, key: str, cost: float, now: float) -> float:
+        """
+        Seconds until `key` can spend `cost` tokens (0 if it can now). A cost
+        above the burst is capped, so large requests need a full bucket.
+        """
+        full_at = max(self._full_at.get(key, now), now)
+        return max(0.0, full_at + min(cost, self.burst) * self.interval - now - self.tolerance)
+
+    def spend(self, key: str, cost: float, now: float):
+        self._full_at[key] = max(self._full_at.get(key, now), now) + min(cost, self.burst) * self.interval
+        if len(self._full_at) > self.max_keys:
+            self._prune(now)
+
+    def _prune(self, now: float):
+        # A full bucket is the same as no bucket
+        self._full_at = {key: t for key, t in self._full_at.items() if t > now}
+        excess = len(self._full_at) - int(self.max_keys * 0.9)
+        if excess > 0:
+            # Still too many active clients: forget the oldest keys (their
+            # buckets start full again)
+            for key in list(self._full_at)[:excess]:
+                del self._full_at[key]
+
+    def level(self, key: str, now: float) -> float:
+        """
+        Fraction of the key's bucket that is left (1.0 when full).
+        """
+        full_at = self._full_at.get(key, now)
+        return min(1.0, max(0.0, 1.0 - (full_at - now) / self.tolerance))
+
+    def __len__(self):
+        return len(self._full_at)
+
+
+class AdmissionControl:
+    """
+    Rate limits, load shedding and the adaptive concurrency limit shared by
+    `AdmissionMiddleware` and the WebSocket endpoint.
+
+    Args:
+        max_inflight (int): Upper bound of the concurrency limit.
+        min_inflight (int): Lower bound of the concurrency limit.
+        latency_ms (float): Request latency (per token of cost) above which
+                            the limit is cut.
+        backoff (float): Factor applied to the limit on a slow request.
+        queue_high (float): Queue fill fraction above which requests are shed.
+        max_waiting (int): Requests that may wait for a slot.
+        queue_timeout_ms (float): How long a request may wait for a slot.
+    """
+
+    def __init__(self, max_inflight: int = ADMISSION_MAX_INFLIGHT, min_inflight: int = ADMISSION_MIN_INFLIGHT,
+                 latency_ms: float = ADMISSION_LATENCY_MS, backoff: float = ADMISSION_BACKOFF,
+                 queue_high: float = ADMISSION_QUEUE_HIGH, max_waiting: int = ADMISSION_MAX_WAITING,
+                 queue_timeout_ms: float = ADMISSION_QUEUE_TIMEOUT_MS):
+        self.enabled = ADMISSION_ENABLED
+        self.by_ip = RateLimiter(RATE_LIMIT_IP_RPS, RATE_LIMIT_IP_BURST)
+        self.by_token = RateLimiter(RATE_LIMIT_TOKEN_RPS, RATE_LIMIT_TOKEN_BURST)
+        self.max_inflight = max_inflight
+        self.min_inflight = min(min_inflight, max_inflight)
+        self.latency = latency_ms / 1000
+        self.backoff = backoff
+        self.queue_high = queue_high
+        self.queues = ()
+        self.max_waiting = max_waiting
+        self.queue_timeout = queue_timeout_ms / 1000
+        self._waiters = collections.deque()  # futures of requests waiting for a slot
+        self.limit = float(max_inflight)
+        self.inflight = 0
+        self._last_cut = 0.0
+        self.admitted = 0
+        self.rejected = {"too_large": 0, "rate_ip": 0, "rate_token": 0, "busy": 0, "timeout": 0, "queue": 0}
+
+    def watch(self, *queues):
+        """
+        Shed load when any of these queues (with `stats()` reporting depth
+        and capacity) is more than `queue_high` full.
+        """
+        self.queues = queues
+
+    def rate_limit(self, ip: str, token: str, cost: float = 1.0):
+        """
+        Spend `cost` tokens from the IP's and the token's buckets if both have
+        them. Returns None, or (reason, seconds to wait) without spending.
+        """
+        now = time.monotonic()
+        checks = [("rate_ip", self.by_ip, ip)]
+        if token:
+            checks.append(("rate_token", self.by_token, token))
+        for reason, limiter, key in checks:
+            wait = limiter.wait(key, cost, now)
+            if wait > 0:
+                self.rejected[reason] += 1
+                return reason, wait
+        for _, limiter, key in checks:
+            limiter.spend(key, cost, now)
+        return None
+
+    async def acquire(self, ip: str, token: str = None):
+        """
+        Take an in-flight slot. Returns None, or the reason the request is shed.
+
+        At the concurrency limit, a client with at least half of its buckets
+        left waits (first come, first served) up to `queue_timeout` for a
+        slot; other clients are shed at once.
+        """
+        for queue in self.queues:
+            stats = queue.stats()
+            if stats["capacity"] and stats["depth"] >= self.queue_high * stats["capacity"]:
+                self.rejected["queue"] += 1
+                return "queue"
+        if self.inflight < int(self.limit) and not self._waiters:
+            self.inflight += 1
+            self.admitted += 1
+            return None
+        if len(self._waiters) >= self.max_waiting or not self._light(ip, token):
+            self.rejected["busy"] += 1
+            return "busy"
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.cancelled():  # not handed a slot in time
+                if waiter in self._waiters:  # `_free` drops cancelled waiters it meets
+                    self._waiters.remove(waiter)
+                self.rejected["timeout"] += 1
+                return "timeout"
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._free()  # handed a slot, but the request is gone
+            raise
+        self.admitted += 1  # the slot was handed over by `_free`
+        return None
+
+    def _light(self, ip: str, token: str) -> bool:
+        # A client with at least half of its buckets left
+        now = time.monotonic()
+        return self.by_ip.level(ip, now) >= 0.5 and (not token or self.by_token.level(token, now) >= 0.5)
+
+    def release(self, elapsed: float, cost: float = 1.0):
+        """
+        Adapt the limit to a finished request's latency, then free its slot.
+        The limit is cut at most once per latency target (so one burst of
+        slow requests counts once) and grows by 1 / limit otherwise.
+        """
+        if elapsed / cost > self.latency:
+            now = time.monotonic()
+            if now - self._last_cut >= self.latency:
+                self._last_cut = now
+                self.limit = max(self.min_inflight, self.limit * self.backoff)
+        else:
+            self.limit = min(self.max_inflight, self.limit + 1 / self.limit)
+
+        self._free()
+
+    def _free(self):
+        # Hand free slots to the oldest waiting requests
+        self.inflight -= 1
+        while self._waiters and self.inflight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self.inflight += 1
+
+    def allow_message(self, ip: str, token: str):
+        """
+        Rate limit one WebSocket message. Returns seconds to wait (0 if allowed).
+        """
+        if not self.enabled:
+            return 0.0
+        limited = self.rate_limit(ip, token)
+        return limited[1] if limited else 0.0
+
+    def stats(self) -> dict:
+        """
+        Return the concurrency limit, in-flight count and rejection counters.
+        """
+        return {
+            "enabled": self.enabled,
+            "inflight": self.inflight,
+            "waiting": len(self._waiters),
+            "limit": round(self.limit, 2),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "ip_buckets": len(self.by_ip),
+            "token_buckets": len(self.by_token),
+        }
+
+
+# Shared instance used by the middleware and /ws/sentiment
+admission = AdmissionControl()
+
+
+async def _reject(send, status: int, message: str, retry_after: float = None):
+    headers = [(b"content-type", b"application/json")]
+    if retry_after is not None:
+        headers.append((b"retry-after", str(max(1, math.ceil(retry_after))).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": json.dumps({"error": message}).encode()})
+
+
+class AdmissionMiddleware:
+    """
+    Pure ASGI middleware applying `admission` to the scoring endpoints (see
+    the module docstring). Other paths pass straight through.
+    """
+
+    def __init__(self, app, control: AdmissionControl = admission):
+        self.app = app
+        self.control = control
+
+    async def __call__(self, scope, receive, send):
+        control = self.control
+        path = scope.get("path")
+        if not control.enabled or scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        if scope["type"] == "websocket":
+            if path in ADMISSION_WEBSOCKETS and control.rate_limit(*self._keys(scope)):
+                await send({"type": "websocket.close", "code": 1013})  # try again later
+                return
+            await self.app(scope, receive, send)
+            return
+        max_body = ADMISSION_PATHS.get(path)
+        if max_body is None or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        length = None
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit():
+                length = int(value)
+        if length is not None and length > max_body:
+            control.rejected["too_large"] += 1
+            await _reject(send, 413, f"Request body too large (max {max_body} bytes).")
+            return
+
+        ip, token = self._keys(scope)
+        if path == "/sentiment":
+            # The form carries the token: read it here (it is small) and replay it
+            body = await self._read_form(receive, max_body)
+            if body is None:
+                control.rejected["too_large"] += 1
+                await _reject(send, 413, f"Request body too large (max {max_body} bytes).")
+                return
+            token = token or self._form_token(scope, body)
+            receive = self._replay(body, receive)
+        else:
+            receive = self._capped(receive, max_body)
+
+        cost = 1 + (length or 0) // ADMISSION_BYTES_PER_TOKEN
+        limited = control.rate_limit(ip, token, cost)
+        if limited:
+            await _reject(send, 429, "Rate limit exceeded.", retry_after=limited[1])
+            return
+        if await control.acquire(ip, token):
+            await _reject(send, 503, "Server busy, try again later.", retry_after=ADMISSION_RETRY_AFTER)
+            return
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            control.release(time.perf_counter() - start, cost)
+
+    @staticmethod
+    def _keys(scope):
+        """
+        Return (client IP, session token from the query string or None).
+        """
+        client = scope.get("client")
+        ip = client[0] if client else ""
+        token = None
+        if b"token=" in scope.get("query_string", b""):
+            token = parse_qs(scope["query_string"].decode("latin-1")).get("token", [None])[0]
+        return ip, token
+
+    @staticmethod
+    async def _read_form(receive, max_body: int):
+        """
+        Read a whole request body, or return None once it exceeds `max_body`.
+        """
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            size += len(chunks[-1])
+            if size > max_body:
+                return None
+            if not message.get("more_body"):
+                break
+        return b"".join(chunks)
+
+    @staticmethod
+    def _form_token(scope, body: bytes):
+        for name, value in scope["headers"]:
+            if name == b"content-type" and value.startswith(b"application/x-www-form-urlencoded"):
+                return parse_qs(body.decode("utf-8", "replace")).get("token", [None])[0]
+        return None
+
+    @staticmethod
+    def _replay(body: bytes, receive):
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if replayed:
+                return await receive()
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        return replay
+
+    def _capped(self, receive, max_body: int):
+        # Bodies without (or with a wrong) Content-Length stop at the limit
+        received = 0
+
+        async def capped():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body:
+                    self.control.rejected["too_large"] += 1
+                    raise BodyTooLarge(max_body)
+            return message
+
+        return capped
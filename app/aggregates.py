@@ -0,0 +1,52 @@
+"""
+Hooks that keep the derived tables (map cells, sentiment rollups) in step with
+the queries table. They run inside the caller's transaction, so the aggregates
+commit or roll back together with the rows they describe.
+
+Rows are passed as dicts with the Query column values (see `query_values`).
+The same deltas are staged for live subscribers and sent after the commit.
+"""
+from sqlalchemy.orm import Session
+from mapdata import add_points, remove_points
+from rollups import record, unrecord
+from live import stage_deleted, stage_located, stage_saved
+
+AGGREGATE_COLUMNS = ("user_id", "time", "score", "sentiment", "latitude", "longitude", "country")
+
+
+def query_values(query) -> dict:
+    """
+    Extract the columns the aggregates need from a Query object or row.
+    """
+    return {name: getattr(query, name) for name in AGGREGATE_COLUMNS}
+
+
+def _points(rows):
+    return [(row["latitude"], row["longitude"], row["score"]) for row in rows]
+
+
+def on_queries_saved(db: Session, rows):
+    """
+    New queries were inserted (located or not).
+    """
+    add_points(db, _points(rows))  # unlocated rows are skipped
+    record(db, rows)  # the country scope is skipped for rows without a country
+    stage_saved(db, rows)
+
+
+def on_queries_located(db: Session, rows):
+    """
+    Previously saved queries just received their location (background enrichment).
+    """
+    add_points(db, _points(rows))
+    record(db, rows, scopes=("country",))
+    stage_located(db, rows)
+
+
+def on_queries_deleted(db: Session, rows):
+    """
+    Queries were deleted; call after the DELETE has been flushed.
+    """
+    remove_points(db, _points(rows))
+    unrecord(db, rows)
+    stage_deleted(db, rows)
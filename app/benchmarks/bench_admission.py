@@ -0,0 +1,175 @@
+"""
+Admission control benchmark: well-behaved clients under overload.
+
+Runs the FastAPI app in-process (like `benchmarks.bench_load`: lifespan,
+fresh SQLite database, geolocation stubbed) and drives POST /sentiment from
+httpx clients over `ASGITransport`, each with its own session token and IP.
+
+- steady: `--clients` well-behaved clients, each sending `--rate` requests
+  per second (open loop), alone;
+- flood: the same, plus one client with one token and one IP sending
+  `--flood-rate` requests per second (open loop, ignoring Retry-After);
+- crowd: `--crowd` clients with distinct tokens and IPs, each sending
+  back-to-back requests and honouring Retry-After (most stay within their
+  own rate, so only load shedding can protect latency).
+
+The flood and crowd phases run with admission control off and on. The
+report gives, per phase, the well-behaved clients' successful requests per
+second and their latency, and the status counts of the other requests with
+the phase's wall time (which includes draining the accepted backlog).
+Client and server share the process (and CPU), so a flood also costs the
+client side.
+
+The database URL is read when `database` is first imported, so this must
+run in its own process. Run from the `app` directory:
+
+    python -m benchmarks.bench_admission [--clients 8] [--rate 5] [--duration 5] [--json results.json]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from benchmarks.common import percentile, print_results, save_results
+
+STUB_LOCATION = {"lat": 37.77, "lon": -122.42, "country": "United States", "region": "California", "city": "San Francisco"}
+
+
+def make_client(httpx, app, ip: str):
+    transport = httpx.ASGITransport(app=app, client=(ip, 1234))
+    return httpx.AsyncClient(transport=transport, base_url="http://bench")
+
+
+async def post(client, token: str, i: int):
+    return await client.post("/sentiment", data={"text": f"admission test text number {i} is great", "token": token})
+
+
+async def paced(client, token: str, rate: float, until: float, latencies: list, statuses: Counter):
+    """
+    Send `rate` requests per second until `until`, whatever their latency.
+    """
+    async def one(i):
+        start = time.perf_counter()
+        response = await post(client, token, i)
+        statuses[response.status_code] += 1
+        if response.status_code == 200:
+            latencies.append(time.perf_counter() - start)
+
+    tasks, i = [], 0
+    next_at = time.perf_counter()
+    while next_at < until:
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+        tasks.append(asyncio.create_task(one(i)))
+        i += 1
+        next_at += 1 / rate
+    await asyncio.gather(*tasks)
+
+
+async def back_to_back(client, token: str, until: float, statuses: Counter, retry: bool = False):
+    """
+    Send requests one after the other until `until`; with `retry`, wait for
+    the Retry-After of a refused request before the next one.
+    """
+    i = 0
+    while time.perf_counter() < until:
+        response = await post(client, token, i)
+        statuses[response.status_code] += 1
+        if retry and "retry-after" in response.headers:
+            await asyncio.sleep(min(float(response.headers["retry-after"]), until - time.perf_counter()))
+        i += 1
+
+
+def summary(latencies, statuses: Counter, duration: float) -> dict:
+    result = {"ok_per_s": round(len(latencies) / duration, 2)}
+    if latencies:
+        result.update(p50_ms=round(percentile(latencies, 50) * 1000, 2), p99_ms=round(percentile(latencies, 99) * 1000, 2))
+    result.update({f"http_{status}": count for status, count in sorted(statuses.items())})
+    return result
+
+
+async def run_admission(clients: int, rate: float, duration: float, flood_rate: float, crowd: int) -> dict:
+    import httpx
+    import crud
+    import database
+    import enrichment
+    from admission import admission
+    from benchmarks.datagen import generate
+    from main import app
+
+    crud.ip_to_location = enrichment.ip_to_location = lambda ip: STUB_LOCATION
+    tokens = [token for _, token in generate(database.engine, 2000, users=clients + crowd + 1)]
+    good = [(make_client(httpx, app, f"198.51.100.{i + 1}"), tokens[i]) for i in range(clients)]
+    flooder = (make_client(httpx, app, "203.0.113.66"), tokens[clients])
+    crowd_clients = [
+        (make_client(httpx, app, f"10.{i // 250}.{i % 250}.1"), tokens[clients + 1 + i]) for i in range(crowd)
+    ]
+
+    async def phase(name: str, flood: bool = False, crowded: bool = False, enabled: bool = True):
+        admission.enabled = enabled
+        admission.limit = admission.max_inflight
+        admission.by_ip._full_at.clear()
+        admission.by_token._full_at.clear()
+        latencies, statuses, others = [], Counter(), Counter()
+        start = time.perf_counter()
+        until = start + duration
+        work = [paced(client, token, rate, until, latencies, statuses) for client, token in good]
+        if flood:
+            work.append(paced(*flooder, flood_rate, until, [], others))
+        if crowded:
+            work += [back_to_back(client, token, until, others, retry=True) for client, token in crowd_clients]
+        await asyncio.gather(*work)
+        result = {f"admission.{name}.good": summary(latencies, statuses, duration)}
+        if others:
+            # Wall time includes draining the requests accepted during the phase
+            result[f"admission.{name}.others"] = {
+                "elapsed_s": round(time.perf_counter() - start, 2),
+                **{f"http_{s}": n for s, n in sorted(others.items())},
+            }
+        return result
+
+    results = {}
+    async with app.router.lifespan_context(app):
+        await phase("warmup", enabled=False)
+        results.update(await phase("1_steady"))
+        results.update(await phase("2_flood_off", flood=True, enabled=False))
+        results.update(await phase("3_flood_on", flood=True))
+        results.update(await phase("4_crowd_off", crowded=True, enabled=False))
+        results.update(await phase("5_crowd_on", crowded=True))
+        results.pop("admission.warmup.good", None)
+    for client, _ in good + crowd_clients + [flooder]:
+        await client.aclose()
+    return results
+
+
+def run(clients: int = 8, rate: float = 5, duration: float = 5, flood_rate: float = 1000, crowd: int = 200) -> dict:
+    """
+    Run the benchmark against a temporary database and return the results by name.
+    """
+    if "database" in sys.modules:
+        raise RuntimeError("bench_admission must run in its own process (the database URL is already fixed)")
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'admission.db')}"
+        return asyncio.run(run_admission(clients, rate, duration, flood_rate, crowd))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=8, help="well-behaved clients")
+    parser.add_argument("--rate", type=float, default=5, help="requests per second per well-behaved client")
+    parser.add_argument("--duration", type=float, default=5, help="seconds per phase")
+    parser.add_argument("--flood-rate", type=float, default=1000, help="requests per second of the flooding client")
+    parser.add_argument("--crowd", type=int, default=200, help="clients in the crowd phase")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = run(args.clients, args.rate, args.duration, args.flood_rate, args.crowd)
+    print_results(results)
+    if args.json:
+        save_results(args.json, results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""
+Micro-benchmark for `sentiment.clean_text`.
+
+Reports the throughput in MB/s of the single-pass normalizer and of the
+original three-regex implementation on a synthetic corpus. (tests/test_textnorm.py
+checks that both give the same output.)
+
+Run from the `app` directory:
+
+    python -m benchmarks.bench_clean_text [--texts 20000] [--repeat 5]
+"""
+import argparse
+import random
+import re
+import sys
+import time
+
+from sentiment import clean_text
+
+
+def legacy_clean_text(text: str) -> str:
+    """
+    The original three-pass `clean_text`, kept as the reference implementation.
+    """
+    text = text.strip()
+    text = re.sub(r"http\S+|www\S+", "", text)
+    text = re.sub(r"([!?.,])\1{2,}", r"\1\1", text)
+    text = re.sub(r"(.)\1{2,}", r"\1\1", text)
+    return text
+
+
+WORDS = [
+    "love", "hate", "great", "terrible", "this", "is", "so", "sooooo", "good",
+    "baaaad", "wow", "!!!", "???", "...", "meh", "happy", "sad", "the", "product",
+    "https://example.com/a?b=1", "www.example.org", "hhhttp://x.io", ":)", ":(",
+    "okkkk", "   ", "yesss!!!!", "no,,,,", "\t", "\n",
+]
+
+
+def make_corpus(n: int, seed: int = 42):
+    """
+    Generate `n` tweet-like texts plus a few long documents.
+    """
+    rng = random.Random(seed)
+    corpus = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 40))) for _ in range(n)]
+    corpus += [" ".join(rng.choice(WORDS) for _ in range(20000)) for _ in range(max(1, n // 1000))]
+
+    # Random strings over a small alphabet hit the edge cases (runs next to URLs, joins)
+    alphabet = "hhttpw.:/ !?,a\n\t"
+    corpus += ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40))) for _ in range(n)]
+    return corpus
+
+
+def throughput(func, corpus, repeat: int) -> float:
+    """
+    Best-of-`repeat` throughput of `func` over the corpus, in MB/s.
+    """
+    size_mb = sum(len(text.encode("utf-8")) for text in corpus) / 1e6
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in corpus:
+            func(text)
+        best = min(best, time.perf_counter() - start)
+    return size_mb / best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=20000, help="number of short texts to generate")
+    parser.add_argument("--repeat", type=int, default=5, help="timing repetitions (best is reported)")
+    args = parser.parse_args(argv)
+
+    corpus = make_corpus(args.texts)
+    legacy = throughput(legacy_clean_text, corpus, args.repeat)
+    current = throughput(clean_text, corpus, args.repeat)
+    print(f"legacy clean_text : {legacy:8.2f} MB/s")
+    print(f"clean_text        : {current:8.2f} MB/s  ({current / legacy:.2f}x)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Database benchmarks at several table sizes.
+
+For each size a fresh SQLite database (tuned profile) is filled by
+`benchmarks.datagen`, then the benchmark times:
+- `crud.save_query` (direct path, one commit per query, geolocation stubbed);
+- `crud.chat_history`, first page and the last page of a user's history;
+- the `/sentiment-map` reads: the points of one city's bounding box, and
+  the clustered world and city views.
+
+Run from the `app` directory (1M rows takes a few minutes to generate):
+
+    python -m benchmarks.bench_db [--sizes 10000,100000,1000000] [--json results.json]
+"""
+import argparse
+import os
+import sys
+import tempfile
+from sqlalchemy import func
+from sqlalchemy.orm import sessionmaker
+import crud
+from benchmarks.common import measure, print_results, save_results
+from benchmarks.datagen import CITIES, generate
+from database import Query, make_engine
+from mapdata import clusters, point_dict, points_query
+
+SAMPLE_DETAILS = {"neg": 0.0, "neu": 0.4, "pos": 0.6, "compound": 0.6249}
+STUB_LOCATION = {"lat": 37.77, "lon": -122.42, "country": "United States", "region": "California", "city": "San Francisco"}
+
+
+def size_label(rows: int) -> str:
+    return f"{rows // 1000000}m" if rows >= 1000000 and rows % 1000000 == 0 else f"{rows // 1000}k"
+
+
+def city_bbox(index: int = 0, radius: float = 0.5):
+    _, _, lat, lon = CITIES[index]
+    return lon - radius, lat - radius, lon + radius, lat + radius
+
+
+def run_size(path: str, rows: int, iterations: int) -> dict:
+    """
+    Generate `rows` queries in a new database at `path` and benchmark it.
+    """
+    engine = make_engine(f"sqlite:///{path}")
+    users = generate(engine, rows)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    label = size_label(rows)
+    results = {}
+
+    db = Session()
+    try:
+        # Busiest user, for the deepest history
+        user_id, count = (
+            db.query(Query.user_id, func.count()).group_by(Query.user_id).order_by(func.count().desc()).first()
+        )
+        token = dict(users)[user_id]
+        record = crud.resolve_token(db, token)
+
+        crud.ip_to_location = lambda ip: STUB_LOCATION
+        results[f"db.save_query.{label}"] = measure(
+            lambda i: crud.save_query(db, record, f"benchmark text {i}", "Positive", 0.6249, "203.0.113.9", 0.625, SAMPLE_DETAILS),
+            iterations, warmup=10,
+        )
+
+        results[f"db.history_first.{label}"] = measure(lambda i: crud.chat_history(db, token), iterations, warmup=10)
+
+        offset = max(0, count + iterations + 10 - crud.HISTORY_PAGE_SIZE - 1)
+        last = (
+            db.query(Query.time, Query.id).filter(Query.user_id == user_id)
+            .order_by(Query.time.desc(), Query.id.desc()).offset(offset).first()
+        )
+        cursor = crud.encode_history_cursor(last.time, last.id)
+        results[f"db.history_last.{label}"] = measure(lambda i: crud.chat_history(db, token, cursor=cursor), iterations, warmup=10)
+
+        bbox = city_bbox()
+        few = max(3, iterations // 20)
+        results[f"db.map_points_bbox.{label}"] = measure(
+            lambda i: [point_dict(row) for row in points_query(db, bbox)], few, warmup=1
+        )
+        results[f"db.map_clusters_world.{label}"] = measure(lambda i: clusters(db, 3), iterations, warmup=5)
+        results[f"db.map_clusters_city.{label}"] = measure(lambda i: clusters(db, 10, bbox), iterations, warmup=5)
+    finally:
+        db.close()
+        engine.dispose()
+    return results
+
+
+def run(sizes=(10000, 100000), iterations: int = 200) -> dict:
+    """
+    Run the DB benchmarks at each size and return their results by name.
+    """
+    ip_to_location = crud.ip_to_location
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for rows in sizes:
+                results.update(run_size(os.path.join(tmp, f"bench-{rows}.db"), rows, iterations))
+    finally:
+        crud.ip_to_location = ip_to_location
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma-separated table sizes")
+    parser.add_argument("--iterations", type=int, default=200, help="timed calls per benchmark")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = run([int(size) for size in args.sizes.split(",")], args.iterations)
+    print_results(results)
+    if args.json:
+        save_results(args.json, results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Group-commit benchmark: per-request commits vs the batching query writer.
+
+Concurrent threads save queries through `crud.save_query`, first with one
+commit per query ("direct"), then through `writer.query_writer` ("batched",
+each caller still waits for its batch to commit). Both runs use a fresh
+SQLite database with the tuned profile; pass --synchronous FULL to fsync
+every commit.
+
+Run from the `app` directory:
+
+    python -m benchmarks.bench_group_commit [--threads 32] [--rows 5000] [--synchronous FULL]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+import crud
+from database import SQLITE_PRAGMAS, Query, make_engine
+from migrations import migrate
+from writer import query_writer
+
+SAMPLE_DETAILS = {"neg": 0.0, "neu": 0.4, "pos": 0.6, "compound": 0.6249}
+
+
+def run(engine, threads: int, rows: int, batched: bool) -> float:
+    """
+    Save `rows` queries from `threads` threads; return rows per second.
+    """
+    migrate(engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = Session()
+    user = crud.create_user(db, f"bench-{time.time_ns()}", "127.0.0.1")
+    db.close()
+
+    if batched:
+        query_writer.session_factory = Session
+        query_writer.start()
+
+    def worker(count):
+        db = Session()
+        try:
+            for i in range(count):
+                crud.save_query(db, user, f"benchmark text {i}", "Positive", 0.6249, "127.0.0.1", 0.625, SAMPLE_DETAILS)
+        finally:
+            db.close()
+
+    per_thread = [rows // threads + (1 if t < rows % threads else 0) for t in range(threads)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(worker, per_thread))
+    elapsed = time.perf_counter() - start
+
+    if batched:
+        query_writer.stop()
+
+    with engine.connect() as conn:
+        stored = conn.execute(select(func.count()).select_from(Query)).scalar()
+    assert stored == rows, f"expected {rows} rows, found {stored}"
+    return rows / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=32, help="concurrent request threads")
+    parser.add_argument("--rows", type=int, default=5000, help="queries to save per run")
+    parser.add_argument("--synchronous", default=SQLITE_PRAGMAS["synchronous"], help="SQLite synchronous pragma")
+    args = parser.parse_args(argv)
+
+    crud.WRITE_DURABILITY = "commit"
+    pragmas = dict(SQLITE_PRAGMAS, synchronous=args.synchronous)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, batched in (("direct", False), ("batched", True)):
+            engine = make_engine(f"sqlite:///{os.path.join(tmp, name + '.db')}", sqlite_pragmas=pragmas)
+            results[name] = run(engine, args.threads, args.rows, batched)
+            engine.dispose()
+
+    print(f"{args.rows} saves, {args.threads} threads, synchronous={args.synchronous}")
+    for name, rate in results.items():
+        print(f"{name:<8} {rate:10.0f} rows/s")
+    print(f"speedup  {results['batched'] / results['direct']:10.1f}x")
+    stats = query_writer.stats()
+    print(f"batches  {stats['batches']:10d} (mean {stats['mean_batch']} rows, max {stats['max_batch']})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
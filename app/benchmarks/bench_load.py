@@ -0,0 +1,110 @@
+"""
+In-process ASGI load test for the main endpoints.
+
+Runs the FastAPI app (including its lifespan: migrations, query writer,
+geo queue) against a fresh SQLite database filled by `benchmarks.datagen`,
+and drives it with concurrent httpx clients over `ASGITransport`, so no
+server or network is involved. Geolocation is stubbed out, and admission
+control is off (see `benchmarks.bench_admission`).
+
+For each of /sentiment, /history, /trend and /sentiment-map, `--requests`
+requests are sent by `--concurrency` workers; the report gives requests
+per second and p50/p95/p99 latency.
+
+The database URL is read when `database` is first imported, so this must
+run in its own process. Run from the `app` directory:
+
+    python -m benchmarks.bench_load [--rows 10000] [--requests 2000] [--concurrency 32] [--json results.json]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from benchmarks.common import print_results, save_results, summarize
+
+STUB_LOCATION = {"lat": 37.77, "lon": -122.42, "country": "United States", "region": "California", "city": "San Francisco"}
+
+
+async def drive(client, make_request, requests: int, concurrency: int):
+    """
+    Send `requests` requests from `concurrency` workers; return (latencies, elapsed).
+    """
+    latencies = []
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            start = time.perf_counter()
+            response = await make_request(client, i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{response.request.url.path} returned {response.status_code}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start
+
+
+async def run_load(rows: int, requests: int, concurrency: int) -> dict:
+    import httpx
+    import crud
+    import database
+    import enrichment
+    from benchmarks.datagen import generate
+    from benchmarks.bench_db import city_bbox
+    from main import app
+
+    crud.ip_to_location = enrichment.ip_to_location = lambda ip: STUB_LOCATION
+    tokens = [token for _, token in generate(database.engine, rows)]
+    west, south, east, north = city_bbox()
+    bbox = f"{west},{south},{east},{north}"
+
+    endpoints = {
+        "/sentiment": lambda c, i: c.post("/sentiment", data={"text": f"load test text number {i} is great", "token": tokens[i % len(tokens)]}),
+        "/history": lambda c, i: c.get("/history", params={"token": tokens[i % len(tokens)]}),
+        "/trend": lambda c, i: c.get("/trend", params={"token": tokens[i % len(tokens)]}),
+        "/sentiment-map": lambda c, i: c.get("/sentiment-map", params={"bbox": bbox}),
+    }
+
+    results = {}
+    transport = httpx.ASGITransport(app=app, client=("203.0.113.9", 123))
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for path, make_request in endpoints.items():
+                await drive(client, make_request, min(concurrency, requests), concurrency)  # warm-up
+                latencies, elapsed = await drive(client, make_request, requests, concurrency)
+                results[f"load{path.replace('/', '.')}"] = summarize(latencies, elapsed)
+    return results
+
+
+def run(rows: int = 10000, requests: int = 2000, concurrency: int = 32) -> dict:
+    """
+    Run the load test against a temporary database and return the results by name.
+    """
+    if "database" in sys.modules:
+        raise RuntimeError("bench_load must run in its own process (the database URL is already fixed)")
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'load.db')}"
+        os.environ["ADMISSION_ENABLED"] = "0"  # one client IP: measure capacity, not the rate limits
+        return asyncio.run(run_load(rows, requests, concurrency))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000, help="queries in the database before the run")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent clients")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = run(args.rows, args.requests, args.concurrency)
+    print_results(results)
+    if args.json:
+        save_results(args.json, results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
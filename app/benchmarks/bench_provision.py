@@ -0,0 +1,100 @@
+"""
+Bulk provisioning benchmark: `provision_users` against one `create_user`
+commit per user.
+
+On a fresh SQLite database (tuned profile) for each size, the benchmark times:
+- `crud.create_user` in a loop, for `--baseline-users` users;
+- `provision_users` creating every user in one transaction;
+- the same input again, now all existing (skipped after the `IN` lookup);
+- the same input with `on_existing="rotate"` (every user gets a new token).
+
+A separate traced pass records the peak Python memory of a run that streams
+its input and discards the results, which should not grow with the size.
+
+Run from the `app` directory:
+
+    python -m benchmarks.bench_provision [--sizes 10000,100000] [--baseline-users 2000] [--json results.json]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+from sqlalchemy.orm import sessionmaker
+import crud
+from benchmarks.common import print_results, save_results
+from benchmarks.bench_db import size_label
+from database import make_engine
+from migrations import migrate
+from provisioning import provision_users
+
+
+def usernames(count: int, prefix: str = "user"):
+    return (f"{prefix}{i}" for i in range(count))
+
+
+def timed(fn, count: int) -> dict:
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    return {"ops_per_s": round(count / elapsed, 2), "elapsed_s": round(elapsed, 3)}
+
+
+def fresh_session(tmp: str, name: str):
+    engine = make_engine(f"sqlite:///{os.path.join(tmp, name)}")
+    migrate(engine)
+    return engine, sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+
+def run(sizes, baseline_users: int = 2000) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, db = fresh_session(tmp, "baseline.db")
+
+        def one_by_one():
+            for username in usernames(baseline_users):
+                crud.create_user(db, username, ip_address=None)
+
+        results["provision.create_user_loop"] = timed(one_by_one, baseline_users)
+        db.close()
+        engine.dispose()
+
+        for size in sizes:
+            label = size_label(size)
+            engine, db = fresh_session(tmp, f"bulk-{label}.db")
+            for case, on_existing in (("create", "skip"), ("existing", "skip"), ("rotate", "rotate")):
+                results[f"provision.{label}.{case}"] = timed(
+                    lambda: deque(provision_users(db, usernames(size), on_existing), maxlen=0), size
+                )
+            db.close()
+            engine.dispose()
+
+            engine, db = fresh_session(tmp, f"traced-{label}.db")
+            tracemalloc.start()
+            deque(provision_users(db, usernames(size)), maxlen=0)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[f"provision.{label}.memory"] = {"peak_mib": round(peak / 2 ** 20, 2)}
+            db.close()
+            engine.dispose()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000", help="comma-separated user counts")
+    parser.add_argument("--baseline-users", type=int, default=2000, help="users created one commit at a time")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = run([int(n) for n in args.sizes.split(",")], args.baseline_users)
+    print_results(results)
+    if args.json:
+        save_results(args.json, results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
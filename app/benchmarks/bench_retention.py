@@ -0,0 +1,120 @@
+"""
+Database size and read latency before and after compaction and retention.
+
+A fresh SQLite database is filled by `benchmarks.datagen` (queries spread
+over the last 30 days) and measured in three states:
+
+- legacy: the sentiment breakdown stored as a `details` JSON column (the
+  layout before migration 5);
+- compacted: after migration 5's step (pos/neg/neu float columns, `details`
+  dropped) and a VACUUM;
+- retained: after a retention pass with `--days`, `--max-per-user` and
+  `--minute-rollup-days` (rows archived to gzip NDJSON, old minute rollup
+  buckets deleted), ANALYZE and VACUUM.
+
+Each state reports the file size and row count, and times the first
+history page of the busiest user, `/analytics` over the whole table and
+the global daily trend (served from the rollups, so it is unaffected).
+
+Run from the `app` directory:
+
+    python -m benchmarks.bench_retention [--rows 200000] [--days 7] [--max-per-user 0]
+        [--minute-rollup-days 2] [--json results.json]
+"""
+import argparse
+import os
+import sys
+import tempfile
+from sqlalchemy import func, text
+from sqlalchemy.orm import sessionmaker
+import crud
+from benchmarks.common import measure, print_results, save_results
+from benchmarks.datagen import generate
+from database import Query, make_engine
+from export import analytics
+from migrations import _compact_details
+from retention import RetentionJob, vacuum
+from rollups import trend_series
+
+
+def legacy_layout(engine):
+    """
+    Move the breakdown back into a `details` JSON column, as before migration 5.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE queries ADD COLUMN details JSON"))
+        conn.execute(text(
+            "UPDATE queries SET details = json_object('neg', neg, 'neu', neu, 'pos', pos, 'compound', score), "
+            "pos = NULL, neg = NULL, neu = NULL"
+        ))
+    vacuum(engine)
+
+
+def measure_state(engine, path: str, label: str, iterations: int) -> dict:
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = Session()
+    try:
+        rows = db.query(func.count(Query.id)).scalar()
+        user_id = db.query(Query.user_id).group_by(Query.user_id).order_by(func.count().desc()).limit(1).scalar()
+        few = max(3, iterations // 20)
+        return {
+            f"retention.{label}.size": {"db_mib": round(os.path.getsize(path) / 2 ** 20, 2), "rows": rows},
+            f"retention.{label}.history_first": measure(lambda i: crud.history_page(db, user_id), iterations, warmup=5),
+            f"retention.{label}.analytics": measure(lambda i: analytics(db, []), few, warmup=1),
+            f"retention.{label}.trend_day": measure(
+                lambda i: trend_series(db, "global", "", "day"), iterations, warmup=5
+            ),
+        }
+    finally:
+        db.close()
+
+
+def run(rows: int = 200000, days: float = 7, max_per_user: int = 0, minute_rollup_days: float = 2,
+        iterations: int = 100) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "retention.db")
+        engine = make_engine(f"sqlite:///{path}")
+        generate(engine, rows)
+
+        legacy_layout(engine)
+        results.update(measure_state(engine, path, "1_legacy", iterations))
+
+        with engine.begin() as conn:
+            _compact_details(conn)
+        vacuum(engine)
+        results.update(measure_state(engine, path, "2_compacted", iterations))
+
+        Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        job = RetentionJob(session_factory=Session, bind=engine, max_age_days=days, max_per_user=max_per_user,
+                           minute_rollup_days=minute_rollup_days, archive_dir=os.path.join(tmp, "archive"))
+        job.run_once(force_maintenance=True)
+        results.update(measure_state(engine, path, "3_retained", iterations))
+
+        archive_bytes = sum(entry.stat().st_size for entry in os.scandir(os.path.join(tmp, "archive")))
+        results["retention.3_retained.archive"] = {
+            "archive_mib": round(archive_bytes / 2 ** 20, 2), "rows": job.archived, "rollups_pruned": job.rollups_pruned,
+        }
+        engine.dispose()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000, help="queries to generate (over 30 days)")
+    parser.add_argument("--days", type=float, default=7, help="retention age limit in days")
+    parser.add_argument("--max-per-user", type=int, default=0, help="retention per-user limit (0: none)")
+    parser.add_argument("--minute-rollup-days", type=float, default=2, help="age limit of minute rollups (0: none)")
+    parser.add_argument("--iterations", type=int, default=100, help="timed calls per benchmark")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = run(args.rows, args.days, args.max_per_user, args.minute_rollup_days, args.iterations)
+    print_results(results)
+    if args.json:
+        save_results(args.json, results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+Search benchmark: `/search` queries against the full-text index.
+
+A fresh SQLite database is filled by `benchmarks.datagen` (20-word
+vocabulary, so every common word matches a large share of the rows); one
+query in 1000 then gets a rare word through an UPDATE, which also exercises
+the sync triggers. The benchmark times `search.search_queries` for:
+- one common word, two common words and a prefix, by relevance and newest first;
+- a rare word;
+- a common word filtered on label, score range and country;
+- a common word in the busiest user's queries, and its second page by
+  relevance (what `/search` runs, as it always needs a user);
+- the tenth page of a common word, newest first.
+
+It also reports the index size next to the table's, and the throughput of
+bulk INSERTs with the index triggers in place.
+
+Run from the `app` directory (1M rows takes several minutes to generate):
+
+    python -m benchmarks.bench_search [--rows 1000000] [--iterations 200] [--json results.json]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from sqlalchemy import func, insert, text
+from sqlalchemy.orm import sessionmaker
+from benchmarks.bench_db import size_label
+from benchmarks.common import measure, print_results, save_results
+from benchmarks.datagen import generate
+from database import Query, make_engine
+from search import search_filters, search_queries
+
+RARE_WORD = "refund"
+
+
+def index_sizes(db) -> dict:
+    """
+    Size in MiB of the queries table and of the FTS5 tables (needs dbstat).
+    """
+    try:
+        rows = db.execute(text("SELECT name, sum(pgsize) FROM dbstat WHERE name LIKE 'queries%' GROUP BY name")).all()
+    except Exception:
+        return {}
+    table = sum(size for name, size in rows if name == "queries")
+    index = sum(size for name, size in rows if name.startswith("queries_fts"))
+    return {"table_mib": round(table / 2 ** 20, 2), "index_mib": round(index / 2 ** 20, 2)}
+
+
+def insert_rate(db, user_id: int, rows: int = 10000) -> dict:
+    values = [
+        {"text": f"benchmark insert {i} good service", "sentiment": "Positive", "score": 0.5, "confidence": 0.5,
+         "user_id": user_id}
+        for i in range(rows)
+    ]
+    start = time.perf_counter()
+    db.execute(insert(Query), values)
+    db.commit()
+    elapsed = time.perf_counter() - start
+    return {"ops_per_s": round(rows / elapsed, 2)}
+
+
+def run(rows: int = 100000, iterations: int = 200) -> dict:
+    results = {}
+    label = size_label(rows)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(f"sqlite:///{os.path.join(tmp, 'search.db')}")
+        generate(engine, rows)
+        Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        db = Session()
+        try:
+            db.execute(text(f"UPDATE queries SET text = text || ' {RARE_WORD}' WHERE id % 1000 = 0"))
+            db.commit()
+            user_id = db.query(Query.user_id).group_by(Query.user_id).order_by(func.count().desc()).limit(1).scalar()
+
+            filters = search_filters(sentiment="Positive", min_score=0.3, max_score=0.8, country="India")
+            cases = {
+                "common": dict(q="good"),
+                "common_newest": dict(q="good", order="newest"),
+                "two_words": dict(q="good service"),
+                "prefix": dict(q="gre*"),
+                "rare": dict(q=RARE_WORD),
+                "filtered": dict(q="love", conditions=filters),
+                "filtered_newest": dict(q="love", conditions=filters, order="newest"),
+                "user": dict(q="love", user_id=user_id),
+                "user_newest": dict(q="love", user_id=user_id, order="newest"),
+            }
+            for name, kwargs in cases.items():
+                results[f"search.{name}.{label}"] = measure(lambda i: search_queries(db, **kwargs), iterations, warmup=5)
+
+            cursor = None
+            for _ in range(9):
+                _, cursor = search_queries(db, "good", order="newest", cursor=cursor)
+            results[f"search.page_10_newest.{label}"] = measure(
+                lambda i: search_queries(db, "good", order="newest", cursor=cursor), iterations, warmup=5
+            )
+
+            _, cursor = search_queries(db, "love", user_id=user_id)
+            results[f"search.user_page_2.{label}"] = measure(
+                lambda i: search_queries(db, "love", user_id=user_id, cursor=cursor), iterations, warmup=5
+            )
+
+            results[f"search.size.{label}"] = index_sizes(db)
+            results[f"search.insert_with_index.{label}"] = insert_rate(db, user_id)
+        finally:
+            db.close()
+        engine.dispose()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000, help="queries to generate")
+    parser.add_argument("--iterations", type=int, default=200, help="timed calls per benchmark")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = run(args.rows, args.iterations)
+    print_results(results)
+    if args.json:
+        save_results(args.json, results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
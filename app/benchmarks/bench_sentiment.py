@@ -0,0 +1,72 @@
+"""
+Micro-benchmarks for the scoring pipeline: `clean_text`, `analyze_sentiment`
+(with a cold and a warm result cache) and `classify_sentiment`.
+
+Run from the `app` directory:
+
+    python -m benchmarks.bench_sentiment [--texts 5000] [--json results.json]
+"""
+import argparse
+import random
+import sys
+from benchmarks.common import print_results, save_results, throughput
+from benchmarks.datagen import fake_text
+from sentiment import analyze_sentiment, classify_sentiment, clean_text, get_analyzer
+from sentiment_cache import result_cache
+
+
+def corpus(count: int, seed: int = 7):
+    """
+    Distinct texts with the noise clean_text deals with (URLs, repeated
+    punctuation and letters).
+    """
+    rng = random.Random(seed)
+    texts = []
+    for i in range(count):
+        text = fake_text(rng)
+        if i % 3 == 0:
+            text += " " + rng.choice(("!!!!!", "???", "soooo", "https://example.com/x"))
+        texts.append(f"{text} #{i}")
+    return texts
+
+
+def run(texts: int = 5000, repeat: int = 5) -> dict:
+    """
+    Run the micro-benchmarks and return their results by name.
+    """
+    items = corpus(texts)
+    get_analyzer()  # load the lexicon outside the timings
+    results = {"sentiment.clean_text": throughput(clean_text, items, repeat)}
+
+    def cold(text):
+        result_cache.memory.clear()
+        analyze_sentiment(text)
+
+    # Only the in-memory tier is cleared; leave SENTIMENT_CACHE_PATH unset.
+    results["sentiment.analyze_cold"] = throughput(cold, items, 1)
+
+    for text in items:
+        analyze_sentiment(text)  # fill the cache
+    results["sentiment.analyze_warm"] = throughput(analyze_sentiment, items, repeat)
+
+    scores = [random.Random(i).uniform(-1, 1) for i in range(texts)]
+    results["sentiment.classify"] = throughput(classify_sentiment, scores, repeat)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=5000, help="distinct texts in the corpus")
+    parser.add_argument("--repeat", type=int, default=5, help="best-of repetitions")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = run(args.texts, args.repeat)
+    print_results(results)
+    if args.json:
+        save_results(args.json, results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+Cold-start benchmark for a worker process.
+
+Starts fresh interpreters and measures:
+- the time to `import main` (what uvicorn does before serving);
+- the time to score the first text (lexicon load included).
+
+Fails (exit code 1) if the median import time exceeds the budget.
+
+Run from the `app` directory:
+
+    python -m benchmarks.bench_startup [--runs 5] [--budget 2.0]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+PROBE = """
+import json, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+from sentiment import analyze_sentiment
+analyze_sentiment("warm up the analyzer")
+t2 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "first_score": t2 - t1}))
+"""
+
+
+def measure_once() -> dict:
+    """
+    Run the probe in a new interpreter and return its timings (seconds).
+    """
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="number of cold starts to measure")
+    parser.add_argument("--budget", type=float, default=2.0, help="maximum median import time, in seconds")
+    args = parser.parse_args(argv)
+
+    runs = [measure_once() for _ in range(args.runs)]
+    import_time = statistics.median(r["import"] for r in runs)
+    first_score = statistics.median(r["first_score"] for r in runs)
+
+    print(f"import main        : {import_time * 1000:8.1f} ms (median of {args.runs})")
+    print(f"first analyze call : {first_score * 1000:8.1f} ms (median of {args.runs})")
+
+    if import_time > args.budget:
+        print(f"FAIL: import time over budget ({args.budget:.2f} s)")
+        return 1
+    print(f"OK: within budget ({args.budget:.2f} s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
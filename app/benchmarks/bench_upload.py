@@ -0,0 +1,79 @@
+"""
+Upload scoring benchmark: throughput and peak memory versus file size.
+
+Generates text uploads of increasing size, scores each with
+`uploads.UploadJobRunner` against a fresh SQLite database, and reports
+records per second and the peak Python heap (tracemalloc) of the run.
+The peak should stay roughly flat as the file grows (it is bounded by the
+chunk size, not the file size).
+
+Run from the `app` directory:
+
+    python -m benchmarks.bench_upload [--records 20000,80000] [--chunk-size 5000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from sqlalchemy.orm import sessionmaker
+import crud
+from benchmarks.datagen import fake_text
+from database import make_engine
+from migrations import migrate
+from uploads import UploadJobRunner, create_job, new_job_id
+
+
+def write_corpus(path: str, records: int, seed: int = 3):
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as fh:
+        for i in range(records):
+            fh.write(f"{fake_text(rng)} #{i}\n")
+
+
+def run(tmp: str, records: int, chunk_size: int) -> dict:
+    path = os.path.join(tmp, f"corpus-{records}.txt")
+    write_corpus(path, records)
+    size = os.path.getsize(path)  # the runner deletes the file when done
+    engine = make_engine(f"sqlite:///{os.path.join(tmp, f'upload-{records}.db')}")
+    migrate(engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = Session()
+    user = crud.create_user(db, f"bench-{records}", "127.0.0.1")
+    job_id = new_job_id()
+    create_job(db, job_id, user.id, os.path.basename(path), "text", None, path, size, "127.0.0.1")
+    db.close()
+
+    runner = UploadJobRunner(session_factory=Session, chunk_size=chunk_size)
+    tracemalloc.start()
+    start = time.perf_counter()
+    runner.run_job(job_id)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    engine.dispose()
+
+    assert runner.records == records, f"scored {runner.records} of {records} records"
+    return {"records_per_s": records / elapsed, "peak_mib": peak / 2 ** 20, "file_mib": size / 2 ** 20}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", default="20000,80000", help="comma-separated upload sizes in records")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="records per committed chunk")
+    args = parser.parse_args(argv)
+
+    crud.ip_to_location = lambda ip: None  # measure scoring and storage only
+    print(f"{'records':>10} {'file MiB':>9} {'records/s':>10} {'peak MiB':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for records in (int(n) for n in args.records.split(",")):
+            result = run(tmp, records, args.chunk_size)
+            print(f"{records:>10} {result['file_mib']:>9.1f} {result['records_per_s']:>10.0f} {result['peak_mib']:>9.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""
+FastVader versus NLTK's SentimentIntensityAnalyzer: equivalence and speed.
+
+Scores a synthetic corpus that exercises every VADER rule (ALL CAPS,
+negations, boosters at distance 1-3, idioms, "kind of", "least", "but",
+"!"/"?" emphasis, emoticons, punctuation next to words and repeated tokens)
+with both scorers, checks that every result dict is identical, and reports
+the throughput of each. The exit status is 1 if any text scores differently.
+
+Run from the `app` directory:
+
+    python -m benchmarks.bench_vader [--texts 100000] [--json results.json]
+"""
+import argparse
+import random
+import sys
+from benchmarks.common import print_results, save_results, throughput
+from benchmarks.datagen import fake_text
+from sentiment import FastVader, build_analyzer, load_lexicon
+
+PIECES = (
+    "good", "GOOD", "bad", "BAD", "great", "terrible", "love", "hate", "ok", "fine",
+    "not", "never", "isn't", "don't", "ain't", "without", "nor", "n't",
+    "very", "VERY", "extremely", "slightly", "barely", "kind", "of", "sort", "just", "enough",
+    "least", "at", "but", "BUT", "so", "this", "the", "a",
+    "yeah", "right", "cut", "me", "some", "slack", "bad", "ass", "shit", "hot", "kiss", "death",
+    "upper", "hand", "break", "leg", "the", "bomb", "no", "doubt",
+    ":)", ":(", ":-D", "<3", ":D", "lol", "lmao", "wtf", "!", "?", "!!", "??", "?!?",
+    "good!", "bad.", "great,", "(terrible", "love!!!", ",hate", "...fine", "ok?", "sad:", "happy;",
+    "happy", "SAD", "Wonderful", "AWFUL", "#bad", "@great", "good-ish", "'nice'", "x", "I",
+)
+
+
+def corpus(count: int, seed: int = 11):
+    """
+    Texts mixing random VADER trigger words with the generated query texts.
+    """
+    rng = random.Random(seed)
+    texts = []
+    for i in range(count):
+        words = rng.choices(PIECES, k=rng.randint(0, 24))
+        if i % 2:
+            words.insert(rng.randint(0, len(words)), fake_text(rng))
+        text = " ".join(words)
+        if i % 5 == 0:
+            text += rng.choice(("!", "!!!!!!", "??", "????", "?!", ""))
+        texts.append(text)
+    return texts
+
+
+def run(texts: int = 100000, repeat: int = 3):
+    """
+    Compare both scorers on the corpus. Returns (results, mismatches).
+    """
+    items = corpus(texts)
+    lexicon = load_lexicon()
+    fast, nltk = FastVader(lexicon), build_analyzer(lexicon)
+
+    mismatches = []
+    for text in items:
+        expected, actual = nltk.polarity_scores(text), fast.polarity_scores(text)
+        if expected != actual:
+            mismatches.append((text, expected, actual))
+
+    results = {
+        "vader.nltk": throughput(nltk.polarity_scores, items, repeat),
+        "vader.fast": throughput(fast.polarity_scores, items, repeat),
+    }
+    return results, mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=100000, help="texts in the corpus")
+    parser.add_argument("--repeat", type=int, default=3, help="best-of repetitions")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    results, mismatches = run(args.texts, args.repeat)
+    print_results(results)
+    speedup = results["vader.fast"]["ops_per_s"] / results["vader.nltk"]["ops_per_s"]
+    print(f"\nspeedup: {speedup:.2f}x, mismatches: {len(mismatches)} of {args.texts}")
+    for text, expected, actual in mismatches[:10]:
+        print(f"  {text!r}\n    nltk: {expected}\n    fast: {actual}")
+    if args.json:
+        save_results(args.json, results)
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""
+Multi-worker benchmark: memory per worker and throughput from 1 to N workers.
+
+Starts `gunicorn -c gunicorn.conf.py main:app` with each worker count against
+a fresh SQLite database filled by `benchmarks.datagen`, drives POST
+/sentiment (distinct texts, so every request is scored) from `--clients`
+client processes, then reads each process's memory from
+/proc/<pid>/smaps_rollup:
+
+- RSS: resident pages, shared ones counted in full in every process;
+- PSS: shared pages split between the processes sharing them;
+- USS: pages private to the process (what each extra worker really costs).
+
+With the preloaded app the workers' PSS and USS stay well below their RSS.
+Compare with `--no-preload`, where every worker imports and loads
+everything itself. Admission control is off (every client shares one IP).
+Linux only; needs gunicorn and httpx.
+
+Run from the `app` directory:
+
+    python -m benchmarks.bench_workers [--workers 1,2,4] [--requests 2000] [--json results.json]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.common import print_results, save_results, summarize
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def children(pid: int):
+    with open(f"/proc/{pid}/task/{pid}/children") as fh:
+        return [int(child) for child in fh.read().split()]
+
+
+def memory_mib(pid: int) -> dict:
+    """
+    RSS, PSS and USS of a process in MiB, from /proc/<pid>/smaps_rollup.
+    """
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as fh:
+        for line in fh:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    uss = fields["Private_Clean"] + fields["Private_Dirty"]
+    return {"rss": fields["Rss"] / 1024, "pss": fields["Pss"] / 1024, "uss": uss / 1024}
+
+
+# ---------- Load clients ----------
+
+async def client_load(base_url: str, tokens, client_id: int, requests: int, concurrency: int):
+    import httpx
+    from benchmarks.bench_load import drive
+
+    async def make_request(client, i):
+        token = tokens[i % len(tokens)]
+        text = f"client {client_id} request {i} was not bad at all, really good"
+        return await client.post("/sentiment", data={"text": text, "token": token})
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60.0) as client:
+        return await drive(client, make_request, requests, concurrency)
+
+
+def run_client(args):
+    base_url, tokens, client_id, requests, concurrency, start_at = args
+    time.sleep(max(0.0, start_at - time.time()))  # start all clients together
+    started = time.time()
+    latencies, _ = asyncio.run(client_load(base_url, tokens, client_id, requests, concurrency))
+    return latencies, started, time.time()
+
+
+def run_workers(tmp: str, tokens, workers: int, preload: bool, requests: int, clients: int, concurrency: int):
+    """
+    Start gunicorn with `workers` workers, load it and measure its memory.
+    """
+    port = free_port()
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+        SHARED_CACHE_DIR=os.path.join(tmp, f"cache-{workers}-{int(preload)}"),
+        GUNICORN_PRELOAD="1" if preload else "0",
+        WEB_CONCURRENCY=str(workers),
+        BIND=f"127.0.0.1:{port}",
+        ADMISSION_ENABLED="0",  # every client is 127.0.0.1: measure capacity, not the rate limits
+    )
+    log = open(os.path.join(tmp, f"gunicorn-{workers}.log"), "w")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:app"],
+        cwd=APP_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        import httpx
+
+        deadline = time.time() + 120
+        while True:
+            if server.poll() is not None or time.time() > deadline:
+                raise RuntimeError(f"gunicorn did not start, see {log.name}")
+            try:
+                if httpx.get(f"{base_url}/stats", timeout=2.0).status_code == 200 and len(children(server.pid)) == workers:
+                    break
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+
+        per_client = requests // clients
+        start_at = time.time() + 0.5
+        jobs = [(base_url, tokens, c, per_client, concurrency, start_at) for c in range(clients)]
+        with multiprocessing.get_context("spawn").Pool(clients) as pool:
+            outcomes = pool.map(run_client, jobs)
+
+        latencies = [latency for outcome in outcomes for latency in outcome[0]]
+        elapsed = max(outcome[2] for outcome in outcomes) - min(outcome[1] for outcome in outcomes)
+        result = summarize(latencies, elapsed)
+
+        worker_memory = [memory_mib(pid) for pid in children(server.pid)]
+        master = memory_mib(server.pid)
+        for kind in ("rss", "pss", "uss"):
+            result[f"worker_{kind}_mib"] = round(sum(m[kind] for m in worker_memory) / len(worker_memory), 1)
+        result["master_rss_mib"] = round(master["rss"], 1)
+        result["total_pss_mib"] = round(master["pss"] + sum(m["pss"] for m in worker_memory), 1)
+        return result
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+        log.close()
+
+
+def run(worker_counts, preload: bool = True, requests: int = 2000, clients: int = 2, concurrency: int = 16) -> dict:
+    from benchmarks.datagen import generate
+    from database import make_engine
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        tokens = [token for _, token in generate(engine, 1000, users=50)]
+        engine.dispose()
+
+        base = None
+        for workers in worker_counts:
+            result = run_workers(tmp, tokens, workers, preload, requests, clients, concurrency)
+            base = base or result["ops_per_s"]
+            result["scaling"] = round(result["ops_per_s"] / base, 2)
+            results[f"workers.{workers}{'' if preload else '.no_preload'}"] = result
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    cores = len(os.sched_getaffinity(0))
+    default_counts = sorted({1, max(1, cores // 2), cores})
+    parser.add_argument("--workers", default=",".join(map(str, default_counts)), help="comma-separated worker counts")
+    parser.add_argument("--no-preload", action="store_true", help="let every worker load the app itself")
+    parser.add_argument("--requests", type=int, default=2000, help="POST /sentiment requests per worker count")
+    parser.add_argument("--clients", type=int, default=2, help="client processes")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent requests per client process")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    counts = [int(n) for n in args.workers.split(",")]
+    results = run(counts, not args.no_preload, args.requests, args.clients, args.concurrency)
+    print_results(results)
+    if args.json:
+        save_results(args.json, results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
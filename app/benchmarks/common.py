@@ -0,0 +1,133 @@
+"""
+Shared helpers for the benchmark suite: timing, result files and the
+regression comparison against a stored baseline.
+
+Every benchmark reports a flat dict `name -> metrics`, where metrics holds
+`ops_per_s` (higher is better) and, for latency-sensitive cases,
+`p50_ms` / `p95_ms` / `p99_ms` (lower is better).
+"""
+import json
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+
+
+def percentile(samples, q: float) -> float:
+    """
+    Nearest-rank percentile of a list of numbers (q in 0..100).
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    rank = max(1, min(len(ordered), round(q / 100.0 * len(ordered) + 0.5)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies, elapsed: float = None) -> dict:
+    """
+    Metrics for a list of per-operation latencies (seconds).
+
+    Args:
+        latencies (list[float]): One entry per operation.
+        elapsed (float): Wall time of the whole run, if operations overlapped
+                         (defaults to the sum of the latencies).
+    """
+    elapsed = elapsed if elapsed is not None else sum(latencies)
+    return {
+        "ops_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 4),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 4),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 4),
+    }
+
+
+def measure(fn, iterations: int, warmup: int = 0) -> dict:
+    """
+    Call `fn(i)` `iterations` times (after `warmup` untimed calls) and summarize.
+    """
+    for i in range(warmup):
+        fn(i)
+    latencies = []
+    timer = time.perf_counter
+    for i in range(iterations):
+        start = timer()
+        fn(i)
+        latencies.append(timer() - start)
+    return summarize(latencies)
+
+
+def throughput(fn, items, repeat: int = 5) -> dict:
+    """
+    Best-of-`repeat` throughput of `fn(item)` over all items, for calls too
+    short to time one by one.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            fn(item)
+        best = min(best, time.perf_counter() - start)
+    return {"ops_per_s": round(len(items) / best, 2), "mean_us": round(best / len(items) * 1e6, 4)}
+
+
+# ---------- Results and baselines ----------
+
+def environment() -> dict:
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+def save_results(path: str, results: dict):
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump({"environment": environment(), "results": results}, fh, indent=2, sort_keys=True)
+
+
+def load_results(path: str) -> dict:
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)["results"]
+
+
+def compare(results: dict, baseline: dict, tolerance: float = 0.2):
+    """
+    Compare results with a baseline.
+
+    A benchmark regresses when its throughput drops, or one of its latency
+    percentiles grows, by more than `tolerance` (a fraction of the baseline).
+    Benchmarks missing from either side are ignored.
+
+    Returns:
+        list[tuple]: (benchmark, metric, baseline value, current value, change)
+                     for every regression.
+    """
+    regressions = []
+    for name, metrics in sorted(results.items()):
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric, value in metrics.items():
+            old = base.get(metric)
+            if not old or not isinstance(value, (int, float)):
+                continue
+            change = (value - old) / old
+            if metric == "ops_per_s":
+                regressed = change < -tolerance
+            elif metric.endswith("_ms") or metric.endswith("_us"):
+                regressed = change > tolerance
+            else:
+                continue
+            if regressed:
+                regressions.append((name, metric, old, value, change))
+    return regressions
+
+
+def print_results(results: dict):
+    width = max((len(name) for name in results), default=0)
+    for name, metrics in sorted(results.items()):
+        cells = "  ".join(f"{metric}={value}" for metric, value in sorted(metrics.items()))
+        print(f"{name:<{width}}  {cells}")
+
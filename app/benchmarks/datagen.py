@@ -0,0 +1,127 @@
+"""
+Synthetic data generator for the DB and load benchmarks.
+
+Creates users and queries with a realistic mix of sentiments, timestamps
+spread over the last 30 days and ~80% of queries located in a handful of
+city clusters, then rebuilds the map cells and trend rollups so the
+aggregate-backed endpoints see the same data as a live deployment.
+
+Run from the `app` directory:
+
+    python -m benchmarks.datagen --rows 100000 --db bench.db
+"""
+import argparse
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from database import Query, User, make_engine
+from mapdata import rebuild_map_cells
+from migrations import migrate
+from rollups import rebuild_rollups
+from sentiment import classify_sentiment
+
+# (city, country, lat, lon) centres the located points cluster around
+CITIES = (
+    ("San Francisco", "United States", 37.77, -122.42),
+    ("New York", "United States", 40.71, -74.01),
+    ("London", "United Kingdom", 51.51, -0.13),
+    ("Berlin", "Germany", 52.52, 13.40),
+    ("Kolkata", "India", 22.57, 88.36),
+    ("Bengaluru", "India", 12.97, 77.59),
+    ("Tokyo", "Japan", 35.68, 139.69),
+    ("Sao Paulo", "Brazil", -23.55, -46.63),
+)
+
+WORDS = (
+    "good great terrible awful happy sad love hate fine meh amazing boring "
+    "product service delivery support price quality app update today really"
+).split()
+
+CHUNK_SIZE = 10000
+
+
+def fake_text(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 20)))
+
+
+def generate(engine, rows: int, users: int = None, seed: int = 42, located: float = 0.8):
+    """
+    Fill a (migrated) database with synthetic users and queries.
+
+    Args:
+        engine: SQLAlchemy engine to write to.
+        rows (int): Number of queries.
+        users (int): Number of users (default: one per 100 queries).
+        seed (int): Random seed, so runs are reproducible.
+        located (float): Fraction of queries with a location.
+
+    Returns:
+        list[tuple]: (user ID, session token) of the generated users.
+    """
+    rng = random.Random(seed)
+    users = users or max(1, rows // 100)
+    migrate(engine)
+    now = datetime.now(timezone.utc)
+
+    with Session(bind=engine) as db:
+        tokens = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(users)]
+        db.execute(insert(User), [
+            {"username": f"bench-{seed}-{i}", "session_token": token, "ip_address": "127.0.0.1", "created_at": now}
+            for i, token in enumerate(tokens)
+        ])
+        db.commit()
+        user_ids = [uid for (uid,) in db.query(User.id).filter(User.session_token.in_(tokens)).order_by(User.id)]
+
+        chunk = []
+        for i in range(rows):
+            score = round(max(-1.0, min(1.0, rng.gauss(0.1, 0.5))), 4)
+            row = {
+                "text": fake_text(rng),
+                "sentiment": classify_sentiment(score),
+                "score": score,
+                "confidence": round(abs(score), 3),
+                "pos": 0.0, "neg": 0.0, "neu": round(1 - abs(score), 3),
+                "time": now - timedelta(seconds=rng.randrange(30 * 86400)),
+                "user_id": rng.choice(user_ids),
+                "ip_address": "203.0.113.%d" % rng.randrange(256),
+                "latitude": None, "longitude": None, "city": None, "region": None, "country": None,
+            }
+            if rng.random() < located:
+                city, country, lat, lon = rng.choice(CITIES)
+                row.update(latitude=lat + rng.gauss(0, 0.2), longitude=lon + rng.gauss(0, 0.2), city=city, country=country)
+            chunk.append(row)
+            if len(chunk) >= CHUNK_SIZE:
+                db.execute(insert(Query), chunk)
+                chunk = []
+        if chunk:
+            db.execute(insert(Query), chunk)
+        db.commit()
+
+        rebuild_map_cells(db)
+        rebuild_rollups(db)
+
+    return list(zip(user_ids, tokens))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000, help="queries to generate")
+    parser.add_argument("--users", type=int, default=None, help="users to generate (default rows / 100)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", default="bench.db", help="SQLite file to fill")
+    args = parser.parse_args(argv)
+
+    engine = make_engine(f"sqlite:///{args.db}")
+    start = time.perf_counter()
+    users = generate(engine, args.rows, args.users, args.seed)
+    print(f"{args.rows} queries for {len(users)} users in {time.perf_counter() - start:.1f}s -> {args.db}")
+    engine.dispose()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
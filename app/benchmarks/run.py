@@ -0,0 +1,81 @@
+"""
+Run the benchmark suite, save the results as JSON and compare them with a
+stored baseline.
+
+Run from the `app` directory:
+
+    python -m benchmarks.run --save results.json
+    python -m benchmarks.run --baseline baseline.json --tolerance 0.2
+
+Suites: "sentiment" (micro-benchmarks), "db" (at --sizes rows) and "load"
+(in-process ASGI load test, run in a subprocess). With --baseline, every
+benchmark whose throughput dropped or whose latency grew by more than
+--tolerance is listed and the exit status is 1. Baselines are only
+comparable on the same machine.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from benchmarks.common import compare, load_results, print_results, save_results
+
+SUITES = ("sentiment", "db", "load")
+
+
+def run_load(args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "load.json")
+        subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_load", "--rows", str(args.load_rows),
+             "--requests", str(args.requests), "--concurrency", str(args.concurrency), "--json", path],
+            check=True, stdout=subprocess.DEVNULL,  # results are read back from the JSON file
+        )
+        return load_results(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suites", default=",".join(SUITES), help="comma-separated suites to run")
+    parser.add_argument("--sizes", default="10000,100000", help="table sizes for the db suite")
+    parser.add_argument("--iterations", type=int, default=200, help="timed calls per db benchmark")
+    parser.add_argument("--load-rows", type=int, default=10000, help="queries in the load test database")
+    parser.add_argument("--requests", type=int, default=2000, help="load test requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=32, help="load test concurrent clients")
+    parser.add_argument("--save", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare with the results in this file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative change before a regression")
+    args = parser.parse_args(argv)
+
+    suites = [suite.strip() for suite in args.suites.split(",") if suite.strip()]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+
+    results = {}
+    if "load" in suites:
+        results.update(run_load(args))
+    if "sentiment" in suites:
+        from benchmarks import bench_sentiment
+        results.update(bench_sentiment.run())
+    if "db" in suites:
+        from benchmarks import bench_db
+        results.update(bench_db.run([int(size) for size in args.sizes.split(",")], args.iterations))
+
+    print_results(results)
+    if args.save:
+        save_results(args.save, results)
+
+    if args.baseline:
+        regressions = compare(results, load_results(args.baseline), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for name, metric, old, new, change in regressions:
+                print(f"  {name} {metric}: {old} -> {new} ({change:+.1%})")
+            return 1
+        print(f"\nNo regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Sentinel returned by `TTLCache.get` on a miss, so that `None` can be cached
+# (negative caching) and still be told apart from "not in the cache".
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe, bounded LRU cache whose entries expire after a time-to-live.
+
+    Entries are evicted least-recently-used first once `maxsize` is reached.
+    A separate (usually shorter) TTL can be used for negative entries, i.e.
+    cached `None` values that record a failed or meaningless lookup.
+
+    Args:
+        maxsize (int): Maximum number of entries kept in memory.
+        ttl (float): Lifetime of a regular entry, in seconds.
+        negative_ttl (float): Lifetime of a `None` entry, in seconds
+                              (defaults to `ttl`).
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 3600.0, negative_ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=MISSING):
+        """
+        Return the cached value for `key`, or `default` if absent or expired.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at < now:
+                # Expired: drop it and report a miss
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)  # mark as most recently used
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        """
+        Store `value` under `key`, evicting the least recently used entry if full.
+        """
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """
+        Remove a single entry (no-op if it is not cached).
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Remove every entry. Counters are kept.
+        """
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """
+        Return hit/miss/eviction counters and the current size.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteConnections:
+    """
+    One SQLite connection per thread (and per process) to a shared file,
+    opened on first use in WAL mode with autocommit.
+
+    A connection inherited through fork() is never reused in the child: it
+    would share file locks and state with the parent's.
+
+    Args:
+        path (str): SQLite file.
+        schema (list[str]): Statements run on every new connection
+                            (`CREATE TABLE IF NOT EXISTS ...`).
+    """
+
+    def __init__(self, path: str, schema=()):
+        self.path = path
+        self.schema = list(schema)
+        self._local = threading.local()
+
+    def get(self) -> sqlite3.Connection:
+        """
+        Return this thread's connection, opening it if needed.
+        """
+        pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != pid:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in self.schema:
+                conn.execute(statement)
+            self._local.conn, self._local.pid = conn, pid
+        return conn
+
+
+class SharedCache:
+    """
+    Cross-process cache backed by a SQLite file, for values that several
+    server worker processes should compute only once. Values are stored as
+    JSON with an absolute expiry time; `None` can be cached (with
+    `negative_ttl`) and is told apart from a miss by `MISSING`.
+
+    Meant as a second tier behind a `TTLCache`: a hit here costs one indexed
+    SQLite read, so it only pays off for values that are more expensive than
+    that to compute.
+
+    Args:
+        path (str): SQLite file shared by the processes.
+        ttl (float): Lifetime of a regular entry, in seconds.
+        negative_ttl (float): Lifetime of a `None` entry, in seconds
+                              (defaults to `ttl`).
+        prune_every (int): Delete expired entries after this many writes.
+    """
+
+    def __init__(self, path: str, ttl: float = 3600.0, negative_ttl: float = None, prune_every: int = 1000):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.prune_every = prune_every
+        self._db = SQLiteConnections(path, [
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)",
+        ])
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, default=MISSING):
+        """
+        Return the cached value for `key`, or `default` if absent or expired.
+        """
+        row = self._db.get().execute(
+            "SELECT value FROM entries WHERE key = ? AND expires_at >= ?", (key, time.time())
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value, ttl: float = None):
+        """
+        Store `value` (JSON-serializable) under `key`.
+        """
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        conn = self._db.get()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, json.dumps(value), time.time() + ttl)
+        )
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            conn.execute("DELETE FROM entries WHERE expires_at < ?", (time.time(),))
+
+    def clear(self):
+        """
+        Remove every entry, for all processes. Counters are kept.
+        """
+        self._db.get().execute("DELETE FROM entries")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -1,8 +1,46 @@
+import asyncio
+import base64
+import os
+from typing import NamedTuple
+from sqlalchemy import insert, select, tuple_
 from sqlalchemy.orm import Session
-from database import User, Query  # SQLAlchemy models
+from database import User, Query, sentiment_details  # SQLAlchemy models
 import uuid
 from datetime import datetime, timezone
 from ipconverter import ip_to_location  # utility to convert IP to geolocation
+from enrichment import geo_queue  # background geolocation worker
+from writer import WRITE_DURABILITY, query_writer  # group-commit writer
+from aggregates import on_queries_deleted, on_queries_saved, query_values  # map cells and rollups
+from cache import MISSING, TTLCache
+from metrics import astage, stage
+
+# "inline": geolocate before the insert (default)
+# "async": insert immediately and let the background queue fill in the location
+GEO_ENRICHMENT_MODE = os.getenv("GEO_ENRICHMENT_MODE", "inline")
+
+# "batched": while the group-commit writer runs (the app starts it), save_query
+#            hands rows to it so concurrent requests share one commit
+# "direct": every save_query commits its own transaction
+QUERY_WRITE_MODE = os.getenv("QUERY_WRITE_MODE", "batched")
+
+
+class UserRecord(NamedTuple):
+    """
+    Immutable snapshot of a user, safe to share between requests and threads
+    (unlike a session-bound User object).
+    """
+    id: int
+    username: str
+    session_token: str
+
+
+# token -> UserRecord (or None for unknown tokens, kept for a shorter time so
+# floods of invalid tokens are answered without touching the database)
+token_cache = TTLCache(
+    maxsize=int(os.getenv("AUTH_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("AUTH_CACHE_TTL", "300")),
+    negative_ttl=float(os.getenv("AUTH_NEGATIVE_TTL", "30")),
+)
 
 
 def create_user(db: Session, username: str, ip_address: str):
@@ -32,6 +70,9 @@ def create_user(db: Session, username: str, ip_address: str):
     db.add(user)
     db.commit()  # save changes
     db.refresh(user)  # refresh the instance with DB-generated fields (like ID)
+
+    # Drop any negative entry cached for this token
+    token_cache.invalidate(token)
     
     return user
 
@@ -50,13 +91,75 @@ def get_user_by_token(db: Session, token: str):
     return db.query(User).filter(User.session_token == token).first()
 
 
+@stage("verify_token")
+def resolve_token(db: Session, token: str):
+    """
+    Resolve a session token to a `UserRecord`, using the in-process token cache.
+
+    Valid tokens are cached for AUTH_CACHE_TTL seconds and unknown tokens for
+    AUTH_NEGATIVE_TTL seconds, so repeated requests skip the database lookup.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        token (str): User's session token.
+
+    Returns:
+        UserRecord or None: The user if the token is valid, else None.
+    """
+    if not token:
+        return None
+
+    record = token_cache.get(token)
+    if record is not MISSING:
+        return record
+
+    row = db.query(User.id, User.username, User.session_token).filter(User.session_token == token).first()
+    record = UserRecord(*row) if row else None
+    token_cache.set(token, record)
+    return record
+
+
+def delete_user(db: Session, user_id: int):
+    """
+    Delete a user and their queries, and evict their token from the cache.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        user_id (int): ID of the user to delete.
+
+    Returns:
+        bool: True if the user existed.
+    """
+    user = db.get(User, user_id)
+    if user is None:
+        return False
+    token = user.session_token
+    values = [query_values(q) for q in user.queries]
+    db.delete(user)  # queries are removed by the relationship cascade
+    db.flush()
+    on_queries_deleted(db, values)
+    db.commit()
+    token_cache.invalidate(token)
+    return True
+
+
+def detail_columns(details) -> dict:
+    """
+    Split a VADER details dict into the pos/neg/neu columns (the compound
+    is stored as `score`).
+    """
+    if not details:
+        return {"pos": None, "neg": None, "neu": None}
+    return {"pos": details["pos"], "neg": details["neg"], "neu": details["neu"]}
+
+
 def save_query(db, user, text, sentiment, score, ip_address, confidence, details):
     """
     Save a user's query and its sentiment analysis results to the database.
     
     Args:
         db (Session): SQLAlchemy database session.
-        user (User): The user object who made the query.
+        user (User or UserRecord): The user who made the query.
         text (str): Original query text.
         sentiment (str): Sentiment label (e.g., Positive, Negative).
         score (float): Compound sentiment score.
@@ -65,10 +168,32 @@ def save_query(db, user, text, sentiment, score, ip_address, confidence, details
         details (dict): Detailed sentiment breakdown (pos, neg, neu, compound).
         
     Returns:
-        Query: The saved Query object.
+        Query or Future: The saved Query object, or a future resolving to the
+        new query ID when the row went through the group-commit writer.
+    """
+    if QUERY_WRITE_MODE == "batched" and query_writer.running:
+        future = _submit_query(user, text, sentiment, score, ip_address, confidence, details)
+        if future is not None:
+            if WRITE_DURABILITY == "commit":
+                with stage("db_commit"):
+                    future.result()  # wait for the batch commit; raises if the insert failed
+            return future
+        # Writer queue is full: fall back to a direct write
+
+    return _save_query_direct(db, user, text, sentiment, score, ip_address, confidence, details)
+
+
+def _save_query_direct(db, user, text, sentiment, score, ip_address, confidence, details, loc=MISSING):
+    """
+    Insert a query in its own transaction (without the group-commit writer).
+    `loc` is the already resolved location, if the caller looked it up.
     """
+    if GEO_ENRICHMENT_MODE == "async":
+        return _save_query_deferred(db, user, text, sentiment, score, ip_address, confidence, details)
+
     # Convert IP address to geolocation (may return None if lookup fails)
-    loc = ip_to_location(ip_address)
+    if loc is MISSING:
+        loc = ip_to_location(ip_address)
 
     # Create a Query object to store in the database
     db_query = Query(
@@ -77,8 +202,8 @@ def save_query(db, user, text, sentiment, score, ip_address, confidence, details
         score=score,  # store as a float
         time=datetime.now(timezone.utc),  # UTC timestamp
         confidence=confidence,  # float value
-        details=details,  # store the sentiment breakdown
-        user=user,  # associate query with user
+        **detail_columns(details),  # store the sentiment breakdown
+        user_id=user.id,  # associate query with user (User or UserRecord)
         ip_address=ip_address,
 
         # Geolocation information
@@ -89,29 +214,354 @@ def save_query(db, user, text, sentiment, score, ip_address, confidence, details
         region=loc.get("region") if loc else None,  # optional
     )
 
-    # Add query to database and commit changes
+    # Add query to database, update the aggregates and commit changes
     db.add(db_query)
-    db.commit()
+    on_queries_saved(db, [query_values(db_query)])
+    with stage("db_commit"):
+        db.commit()
     db.refresh(db_query)  # refresh instance to get DB-generated fields (like ID)
 
     return db_query
 
 
-def chat_history(db: Session, token: str):
+def _submit_query(user, text, sentiment, score, ip_address, confidence, details, timeout=None, loc=MISSING):
+    """
+    Queue a query on the group-commit writer (`loc` as in `_save_query_direct`).
+    Returns a future of the new ID, or None if the writer queue is full.
+    """
+    deferred = GEO_ENRICHMENT_MODE == "async"
+    if deferred:
+        loc = None
+    elif loc is MISSING:
+        loc = ip_to_location(ip_address)
+    row = {
+        "text": text,
+        "sentiment": sentiment,
+        "score": score,
+        "time": datetime.now(timezone.utc),
+        "confidence": confidence,
+        **detail_columns(details),
+        "user_id": user.id,
+        "ip_address": ip_address,
+        "latitude": loc.get("lat") if loc else None,
+        "longitude": loc.get("lon") if loc else None,
+        "country": loc.get("country") if loc else None,
+        "city": loc.get("city") if loc else None,
+        "region": loc.get("region") if loc else None,
+    }
+    return query_writer.submit(row, geolocate=deferred, timeout=timeout)
+
+
+def _save_query_deferred(db, user, text, sentiment, score, ip_address, confidence, details):
+    """
+    Insert a query with empty location columns and queue it for geolocation.
+    Costs a single INSERT on the request path (no refresh round trip).
+    """
+    db_query = Query(
+        text=text,
+        sentiment=sentiment,
+        score=score,
+        time=datetime.now(timezone.utc),
+        confidence=confidence,
+        **detail_columns(details),
+        user_id=user.id,
+        ip_address=ip_address,
+    )
+
+    db.add(db_query)
+    db.flush()  # assigns the ID as part of the INSERT
+    query_id = db_query.id
+    on_queries_saved(db, [query_values(db_query)])  # location-based parts are added later
+    with stage("db_commit"):
+        db.commit()
+
+    # Location is written later by the background worker (dropped if the queue is full)
+    geo_queue.submit(query_id, ip_address)
+    return db_query
+
+
+def save_queries_bulk(db: Session, user, results, ip_address, before_commit=None, defer_geo: bool = None):
+    """
+    Save many sentiment results for one user with a single bulk INSERT.
+
+    The client IP is geolocated once for the whole batch (or queued for
+    background enrichment in async mode).
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        user (User or UserRecord): The user who made the queries.
+        results (list[dict]): `analyze_sentiment` results to store.
+        ip_address (str): IP address of the user when making the queries.
+        before_commit (callable): Called with the session just before the
+            commit, to record more state in the same transaction.
+        defer_geo (bool): Override GEO_ENRICHMENT_MODE for this batch.
+
+    Returns:
+        list[int]: IDs of the inserted rows, in input order.
+    """
+    if not results:
+        return []
+
+    deferred = GEO_ENRICHMENT_MODE == "async" if defer_geo is None else defer_geo
+    loc = None if deferred else ip_to_location(ip_address)
+    now = datetime.now(timezone.utc)
+
+    rows = [
+        {
+            "text": r["text"],
+            "sentiment": r["sentiment"],
+            "score": r["score"],
+            "time": now,
+            "confidence": r["confidence"],
+            **detail_columns(r["details"]),
+            "user_id": user.id,
+            "ip_address": ip_address,
+            "latitude": loc.get("lat") if loc else None,
+            "longitude": loc.get("lon") if loc else None,
+            "country": loc.get("country") if loc else None,
+            "city": loc.get("city") if loc else None,
+            "region": loc.get("region") if loc else None,
+        }
+        for r in results
+    ]
+
+    # executemany-style INSERT ... RETURNING, one statement for the whole chunk
+    stmt = insert(Query).returning(Query.id, sort_by_parameter_order=True)
+    ids = list(db.scalars(stmt, rows))
+    on_queries_saved(db, rows)
+    if before_commit is not None:
+        before_commit(db)
+    db.commit()
+
+    if deferred:
+        for query_id in ids:
+            geo_queue.submit(query_id, ip_address)
+    return ids
+
+
+# Columns returned by the history endpoints (no ORM objects, no IP/geo columns)
+HISTORY_COLUMNS = (
+    Query.id, Query.text, Query.sentiment, Query.score, Query.time,
+    Query.city, Query.country, Query.confidence, Query.pos, Query.neg, Query.neu,
+)
+
+
+class HistoryEntry(NamedTuple):
+    """
+    One history row, with the VADER breakdown rebuilt as `details`.
     """
-    Retrieve all queries associated with a user session token.
+    id: int
+    text: str
+    sentiment: str
+    score: float
+    time: datetime
+    city: str
+    country: str
+    confidence: float
+    details: dict
+
+
+def history_entry(row) -> HistoryEntry:
+    return HistoryEntry(
+        row.id, row.text, row.sentiment, row.score, row.time, row.city, row.country, row.confidence,
+        sentiment_details(row.pos, row.neg, row.neu, row.score),
+    )
+
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+
+
+def encode_history_cursor(time, query_id) -> str:
+    """
+    Encode the (time, id) position of the last row of a page as an opaque cursor.
+    """
+    raw = f"{time.isoformat()}|{query_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_history_cursor(cursor: str):
+    """
+    Decode a history cursor back to (time, id). Raises ValueError if malformed.
+    """
+    try:
+        time_str, id_str = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(time_str), int(id_str)
+    except Exception as e:
+        raise ValueError("Invalid history cursor") from e
+
+
+def _history_page(query, cursor, limit):
+    """
+    Apply keyset pagination on (time, id), newest first, to a history query.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    if cursor:
+        time, query_id = decode_history_cursor(cursor)
+        query = query.filter(tuple_(Query.time, Query.id) < (time, query_id))
+
+    # Fetch one extra row to know whether another page exists
+    rows = query.order_by(Query.time.desc(), Query.id.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_history_cursor(rows[-1].time, rows[-1].id)
+
+
+def history_page(db: Session, user_id: int, cursor: str = None, limit: int = HISTORY_PAGE_SIZE):
+    """
+    Retrieve one page of a user's queries, newest first.
+
+    Uses keyset pagination on the (user_id, time, id) index, so every page
+    costs the same no matter how deep it is.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        user_id (int): Owner of the queries.
+        cursor (str): `next_cursor` from the previous page (None for the first).
+        limit (int): Page size (capped at HISTORY_MAX_PAGE_SIZE).
+
+    Returns:
+        tuple: (list of HistoryEntry, next_cursor or None).
+    """
+    query = db.query(*HISTORY_COLUMNS).filter(Query.user_id == user_id)
+    rows, next_cursor = _history_page(query, cursor, limit)
+    return [history_entry(row) for row in rows], next_cursor
+
+
+def chat_history(db: Session, token: str, cursor: str = None, limit: int = HISTORY_PAGE_SIZE):
+    """
+    Retrieve one page of queries associated with a user session token.
     
     Args:
         db (Session): SQLAlchemy database session.
         token (str): User's session token.
+        cursor (str): `next_cursor` from the previous page (None for the first).
+        limit (int): Page size.
         
     Returns:
-        Query: SQLAlchemy query object (can be iterated to get results).
+        tuple: (list of HistoryEntry, next_cursor or None).
     """
-    # Attempt to get queries for user by joining User and Query via token
-    data = db.query(Query).join(User).filter(User.session_token == token).all()
-    
-    # # Print for debugging (optional)
-    # print(data)
-    
-    return data
+    # The token is resolved through the token cache, so no join on users
+    user = resolve_token(db, token)
+    if user is None:
+        return [], None
+    return history_page(db, user.id, cursor=cursor, limit=limit)
+
+
+def delete_query(db: Session, user_id: int, query_id: int):
+    """
+    Delete one of a user's queries and update the aggregates.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        user_id (int): Owner of the query.
+        query_id (int): ID of the query to delete.
+
+    Returns:
+        bool: True if the query existed and belonged to the user.
+    """
+    query = db.query(Query).filter(Query.id == query_id, Query.user_id == user_id).first()
+    if not query:
+        return False
+
+    values = query_values(query)
+    db.delete(query)
+    db.flush()  # rollup min/max are recomputed from the remaining rows
+    on_queries_deleted(db, [values])
+    db.commit()
+    return True
+
+
+# ---------- Async variants (request path) ----------
+# Same behaviour as the functions above, for an AsyncSession. Work that needs
+# the ORM Query API or the sync aggregate hooks goes through
+# `AsyncSession.run_sync`, which still awaits the async driver for all I/O.
+
+async def create_user_async(db, username: str, ip_address: str):
+    """
+    Async version of `create_user`.
+    """
+    token = str(uuid.uuid4())
+    user = User(username=username, session_token=token, ip_address=ip_address, created_at=datetime.now())
+    db.add(user)
+    await db.commit()
+    await db.refresh(user)
+    token_cache.invalidate(token)
+    return user
+
+
+@astage("verify_token")
+async def resolve_token_async(db, token: str):
+    """
+    Async version of `resolve_token` (cache hits never touch the database).
+    """
+    if not token:
+        return None
+
+    record = token_cache.get(token)
+    if record is not MISSING:
+        return record
+
+    stmt = select(User.id, User.username, User.session_token).where(User.session_token == token)
+    row = (await db.execute(stmt)).first()
+    record = UserRecord(*row) if row else None
+    token_cache.set(token, record)
+    return record
+
+
+async def save_query_async(db, user, text, sentiment, score, ip_address, confidence, details):
+    """
+    Async version of `save_query`. Neither the IP lookup nor waiting for the
+    group commit blocks the event loop.
+    """
+    loc = None if GEO_ENRICHMENT_MODE == "async" else await asyncio.to_thread(ip_to_location, ip_address)
+    if QUERY_WRITE_MODE == "batched" and query_writer.running:
+        future = _submit_query(user, text, sentiment, score, ip_address, confidence, details, timeout=0, loc=loc)
+        if future is not None:
+            if WRITE_DURABILITY == "commit":
+                with stage("db_commit"):
+                    await asyncio.wrap_future(future)
+            return future
+        # Writer queue is full: fall back to a direct write
+
+    return await db.run_sync(_save_query_direct, user, text, sentiment, score, ip_address, confidence, details, loc)
+
+
+async def save_queries_bulk_async(db, user, results, ip_address):
+    """
+    Async version of `save_queries_bulk`.
+    """
+    return await db.run_sync(save_queries_bulk, user, results, ip_address)
+
+
+async def history_page_async(db, user_id: int, cursor: str = None, limit: int = HISTORY_PAGE_SIZE):
+    """
+    Async version of `history_page`.
+    """
+    return await db.run_sync(history_page, user_id, cursor, limit)
+
+
+async def chat_history_async(db, token: str, cursor: str = None, limit: int = HISTORY_PAGE_SIZE):
+    """
+    Async version of `chat_history`.
+    """
+    user = await resolve_token_async(db, token)
+    if user is None:
+        return [], None
+    return await history_page_async(db, user.id, cursor, limit)
+
+
+async def delete_query_async(db, user_id: int, query_id: int):
+    """
+    Async version of `delete_query`.
+    """
+    return await db.run_sync(delete_query, user_id, query_id)
+
+
+async def delete_user_async(db, user_id: int):
+    """
+    Async version of `delete_user`.
+    """
+    return await db.run_sync(delete_user, user_id)
@@ -0,0 +1,126 @@
+import os
+from sqlalchemy import update
+from database import Query, SessionLocal
+from ipconverter import ip_to_location
+from aggregates import AGGREGATE_COLUMNS, on_queries_located
+from worker import BatchWorker
+
+
+class GeoEnrichmentQueue(BatchWorker):
+    """
+    Background worker that fills in the location columns of saved queries.
+
+    Query IDs are submitted together with the client IP after the row has been
+    committed. The worker collects them into batches, resolves each distinct IP
+    once and writes the location with one bulk UPDATE per IP.
+
+    Args:
+        capacity (int): Maximum number of pending items (backpressure bound).
+        batch_size (int): Maximum number of items handled per batch.
+        max_wait (float): Seconds to wait for a batch to fill up before flushing.
+        put_timeout (float): Seconds `submit` may block when the queue is full
+                             (0 means drop immediately).
+    """
+
+    thread_name = "geo-enrichment"
+
+    def __init__(self, capacity: int = 10000, batch_size: int = 500, max_wait: float = 0.05, put_timeout: float = 0.0):
+        super().__init__(capacity, batch_size, max_wait)
+        self.put_timeout = put_timeout
+
+        # Metrics
+        self.submitted = 0
+        self.dropped = 0
+        self.processed = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.high_watermark = 0
+
+    # ---------- Producer side ----------
+
+    def submit(self, query_id: int, ip_address: str) -> bool:
+        """
+        Schedule a saved query for geolocation.
+
+        Returns:
+            bool: True if queued, False if the queue was full and the item dropped.
+        """
+        if not self._put((query_id, ip_address), self.put_timeout):
+            self.dropped += 1
+            return False
+
+        self.submitted += 1
+        depth = self.depth()
+        if depth > self.high_watermark:
+            self.high_watermark = depth
+        return True
+
+    def stats(self) -> dict:
+        """
+        Return queue depth and throughput counters.
+        """
+        return {
+            "running": self.running,
+            "depth": self.depth(),
+            "capacity": self.capacity,
+            "high_watermark": self.high_watermark,
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "processed": self.processed,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+        }
+
+    # ---------- Worker side ----------
+
+    def handle_batch(self, items):
+        try:
+            self.process_batch(items)
+        except Exception as e:
+            self.failed_batches += 1
+            print("Geo enrichment batch failed:", e)
+
+    def process_batch(self, items):
+        """
+        Geolocate a batch of (query_id, ip_address) pairs and store the results.
+        Each distinct IP is resolved once and written with a single UPDATE.
+        """
+        by_ip = {}
+        for query_id, ip_address in items:
+            by_ip.setdefault(ip_address, []).append(query_id)
+
+        db = SessionLocal()
+        try:
+            for ip_address, ids in by_ip.items():
+                loc = ip_to_location(ip_address)
+                if not loc:
+                    continue
+                db.execute(
+                    update(Query)
+                    .where(Query.id.in_(ids))
+                    .values(
+                        latitude=loc.get("lat"),
+                        longitude=loc.get("lon"),
+                        country=loc.get("country"),
+                        city=loc.get("city"),
+                        region=loc.get("region"),
+                    )
+                )
+                columns = [getattr(Query, name) for name in AGGREGATE_COLUMNS]
+                located = db.query(*columns).filter(Query.id.in_(ids))
+                on_queries_located(db, [row._asdict() for row in located])
+            db.commit()
+        finally:
+            db.close()
+
+        self.processed += len(items)
+        self.batches += 1
+
+
+# Shared instance used by crud.save_query and started by the FastAPI lifespan
+geo_queue = GeoEnrichmentQueue(
+    capacity=int(os.getenv("GEO_QUEUE_CAPACITY", "10000")),
+    batch_size=int(os.getenv("GEO_QUEUE_BATCH_SIZE", "500")),
+    max_wait=float(os.getenv("GEO_QUEUE_MAX_WAIT", "0.05")),
+    put_timeout=float(os.getenv("GEO_QUEUE_PUT_TIMEOUT", "0")),
+)
@@ -0,0 +1,231 @@
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from database import Query, SessionLocal
+from rollups import LABEL_COLUMNS, to_utc_naive
+
+# Columns included in exports (no IP address, no raw VADER details)
+EXPORT_COLUMNS = (
+    Query.id, Query.time, Query.user_id, Query.text, Query.sentiment,
+    Query.score, Query.confidence, Query.latitude, Query.longitude,
+    Query.city, Query.region, Query.country,
+)
+EXPORT_FIELDS = tuple(column.key for column in EXPORT_COLUMNS)
+EXPORT_CHUNK_SIZE = 5000  # rows per server-side fetch (and per columnar chunk)
+EXPORT_API_KEY = os.getenv("EXPORT_API_KEY", "")  # X-API-Key for /export/queries and /analytics (empty disables them)
+
+
+# ---------- Filters ----------
+
+def export_filters(start: datetime = None, end: datetime = None, sentiment: str = None, country: str = None):
+    """
+    Build the WHERE conditions shared by exports and analytics.
+
+    Args:
+        start (datetime): Inclusive lower bound on the query time.
+        end (datetime): Exclusive upper bound on the query time.
+        sentiment (str): Sentiment label, e.g. "Positive".
+        country (str): Country name as stored by the geolocation lookup.
+
+    Returns:
+        list: SQLAlchemy conditions. Raises ValueError for an unknown label.
+    """
+    conditions = []
+    if start is not None:
+        conditions.append(Query.time >= to_utc_naive(start))
+    if end is not None:
+        conditions.append(Query.time < to_utc_naive(end))
+    if sentiment is not None:
+        if sentiment not in LABEL_COLUMNS:
+            raise ValueError(f"Unknown sentiment label: {sentiment}")
+        conditions.append(Query.sentiment == sentiment)
+    if country is not None:
+        conditions.append(Query.country == country)
+    return conditions
+
+
+# ---------- Streaming export ----------
+
+def iter_chunks(conditions, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Yield matching rows (EXPORT_COLUMNS) in lists of up to `chunk_size`.
+
+    Uses its own session and a server-side cursor (`yield_per`), so memory
+    stays constant however many rows match, and it can run after the
+    request's session has been closed.
+    """
+    db = SessionLocal()
+    try:
+        stmt = select(*EXPORT_COLUMNS).where(*conditions).order_by(Query.id)
+        result = db.execute(stmt.execution_options(yield_per=chunk_size))
+        for chunk in result.partitions():
+            yield chunk
+    finally:
+        db.close()
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def stream_csv(conditions, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Yield the export as CSV text, one block per chunk, header first.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    yield buffer.getvalue()
+    for chunk in iter_chunks(conditions, chunk_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_plain(value) for value in row] for row in chunk)
+        yield buffer.getvalue()
+
+
+def stream_ndjson(conditions, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Yield the export as NDJSON, one object per row.
+    """
+    for chunk in iter_chunks(conditions, chunk_size):
+        yield "".join(
+            json.dumps(dict(zip(EXPORT_FIELDS, (_plain(value) for value in row)))) + "\n"
+            for row in chunk
+        )
+
+
+def stream_columns(conditions, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Yield the export as columnar NDJSON: one line per chunk of up to
+    `chunk_size` rows, `{"rows": n, "columns": {"id": [...], "score": [...], ...}}`.
+    Each line loads directly into a dataframe; no field names are repeated per row.
+    """
+    for chunk in iter_chunks(conditions, chunk_size):
+        columns = {
+            name: [_plain(value) for value in values]
+            for name, values in zip(EXPORT_FIELDS, zip(*chunk))
+        }
+        yield json.dumps({"rows": len(chunk), "columns": columns}) + "\n"
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401 (optional dependency)
+    except ImportError:
+        return False
+    return True
+
+
+def stream_parquet(conditions, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Yield the export as a Parquet file, one row group per chunk
+    (needs the optional `pyarrow` package).
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("id", pa.int64()), ("time", pa.timestamp("us", tz="UTC")), ("user_id", pa.int64()),
+        ("text", pa.string()), ("sentiment", pa.string()), ("score", pa.float64()),
+        ("confidence", pa.float64()), ("latitude", pa.float64()), ("longitude", pa.float64()),
+        ("city", pa.string()), ("region", pa.string()), ("country", pa.string()),
+    ])
+    sink = io.BytesIO()
+    writer = pq.ParquetWriter(sink, schema)
+
+    def drain():
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    for chunk in iter_chunks(conditions, chunk_size):
+        columns = [list(values) for values in zip(*chunk)]
+        writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+        yield drain()
+    writer.close()
+    yield drain()  # footer
+
+
+EXPORT_STREAMS = {
+    "csv": (stream_csv, "text/csv"),
+    "ndjson": (stream_ndjson, "application/x-ndjson"),
+    "columns": (stream_columns, "application/x-ndjson"),
+    "parquet": (stream_parquet, "application/vnd.apache.parquet"),
+}
+
+
+# ---------- Analytics ----------
+
+def score_histogram(db: Session, conditions, bins: int = 20, chunk_size: int = 50000):
+    """
+    Histogram of compound scores over [-1, 1] in `bins` equal-width bins.
+
+    Only the score column is read, in chunks, and each chunk is binned by
+    NumPy, so memory stays constant.
+    """
+    import numpy as np
+
+    edges = np.linspace(-1.0, 1.0, bins + 1)
+    counts = np.zeros(bins, dtype=np.int64)
+    stmt = select(Query.score).where(*conditions).execution_options(yield_per=chunk_size)
+    for chunk in db.execute(stmt).scalars().partitions():
+        scores = np.fromiter(chunk, dtype=np.float64, count=len(chunk))
+        counts += np.histogram(scores, bins=edges)[0]
+    return [
+        {"start": round(float(lo), 4), "end": round(float(hi), 4), "count": int(count)}
+        for lo, hi, count in zip(edges[:-1], edges[1:], counts)
+    ]
+
+
+def analytics(db: Session, conditions, bins: int = 20, top: int = 10) -> dict:
+    """
+    Aggregate statistics over the queries matching `conditions`.
+
+    Totals, the label distribution and the top cities are computed by the
+    database (COUNT/AVG/GROUP BY); the score histogram by NumPy over the
+    projected score column.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        conditions (list): Filters from `export_filters`.
+        bins (int): Number of score histogram bins.
+        top (int): Number of cities to return.
+
+    Returns:
+        dict: total/mean/min/max score, labels, histogram and top_cities.
+    """
+    total, mean, low, high = db.execute(
+        select(func.count(), func.avg(Query.score), func.min(Query.score), func.max(Query.score))
+        .select_from(Query).where(*conditions)
+    ).one()
+
+    labels = dict(db.execute(
+        select(Query.sentiment, func.count()).where(*conditions).group_by(Query.sentiment)
+    ).all())
+
+    count = func.count().label("count")
+    cities = db.execute(
+        select(Query.city, Query.country, count, func.avg(Query.score))
+        .where(Query.city.isnot(None), *conditions)
+        .group_by(Query.city, Query.country)
+        .order_by(count.desc(), Query.city)
+        .limit(top)
+    ).all()
+
+    return {
+        "total": total,
+        "mean_score": round(mean, 4) if mean is not None else None,
+        "min_score": low,
+        "max_score": high,
+        "labels": {**dict.fromkeys(LABEL_COLUMNS, 0), **labels},
+        "histogram": score_histogram(db, conditions, bins) if total else [],
+        "top_cities": [
+            {"city": city, "country": country, "count": n, "mean_score": round(avg, 4)}
+            for city, country, n, avg in cities
+        ],
+    }
@@ -0,0 +1,123 @@
+import csv
+import gzip
+import ipaddress
+from array import array
+from bisect import bisect_right
+
+
+class IPRangeDatabase:
+    """
+    In-memory IP → location table built from a local IP-range CSV file.
+
+    The file uses the DB-IP "IP to City Lite" layout (optionally gzipped):
+
+        ip_start,ip_end,continent,country,region,city,latitude,longitude
+
+    Ranges are kept sorted by start address in compact parallel arrays, one
+    set per address family, and looked up with a binary search. Identical
+    locations are stored once and shared between ranges.
+    """
+
+    def __init__(self):
+        # Per address family (4 or 6): range starts, range ends, location index
+        self._starts = {4: array("I"), 6: []}
+        self._ends = {4: array("I"), 6: []}
+        self._loc_ids = {4: array("I"), 6: array("I")}
+        self._locations = []  # unique location dicts, referenced by index
+
+    @classmethod
+    def from_csv(cls, path: str):
+        """
+        Load an IP-range CSV (plain or .gz) into a new database.
+
+        Args:
+            path (str): Path of the CSV file.
+
+        Returns:
+            IPRangeDatabase: The loaded table.
+        """
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8", newline="") as fh:
+            db = cls()
+            db.load_rows(csv.reader(fh))
+        return db
+
+    def load_rows(self, rows):
+        """
+        Add ranges from an iterable of CSV rows, then sort them for lookups.
+        """
+        location_ids = {}
+        entries = {4: [], 6: []}
+
+        for row in rows:
+            if len(row) < 8:
+                continue  # skip blank or malformed lines
+            try:
+                start = ipaddress.ip_address(row[0].strip())
+                end = ipaddress.ip_address(row[1].strip())
+                lat = float(row[6]) if row[6] else None
+                lon = float(row[7]) if row[7] else None
+            except ValueError:
+                continue  # header line or bad address
+
+            loc_key = (row[3], row[4], row[5], lat, lon)
+            loc_id = location_ids.get(loc_key)
+            if loc_id is None:
+                loc_id = len(self._locations)
+                location_ids[loc_key] = loc_id
+                self._locations.append({
+                    "lat": lat,
+                    "lon": lon,
+                    "country": row[3] or None,
+                    "region": row[4] or None,
+                    "city": row[5] or None,
+                    "zip": None,  # not present in range files
+                })
+            entries[start.version].append((int(start), int(end), loc_id))
+
+        for version, items in entries.items():
+            # Merge with anything loaded earlier and keep the table sorted by start
+            items.extend(zip(self._starts[version], self._ends[version], self._loc_ids[version]))
+            items.sort()
+            if version == 4:
+                self._starts[4] = array("I", (s for s, _, _ in items))
+                self._ends[4] = array("I", (e for _, e, _ in items))
+            else:
+                self._starts[6] = [s for s, _, _ in items]
+                self._ends[6] = [e for _, e, _ in items]
+            self._loc_ids[version] = array("I", (l for _, _, l in items))
+
+    def lookup(self, ip: str):
+        """
+        Find the location of a public IP address.
+
+        Args:
+            ip (str): IPv4 or IPv6 address.
+
+        Returns:
+            dict or None: Location with lat, lon, country, region, city and zip,
+                          or None if the address is not covered by any range.
+        """
+        addr = ipaddress.ip_address(ip)
+        value = int(addr)
+        starts = self._starts[addr.version]
+
+        i = bisect_right(starts, value) - 1
+        if i < 0 or value > self._ends[addr.version][i]:
+            return None
+        return self._locations[self._loc_ids[addr.version][i]]
+
+    def __len__(self):
+        return len(self._starts[4]) + len(self._starts[6])
+
+
+def is_public_ip(ip: str) -> bool:
+    """
+    Return True if `ip` is a valid, globally routable address worth geolocating.
+    Private, loopback, link-local, multicast and reserved addresses return False.
+    """
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return addr.is_global and not addr.is_multicast
@@ -0,0 +1,74 @@
+"""
+Gunicorn settings for running the app in several worker processes:
+
+    gunicorn -c gunicorn.conf.py main:app      (from the `app` directory)
+
+- The app is imported once in the master (`preload_app`), then the master
+  applies migrations, loads the VADER lexicon, the IP-range table and
+  matplotlib, and freezes the garbage collector before forking, so these
+  pages stay shared copy-on-write between the workers.
+- Workers share the sentiment result cache and the geolocation cache
+  through SQLite files in SHARED_CACHE_DIR (WAL mode, safe across processes).
+- One worker per available core by default (WEB_CONCURRENCY overrides it);
+  each worker scores batches in its own process instead of starting a
+  scoring pool, since the workers already use every core.
+"""
+import gc
+import importlib.util
+import os
+
+# ---------- Environment (read when the app is imported, so set it first) ----------
+
+SHARED_CACHE_DIR = os.getenv("SHARED_CACHE_DIR", "./cache")
+os.makedirs(SHARED_CACHE_DIR, exist_ok=True)
+os.environ.setdefault("SENTIMENT_CACHE_PATH", os.path.join(SHARED_CACHE_DIR, "sentiment.db"))
+os.environ.setdefault("GEOIP_CACHE_PATH", os.path.join(SHARED_CACHE_DIR, "geoip.db"))
+os.environ.setdefault("SENTIMENT_POOL_WORKERS", "1")
+
+# ---------- Server ----------
+
+bind = os.getenv("BIND", "127.0.0.1:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(len(os.sched_getaffinity(0)))))
+# uvicorn.workers is deprecated in favour of the uvicorn-worker package
+if importlib.util.find_spec("uvicorn_worker") is not None:
+    worker_class = "uvicorn_worker.UvicornWorker"
+else:
+    worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") != "0"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+
+
+# ---------- Hooks ----------
+
+def when_ready(server):
+    """
+    Runs in the master after the app is loaded and before the first fork.
+    """
+    if not preload_app:
+        return
+    import database
+    import ipconverter
+    import sentiment
+    import trendplot
+
+    database.init_db()  # once here, instead of racing in every worker
+    database.engine.dispose()
+    sentiment.preload()
+    ipconverter.get_geoip_db()
+    trendplot.preload()
+
+    # Move everything loaded so far out of the collector's reach: collections
+    # in the workers would otherwise touch (and so copy) these shared pages.
+    gc.collect()
+    gc.freeze()
+    server.log.info("Preloaded app state, %d objects frozen", gc.get_freeze_count())
+
+
+def post_fork(server, worker):
+    """
+    Runs in each new worker. Pooled connections belong to the master.
+    """
+    import database
+
+    database.engine.dispose(close=False)
@@ -1,25 +1,83 @@
-import requests
+import os
+import threading
+from cache import MISSING, SharedCache, TTLCache
+from geoip import IPRangeDatabase, is_public_ip
+from metrics import stage
 
+# Local IP-range database (DB-IP "IP to City Lite" CSV, plain or gzipped)
+GEOIP_DB_PATH = os.getenv("GEOIP_DB_PATH", "./geoip.csv.gz")
+
+# Bounded LRU/TTL cache keyed by IP. Failed and private lookups are cached as
+# None for a shorter time so they never hit the range table twice in a row.
+location_cache = TTLCache(
+    maxsize=int(os.getenv("GEOIP_CACHE_SIZE", "65536")),
+    ttl=float(os.getenv("GEOIP_CACHE_TTL", "86400")),
+    negative_ttl=float(os.getenv("GEOIP_NEGATIVE_TTL", "3600")),
+)
+
+# Optional second tier shared by every worker process (see gunicorn.conf.py)
+GEOIP_CACHE_PATH = os.getenv("GEOIP_CACHE_PATH") or None
+shared_location_cache = SharedCache(
+    GEOIP_CACHE_PATH,
+    ttl=location_cache.ttl,
+    negative_ttl=location_cache.negative_ttl,
+) if GEOIP_CACHE_PATH else None
+
+_db = None
+_db_lock = threading.Lock()
+
+
+def get_geoip_db():
+    """
+    Load the IP-range database on first use and return it.
+    Returns None if the database file is missing or unreadable.
+    """
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                try:
+                    _db = IPRangeDatabase.from_csv(GEOIP_DB_PATH)
+                except OSError as e:
+                    print("IP database unavailable, locations disabled:", e)
+                    _db = IPRangeDatabase()  # empty table: every lookup misses
+    return _db
+
+
+@stage("ip_to_location")
 def ip_to_location(ip: str = None):
-    try:
-        url = f"http://ip-api.com/json/{ip or ''}"  
-        params = {
-            "fields": "status,message,country,city,zip,lat,lon"
-        }  
-        resp = requests.get(url, params=params, timeout=5)
-        data = resp.json()
-
-        if data.get("status") == "success":
-            return {
-                "lat": data.get("lat"),
-                "lon": data.get("lon"),
-                "country": data.get("country"),
-                "city": data.get("city"),
-                "zip": data.get("zip")
-            }
-        else:
-            print("IP lookup failed:", data.get("message"))
-            return None
-    except Exception as e:
-        print("IP lookup exception:", e)
+    """
+    Convert an IP address to a location using the local IP-range database.
+    Never touches the network.
+
+    Args:
+        ip (str): IPv4 or IPv6 address of the client.
+
+    Returns:
+        dict or None: lat, lon, country, region, city and zip, or None if the
+                      address is private, invalid or not in the database.
+    """
+    if not ip:
         return None
+
+    loc = location_cache.get(ip)
+    if loc is not MISSING:
+        return loc
+
+    if shared_location_cache is not None:
+        loc = shared_location_cache.get(ip)
+        if loc is not MISSING:
+            location_cache.set(ip, loc)  # promote to this process's tier
+            return loc
+
+    loc = None
+    if is_public_ip(ip):
+        try:
+            loc = get_geoip_db().lookup(ip)
+        except Exception as e:
+            print("IP lookup exception:", e)
+
+    location_cache.set(ip, loc)  # None values use the negative TTL
+    if shared_location_cache is not None:
+        shared_location_cache.set(ip, loc)
+    return loc
@@ -0,0 +1,119 @@
+"""
+Local VADER lexicon loading.
+
+The lexicon is read from the first source that exists, without touching the
+network unless every local source is missing:
+
+1. a prebuilt pickle (`VADER_LEXICON_CACHE`, default `./vader_lexicon.pickle`);
+2. a lexicon text file named by `VADER_LEXICON_PATH`;
+3. the NLTK data package (`sentiment/vader_lexicon.zip`), if installed;
+4. the `vader_lexicon.txt` shipped with the `vaderSentiment` package;
+5. `nltk.download("vader_lexicon")`, unless `VADER_ALLOW_DOWNLOAD=0`.
+
+Build the pickle once (e.g. in the Docker image) with:
+
+    python lexicon.py
+"""
+import os
+import pickle
+import sys
+
+VADER_LEXICON_CACHE = os.getenv("VADER_LEXICON_CACHE", "./vader_lexicon.pickle")
+VADER_LEXICON_PATH = os.getenv("VADER_LEXICON_PATH")
+VADER_ALLOW_DOWNLOAD = os.getenv("VADER_ALLOW_DOWNLOAD", "1") != "0"
+
+NLTK_LEXICON_RESOURCE = "sentiment/vader_lexicon.zip/vader_lexicon/vader_lexicon.txt"
+
+
+def parse_lexicon(text: str) -> dict:
+    """
+    Parse VADER lexicon text (word<TAB>mean<TAB>...) into {word: valence}.
+    Same parsing as NLTK's `make_lex_dict`.
+    """
+    lex_dict = {}
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+        word, measure = line.split("\t")[0:2]
+        lex_dict[word] = float(measure)
+    return lex_dict
+
+
+def _read_text(path: str) -> str:
+    with open(path, encoding="utf-8") as fh:
+        return fh.read()
+
+
+def _nltk_lexicon_text():
+    import nltk
+
+    try:
+        return nltk.data.load(NLTK_LEXICON_RESOURCE, format="text")
+    except LookupError:
+        return None
+
+
+def _vader_package_lexicon_path():
+    try:
+        import vaderSentiment
+    except ImportError:
+        return None
+    path = os.path.join(os.path.dirname(vaderSentiment.__file__), "vader_lexicon.txt")
+    return path if os.path.exists(path) else None
+
+
+def load_lexicon() -> dict:
+    """
+    Load the VADER lexicon from the first available local source.
+
+    Returns:
+        dict: Mapping of token to valence.
+    """
+    if VADER_LEXICON_CACHE and os.path.exists(VADER_LEXICON_CACHE):
+        with open(VADER_LEXICON_CACHE, "rb") as fh:
+            return pickle.load(fh)
+
+    if VADER_LEXICON_PATH:
+        return parse_lexicon(_read_text(VADER_LEXICON_PATH))
+
+    text = _nltk_lexicon_text()
+    if text is not None:
+        return parse_lexicon(text)
+
+    path = _vader_package_lexicon_path()
+    if path is not None:
+        return parse_lexicon(_read_text(path))
+
+    if VADER_ALLOW_DOWNLOAD:
+        import nltk
+
+        nltk.download("vader_lexicon")
+        text = _nltk_lexicon_text()
+        if text is not None:
+            return parse_lexicon(text)
+
+    raise RuntimeError("VADER lexicon not found; set VADER_LEXICON_PATH or install the NLTK data package")
+
+
+def build_lexicon_cache(path: str = VADER_LEXICON_CACHE) -> dict:
+    """
+    Write the lexicon as a pickle so later startups skip parsing.
+    """
+    global VADER_LEXICON_CACHE
+
+    # Read from the text sources, not from a stale cache file
+    cache, VADER_LEXICON_CACHE = VADER_LEXICON_CACHE, None
+    try:
+        lexicon = load_lexicon()
+    finally:
+        VADER_LEXICON_CACHE = cache
+
+    with open(path, "wb") as fh:
+        pickle.dump(lexicon, fh, protocol=pickle.HIGHEST_PROTOCOL)
+    return lexicon
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else VADER_LEXICON_CACHE
+    print(f"Wrote {len(build_lexicon_cache(target))} lexicon entries to {target}")
@@ -0,0 +1,160 @@
+"""
+Live map and trend updates for WebSocket subscribers.
+
+The aggregate hooks stage deltas in the session while the transaction is
+open (`stage_saved` / `stage_located` / `stage_deleted`); they are published
+to `broker` only after the commit succeeds, and discarded on rollback.
+Nothing is computed when nobody is subscribed.
+
+Topics:
+- "map:<level>": per-cell deltas (count, score_sum, lat_sum, lon_sum) at a
+  map_cells grid level, coalesced per cell;
+- "map:points": newly located points (no text), for zoomed-in maps;
+- "trend:<scope>:<key>:<granularity>": per-bucket deltas (count, score_sum,
+  label counts), coalesced per bucket.
+"""
+import os
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from mapdata import POINTS_MIN_ZOOM, cell_of, level_for_zoom
+from pubsub import Broker
+from rollups import GRANULARITIES, LABEL_COLUMNS, SCOPES, bucket_start, scope_keys
+
+# Shared broker; bound to the event loop by the FastAPI lifespan
+broker = Broker(maxsize=int(os.getenv("LIVE_QUEUE_SIZE", "256")))
+
+_STAGED = "live_events"  # key in Session.info
+
+
+# ---------- Topic names ----------
+
+def resolve_topic(name: str, user=None) -> str:
+    """
+    Map a client topic name to a broker topic.
+
+    - "map:<zoom>" (Leaflet zoom) -> the grid level drawn at that zoom, or
+      "map:points" at POINTS_MIN_ZOOM and above;
+    - "trend:global:<granularity>", "trend:country:<name>:<granularity>";
+    - "trend:user:<granularity>" for the connection's own user.
+
+    Raises ValueError for unknown names.
+    """
+    parts = name.split(":")
+    if parts[0] == "map" and len(parts) == 2:
+        if parts[1] == "points":
+            return "map:points"
+        zoom = int(parts[1])
+        return "map:points" if zoom >= POINTS_MIN_ZOOM else f"map:{level_for_zoom(zoom)}"
+
+    if parts[0] == "trend" and len(parts) >= 3 and parts[-1] in GRANULARITIES:
+        scope, granularity = parts[1], parts[-1]
+        if scope == "global" and len(parts) == 3:
+            return f"trend:global::{granularity}"
+        if scope == "country" and len(parts) == 4 and parts[2]:
+            return f"trend:country:{parts[2]}:{granularity}"
+        if scope == "user" and len(parts) == 3:
+            if user is None:
+                raise ValueError("trend:user topics need a session token")
+            return f"trend:user:{user.id}:{granularity}"
+    raise ValueError(f"Unknown topic: {name}")
+
+
+# ---------- Deltas ----------
+
+def _merge(old: dict, new: dict) -> dict:
+    """
+    Combine two deltas for the same cell or bucket.
+    """
+    merged = dict(old)
+    for name, value in new.items():
+        if isinstance(value, dict):
+            merged[name] = _merge(old.get(name, {}), value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            merged[name] = old.get(name, 0) + value
+        else:
+            merged[name] = value
+    return merged
+
+
+def _map_events(rows, sign, topics):
+    levels = [int(t.split(":")[1]) for t in topics if t != "map:points"]
+    cells = {}
+    points = []
+    for row in rows:
+        lat, lon, score = row["latitude"], row["longitude"], row["score"] or 0.0
+        if lat is None or lon is None:
+            continue
+        for level in levels:
+            x, y = cell_of(lat, lon, level)
+            cell = f"{level}/{x}/{y}"
+            delta = {"cell": cell, "count": sign, "score_sum": sign * score, "lat_sum": sign * lat, "lon_sum": sign * lon}
+            cells[cell] = _merge(cells[cell], delta) if cell in cells else delta
+        if sign > 0 and "map:points" in topics:
+            points.append({"lat": lat, "lng": lon, "sentiment": row["sentiment"], "score": score, "country": row.get("country")})
+
+    events = [(f"map:{cell.split('/')[0]}", delta, cell) for cell, delta in cells.items()]
+    events.extend(("map:points", point, None) for point in points)
+    return events
+
+
+def _trend_events(rows, sign, topics, scopes):
+    wanted = set(topics)
+    buckets = {}
+    for row in rows:
+        if row.get("time") is None:
+            continue
+        label = row["sentiment"] if row["sentiment"] in LABEL_COLUMNS else None
+        for scope, key in scope_keys(row, scopes):
+            for granularity in GRANULARITIES:
+                topic = f"trend:{scope}:{key}:{granularity}"
+                if topic not in wanted:
+                    continue
+                bucket = bucket_start(row["time"], granularity).isoformat()
+                delta = {"bucket": bucket, "count": sign, "score_sum": sign * (row["score"] or 0.0),
+                         "labels": {label: sign} if label else {}}
+                k = (topic, bucket)
+                buckets[k] = _merge(buckets[k], delta) if k in buckets else delta
+    return [(topic, delta, bucket) for (topic, bucket), delta in buckets.items()]
+
+
+def _stage(db: Session, rows, sign: int, scopes):
+    if not rows:
+        return
+    topics = broker.active_topics()
+    if not topics:
+        return  # nobody listening: skip the work entirely
+
+    events = []
+    map_topics = [t for t in topics if t.startswith("map:")]
+    if map_topics:
+        events.extend(_map_events(rows, sign, map_topics))
+    trend_topics = [t for t in topics if t.startswith("trend:")]
+    if trend_topics:
+        events.extend(_trend_events(rows, sign, trend_topics, scopes))
+    if events:
+        db.info.setdefault(_STAGED, []).extend(events)
+
+
+def stage_saved(db: Session, rows):
+    _stage(db, rows, 1, SCOPES)
+
+
+def stage_located(db: Session, rows):
+    _stage(db, rows, 1, ("country",))
+
+
+def stage_deleted(db: Session, rows):
+    _stage(db, rows, -1, SCOPES)
+
+
+# ---------- Publication on commit ----------
+
+@event.listens_for(Session, "after_commit")
+def _publish_staged(session):
+    for topic, payload, key in session.info.pop(_STAGED, ()):
+        broker.publish(topic, payload, key=key, merge=_merge if key is not None else None)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_staged(session):
+    session.info.pop(_STAGED, None)
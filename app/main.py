@@ -1,44 +1,112 @@
-import io
-from fastapi import FastAPI, Depends, File, Request, Form, UploadFile, WebSocket
-from fastapi.responses import HTMLResponse, StreamingResponse
+import asyncio
+import hmac
+import json
+from datetime import datetime
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, File, Request, Form, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import ValidationError
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-from database import Query, SessionLocal, User, init_db
-from crud import create_user, get_user_by_token, save_query, chat_history
-from sentiment import analyze_sentiment
-import matplotlib.pyplot as plt
-import matplotlib.cm as cm
+from sqlalchemy.ext.asyncio import AsyncSession
+import database
+from database import dispose_async_engine, get_async_sessionmaker, init_db
+from crud import (
+    GEO_ENRICHMENT_MODE, HISTORY_PAGE_SIZE, QUERY_WRITE_MODE, UserRecord, token_cache,
+    create_user_async, delete_query_async, history_page_async, resolve_token_async,
+    save_queries_bulk_async, save_query_async,
+)
+from cache import MISSING
+from enrichment import geo_queue
+from writer import query_writer
+from live import broker, resolve_topic
+from pubsub import RESYNC
+from uploads import create_job, detect_format, get_job, job_dict, new_job_id, new_upload_path, spool_upload, upload_jobs
+from retention import retention_job
+from provisioning import ON_EXISTING, PROVISION_API_KEY, PROVISION_MAX_BATCH, provision_users_async
+from admission import AdmissionMiddleware, BodyTooLarge, admission
+from search import SEARCH_PAGE_SIZE, search_filters, search_queries_async
+from export import EXPORT_API_KEY, EXPORT_CHUNK_SIZE, EXPORT_STREAMS, analytics, export_filters, parquet_available
+from metrics import MetricsMiddleware, cache_gauges, collector, pool_gauges, render_prometheus, stage
+from ipconverter import get_geoip_db, location_cache, shared_location_cache
+from pagecache import StaticPageCache, enable_bytecode_cache
+from mapdata import POINTS_MIN_ZOOM, clusters, parse_bbox, point_dict, points_query, stream_points
+from rollups import trend_series
+from trendplot import png_cache, render_trend_png_async, shutdown_render_pool, trend_etag, trend_points, trend_watermark
+from models import TEXT_MAX_LENGTH, HistoryListOut, QueryHistoryOut, SentimentAnalysisOut, SentimentRequest
+from sentiment import PROCESS_POOL_MIN_BATCH, analyze_batch_async, analyze_sentiment_async, shutdown_process_pool
+from sentiment_cache import result_cache
 
 # ---------- Initialize database and FastAPI ----------
 
-init_db()  # Create all tables if they don't exist
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Create tables and start background workers on startup; drain them on shutdown.
+    Heavy modules (VADER lexicon, matplotlib) are loaded on first use instead;
+    the IP-range table is loaded here, since the first saved query needs it.
+    """
+    init_db()  # Apply pending schema migrations
+    get_geoip_db()  # parse the IP ranges now, not inside the first request that saves a query
+    static_pages.prerender()
+    broker.bind(asyncio.get_running_loop())  # live updates are delivered on this loop
+    if GEO_ENRICHMENT_MODE == "async":
+        geo_queue.start()
+    if QUERY_WRITE_MODE == "batched":
+        query_writer.start()
+    upload_jobs.start()  # also resumes jobs interrupted by a previous shutdown
+    retention_job.start()
+    yield
+    retention_job.stop()
+    upload_jobs.stop()  # hands the current job back after its chunk is committed
+    query_writer.stop()  # commit queued rows (may queue geolocation work)
+    geo_queue.stop()  # flush pending geolocation updates before exiting
+    shutdown_process_pool()
+    shutdown_render_pool()
+    await dispose_async_engine()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)  # per-route latency histograms (see /metrics)
+app.add_middleware(AdmissionMiddleware)  # size caps, rate limits and load shedding on the scoring endpoints
+admission.watch(query_writer, geo_queue)
 templates = Jinja2Templates(directory="templates")  # Directory for Jinja2 HTML templates
+enable_bytecode_cache(templates.env)  # compiled templates survive restarts
+
+# Pages whose HTML never varies: rendered once at startup, served with ETags
+static_pages = StaticPageCache(templates)
+static_pages.add("home", "welcome.html")
+static_pages.add("about", "about.html")
+static_pages.add("register", "auth/register.html")
+static_pages.add("map", "sentiment/sentiment_map.html")
+static_pages.add("trend", "trend.html")
+static_pages.add("sentiment_form", "/sentiment/sentiment_form.html", {
+    "text": "",
+    "sentiment": None,
+    "score": None,
+    "error": None
+})
 
 # ---------- Dependency: database session ----------
 
-def get_db():
+async def get_db():
     """
-    Dependency that provides a SQLAlchemy database session for each request.
+    Dependency that provides an async SQLAlchemy session for each request.
     Ensures proper closing of the session after request.
     """
-    db = SessionLocal()
-    try:
+    async with get_async_sessionmaker()() as db:
         yield db
-    finally:
-        db.close()
 
 # ---------- Registration Endpoints ----------
 
 @app.get("/register", response_class=HTMLResponse)
-def register_form(request: Request):
+async def register_form(request: Request):
     """
     Display the registration form page.
     """
-    return templates.TemplateResponse("auth/register.html", {"request": request})
+    return static_pages.response(request, "register")
 
 @app.post("/register", response_class=HTMLResponse)
-def register_user(request: Request, username: str = Form(...), db: Session = Depends(get_db)):
+async def register_user(request: Request, username: str = Form(...), db: AsyncSession = Depends(get_db)):
     """
     Handle user registration:
     - Create a new user with a unique session token.
@@ -46,27 +114,51 @@ def register_user(request: Request, username: str = Form(...), db: Session = Dep
     - Return a welcome page with username and token.
     """
     client_host = request.client.host  # Get client IP
-    db_user = create_user(db, username, ip_address=client_host)
+    db_user = await create_user_async(db, username, ip_address=client_host)
     return templates.TemplateResponse("welcome.html", {
         "request": request,
         "username": db_user.username,
         "session_token": db_user.session_token
     })
 
+@app.post("/users/bulk")
+async def provision_users_endpoint(request: Request, on_existing: str = "skip", db: AsyncSession = Depends(get_db)):
+    """
+    Register many users in one transaction (for migrations and provisioning).
+
+    The body is a JSON array of usernames or `{"username", "ip_address"}`
+    objects. Requires the `X-API-Key` header to match PROVISION_API_KEY (the
+    endpoint is disabled when it is unset). `on_existing=rotate` issues new
+    tokens to users that already exist. Returns per-row statuses and tokens;
+    use `python provisioning.py` for files larger than PROVISION_MAX_BATCH.
+    """
+    if not api_key_matches(request, PROVISION_API_KEY):
+        return JSONResponse({"error": "Invalid API key."}, status_code=403)
+    if on_existing not in ON_EXISTING:
+        return JSONResponse({"error": f"on_existing must be one of {', '.join(ON_EXISTING)}."}, status_code=400)
+    try:
+        rows = json.loads(await request.body())
+    except ValueError:
+        rows = None
+    if not isinstance(rows, list):
+        return JSONResponse({"error": "Body must be a JSON array of usernames or {\"username\": ...} objects."}, status_code=422)
+    if len(rows) > PROVISION_MAX_BATCH:
+        return JSONResponse({"error": f"Batch too large (max {PROVISION_MAX_BATCH} users)."}, status_code=413)
+
+    results = await provision_users_async(db, rows, on_existing)
+    counts = {}
+    for result in results:
+        counts[result.status] = counts.get(result.status, 0) + 1
+    return {"counts": counts, "results": [result._asdict() for result in results]}
+
 # ---------- Sentiment Form ----------
 
 @app.get("/sentiment-form", response_class=HTMLResponse)
-def sentiment_form(request: Request):
+async def sentiment_form(request: Request):
     """
     Render the sentiment analysis form page with empty default values.
     """
-    return templates.TemplateResponse("/sentiment/sentiment_form.html", {
-        "request": request,
-        "text": "",
-        "sentiment": None,
-        "score": None,
-        "error": None
-    })
+    return static_pages.response(request, "sentiment_form")
 
 # ---------- Utility functions ----------
 
@@ -79,31 +171,50 @@ def render_error(request: Request, message: str):
         "error": message
     })
 
-def verify_user(request: Request, db: Session, token: str):
+@app.exception_handler(BodyTooLarge)
+async def body_too_large(request: Request, exc: BodyTooLarge):
+    """
+    Answer a body cut off by the admission middleware like other 413s.
+    """
+    return JSONResponse({"error": exc.detail}, status_code=413)
+
+async def verify_user(request: Request, db: AsyncSession, token: str):
     """
     Verify that a session token belongs to a valid user.
-    Returns the User object if valid, otherwise renders an error.
+    Returns the UserRecord if valid, otherwise renders an error.
     """
-    user = get_user_by_token(db, token)
+    user = await resolve_token_async(db, token)
     if not user:
         return render_error(request, 'Invalid session token. <a href="/register">Register here</a>')
     return user
 
+def api_key_matches(request: Request, expected: str) -> bool:
+    """
+    Check the `X-API-Key` header against a configured key, in constant time.
+    Always False when the key is unset, which disables the endpoint.
+    """
+    key = request.headers.get("x-api-key", "")
+    return bool(expected) and hmac.compare_digest(key.encode(), expected.encode())
+
 # ---------- Sentiment Analysis Endpoint ----------
 
 @app.post("/sentiment", response_class=HTMLResponse)
-def sentiment_analysis(request: Request, text: str = Form(...), token: str = Form(...), db: Session = Depends(get_db)):
+async def sentiment_analysis(request: Request, text: str = Form(...), token: str = Form(...), db: AsyncSession = Depends(get_db)):
     """
     Process a text for sentiment analysis:
     - Verify user token.
-    - Analyze sentiment using VADER.
+    - Analyze sentiment using VADER (on the scoring executor).
     - Save query to database.
     - Render the form page again with results.
     """
     ip_address = request.client.host  # Capture user's IP
-    user = verify_user(db=db, token=token, request=request)
-    result = analyze_sentiment(text)
-    save_query(db, user, text, result["sentiment"], result["score"], ip_address, result["confidence"], result["details"])
+    user = await verify_user(db=db, token=token, request=request)
+    if not isinstance(user, UserRecord):
+        return user  # error page
+    if len(text) > TEXT_MAX_LENGTH:
+        return render_error(request, f"Text too long (max {TEXT_MAX_LENGTH} characters).")
+    result = await analyze_sentiment_async(text, lean=True)
+    await save_query_async(db, user, text, result["sentiment"], result["score"], ip_address, result["confidence"], result["details"])
 
     data = {
         "request": request,
@@ -113,147 +224,648 @@ def sentiment_analysis(request: Request, text: str = Form(...), token: str = For
         "result": result["details"],
         "error": None
     }
-    return templates.TemplateResponse("sentiment/sentiment_form.html", data)
+    with stage("render"):
+        return templates.TemplateResponse("sentiment/sentiment_form.html", data)
+
+# ---------- Batch Sentiment Endpoint ----------
+
+BATCH_INSERT_SIZE = 1000  # rows per bulk INSERT
+# Texts per analyze_batch call: at least the process pool threshold, so large
+# batches are scored in parallel
+BATCH_CHUNK_SIZE = max(PROCESS_POOL_MIN_BATCH, BATCH_INSERT_SIZE)
+MAX_BATCH_SIZE = 100000  # texts per request (JSON array items or NDJSON lines)
+
+
+async def score_and_save(db: AsyncSession, user, texts, ip_address):
+    """
+    Score a chunk of texts in one batch and persist them with bulk inserts of
+    `BATCH_INSERT_SIZE` rows. Returns the results as `SentimentAnalysisOut` models.
+    """
+    results = await analyze_batch_async(texts)
+    for start in range(0, len(results), BATCH_INSERT_SIZE):
+        await save_queries_bulk_async(db, user, results[start:start + BATCH_INSERT_SIZE], ip_address)
+    return [SentimentAnalysisOut(**r) for r in results]
+
+
+async def read_ndjson(request: Request):
+    """
+    Yield (line_number, SentimentRequest or error message) from an NDJSON body
+    as it arrives, without buffering the whole upload.
+    """
+    buffer = b""
+    line_no = 0
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_no += 1
+            if line.strip():
+                yield line_no, parse_ndjson_line(line)
+    if buffer.strip():
+        yield line_no + 1, parse_ndjson_line(buffer)
+
+
+def parse_ndjson_line(line: bytes):
+    try:
+        return SentimentRequest.model_validate_json(line)
+    except ValidationError as e:
+        return f"Invalid line: {e.errors()[0]['msg']}"
+
+
+async def ndjson_chunk(db: AsyncSession, user, chunk, ip_address) -> str:
+    """
+    Score and save a chunk of parsed NDJSON lines, and return one JSON line
+    per input line, in input order: the result, or the parse error, tagged
+    with its `line` number.
+    """
+    texts = [item.text for _, item in chunk if not isinstance(item, str)]
+    results = iter(await score_and_save(db, user, texts, ip_address) if texts else [])
+    lines = []
+    for line_no, item in chunk:
+        if isinstance(item, str):
+            lines.append(json.dumps({"line": line_no, "error": item}))
+        else:
+            lines.append(json.dumps({"line": line_no, **next(results).model_dump(mode="json")}))
+    return "\n".join(lines) + "\n"
+
+
+async def score_ndjson(db: AsyncSession, user, request: Request, ip_address) -> list[str]:
+    """
+    Score and save an NDJSON body in chunks of `BATCH_CHUNK_SIZE` lines as
+    they arrive, so at most one chunk of input is held at a time. Stops
+    reading after `MAX_BATCH_SIZE` lines, with an error for the next one.
+    Returns the result lines chunk by chunk (see `ndjson_chunk`).
+    """
+    output = []
+    chunk = []
+    count = 0
+    async for line_no, item in read_ndjson(request):
+        count += 1
+        if count > MAX_BATCH_SIZE:
+            chunk.append((line_no, f"Batch too large (max {MAX_BATCH_SIZE} lines); the rest was not read."))
+            break
+        chunk.append((line_no, item))
+        if len(chunk) == BATCH_CHUNK_SIZE:
+            output.append(await ndjson_chunk(db, user, chunk, ip_address))
+            chunk = []
+    if chunk:
+        output.append(await ndjson_chunk(db, user, chunk, ip_address))
+    return output
+
+
+@app.post("/sentiment/batch", response_model=list[SentimentAnalysisOut])
+async def sentiment_batch(request: Request, token: str, db: AsyncSession = Depends(get_db)):
+    """
+    Analyze many texts in one request.
+
+    Accepts either a JSON array of `{"text": ...}` objects, or an NDJSON
+    stream (`Content-Type: application/x-ndjson`) with one object per line.
+    Texts are scored in chunks of `BATCH_CHUNK_SIZE` (across the process pool
+    for large batches) and saved with bulk inserts of `BATCH_INSERT_SIZE` rows.
+
+    JSON input returns a JSON array of results; NDJSON input returns one
+    result (or error) per input line, in input order, each with its `line`.
+    Either way at most `MAX_BATCH_SIZE` texts are accepted.
+    """
+    user = await resolve_token_async(db, token)
+    if not user:
+        return JSONResponse({"error": "Invalid session token."}, status_code=401)
+    ip_address = request.client.host
+
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        # Scored while the body arrives; the results are sent once it is read,
+        # as a streaming response would listen on the same receive channel
+        # for a client disconnect
+        lines = await score_ndjson(db, user, request, ip_address)
+        return StreamingResponse(iter(lines), media_type="application/x-ndjson")
+
+    invalid = JSONResponse(
+        {"error": f"Body must be a JSON array of {{\"text\": ...}} objects (texts up to {TEXT_MAX_LENGTH} characters)."},
+        status_code=422,
+    )
+    try:
+        body = json.loads(await request.body())
+    except ValueError:
+        return invalid
+    if not isinstance(body, list):
+        return invalid
+    if len(body) > MAX_BATCH_SIZE:
+        return JSONResponse({"error": f"Batch too large (max {MAX_BATCH_SIZE} texts)."}, status_code=413)
+    try:
+        items = [SentimentRequest.model_validate(i) for i in body]
+    except ValidationError:
+        return invalid
+
+    texts = [i.text for i in items]
+    results = []
+    for start in range(0, len(texts), BATCH_CHUNK_SIZE):
+        results.extend(await score_and_save(db, user, texts[start:start + BATCH_CHUNK_SIZE], ip_address))
+    return results
+
+# ---------- File Uploads ----------
+
+@app.post("/upload", status_code=202)
+async def upload_file(
+    request: Request,
+    token: str,
+    file: UploadFile = File(...),
+    format: str = Form("auto"),
+    column: str = Form("text"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Upload a text, CSV or JSONL file and score it in the background.
+
+    - `format` is text (one text per line), jsonl (`{"text": ...}` per line),
+      csv (texts in `column`), or auto (guessed from the file extension).
+    The file is written to disk in blocks and scored chunk by chunk; poll
+    `/upload/{job_id}` for progress and summary statistics.
+    """
+    user = await resolve_token_async(db, token)
+    if not user:
+        return JSONResponse({"error": "Invalid session token."}, status_code=401)
+    try:
+        fmt = detect_format(file.filename, format)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    job_id = new_job_id()
+    path = new_upload_path(job_id)
+    size = await spool_upload(file, path)
+    await db.run_sync(create_job, job_id, user.id, file.filename, fmt, column, path, size, request.client.host)
+    upload_jobs.submit(job_id)
+    return {"job_id": job_id, "status": "pending", "size": size}
+
+
+@app.get("/upload/{job_id}")
+async def upload_status(job_id: str, token: str, db: AsyncSession = Depends(get_db)):
+    """
+    Return the progress and summary statistics of one of the user's upload jobs.
+    """
+    user = await resolve_token_async(db, token)
+    if not user:
+        return JSONResponse({"error": "Invalid session token."}, status_code=401)
+    job = await db.run_sync(get_job, job_id, user.id)
+    if job is None:
+        return JSONResponse({"error": "Job not found."}, status_code=404)
+    return job_dict(job)
 
 # ---------- Map Page ----------
 
 @app.get("/map")
-def map_page(request: Request):
+async def map_page(request: Request):
     """
     Render a page showing a map of sentiment locations.
     """
-    return templates.TemplateResponse("sentiment/sentiment_map.html", {"request": request})
+    return static_pages.response(request, "map")
 
 @app.get("/sentiment-map")
-def sentiment_map(db: Session = Depends(get_db)):
-    """
-    Return JSON data of all queries with location and sentiment info.
-    Used to populate a frontend map.
-    """
-    data = db.query(Query).all()
-    result = []
-    for q in data:
-        result.append({
-            "lat": q.latitude,
-            "lng": q.longitude,
-            "sentiment": q.sentiment if q.sentiment else "Unknown",
-            "score": float(q.score) if q.score is not None else 0.0,
-            "city": q.city if q.city else "Unknown City",
-            "country": q.country if q.country else "Unknown Country",
-            "text": q.text if q.text else "No text",
-            "uid": q.user_id
-        })
-    return result
+async def sentiment_map(bbox: str | None = None, format: str = "json", limit: int | None = None, db: AsyncSession = Depends(get_db)):
+    """
+    Return located queries with sentiment info, used to populate a frontend map.
+
+    - `bbox=west,south,east,north` restricts the points to the visible area.
+    - `format=ndjson` streams one point per line with constant memory;
+      the default returns a JSON array.
+    Only the columns the map needs are read, never full ORM rows.
+    """
+    try:
+        box = parse_bbox(bbox)
+    except ValueError:
+        return JSONResponse({"error": "bbox must be west,south,east,north"}, status_code=400)
+
+    if format == "ndjson":
+        lines = (json.dumps(point) + "\n" for point in stream_points(box))
+        return StreamingResponse(lines, media_type="application/x-ndjson")
+
+    def load(session):
+        query = points_query(session, box)
+        if limit:
+            query = query.limit(limit)
+        return [point_dict(row) for row in query]
+
+    return await db.run_sync(load)
+
+@app.get("/sentiment-map/clusters")
+async def sentiment_map_clusters(zoom: int = 2, bbox: str | None = None, db: AsyncSession = Depends(get_db)):
+    """
+    Return pre-aggregated grid cells (count, mean score, centroid) for the
+    visible area at a map zoom level. Cells are maintained as queries are saved.
+    """
+    try:
+        box = parse_bbox(bbox)
+    except ValueError:
+        return JSONResponse({"error": "bbox must be west,south,east,north"}, status_code=400)
+
+    return {
+        "zoom": zoom,
+        "points_min_zoom": POINTS_MIN_ZOOM,  # below this zoom the map draws cells
+        "cells": await db.run_sync(clusters, zoom, box),
+    }
+
+# ---------- Export & Analytics ----------
+
+@app.get("/export/queries")
+def export_queries(
+    request: Request,
+    format: str = "csv",
+    start: datetime | None = None,
+    end: datetime | None = None,
+    sentiment: str | None = None,
+    country: str | None = None,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+):
+    """
+    Stream every query matching the filters, for offline analysis.
+
+    - `format` is csv (default), ndjson, columns (one JSON object of column
+      arrays per chunk) or parquet (needs pyarrow).
+    - `start`/`end` bound the time range; `sentiment` and `country` filter
+      on the label and country.
+    Rows are read with a server-side cursor in chunks of `chunk_size`, so
+    memory stays constant regardless of the table size. Requires the
+    `X-API-Key` header to match EXPORT_API_KEY (disabled when it is unset),
+    as exports hold every user's texts.
+    """
+    if not api_key_matches(request, EXPORT_API_KEY):
+        return JSONResponse({"error": "Invalid API key."}, status_code=403)
+    if format not in EXPORT_STREAMS:
+        return JSONResponse({"error": f"format must be one of {', '.join(EXPORT_STREAMS)}"}, status_code=400)
+    if format == "parquet" and not parquet_available():
+        return JSONResponse({"error": "format=parquet needs the pyarrow package"}, status_code=400)
+    try:
+        conditions = export_filters(start, end, sentiment, country)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    stream, media_type = EXPORT_STREAMS[format]
+    extension = {"columns": "ndjson"}.get(format, format)
+    headers = {"Content-Disposition": f'attachment; filename="queries.{extension}"'}
+    return StreamingResponse(stream(conditions, max(1, min(chunk_size, 100000))), media_type=media_type, headers=headers)
+
+
+@app.get("/analytics")
+async def analytics_summary(
+    request: Request,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    sentiment: str | None = None,
+    country: str | None = None,
+    bins: int = 20,
+    top: int = 10,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Return aggregate statistics over the queries matching the filters:
+    totals, label distribution, score histogram (`bins` bins over [-1, 1])
+    and the `top` cities by query count. Requires the `X-API-Key` header
+    to match EXPORT_API_KEY, like `/export/queries`.
+    """
+    if not api_key_matches(request, EXPORT_API_KEY):
+        return JSONResponse({"error": "Invalid API key."}, status_code=403)
+    try:
+        conditions = export_filters(start, end, sentiment, country)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return await db.run_sync(analytics, conditions, max(1, min(bins, 200)), max(1, min(top, 100)))
+
+# ---------- Search ----------
+
+@app.get("/search")
+async def search(
+    q: str,
+    token: str | None = None,
+    sentiment: str | None = None,
+    min_score: float | None = None,
+    max_score: float | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    country: str | None = None,
+    order: str = "relevance",
+    cursor: str | None = None,
+    limit: int = SEARCH_PAGE_SIZE,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Search the user's saved queries by keyword, through the full-text index.
+
+    - `q`: words that must all appear (`word*` matches a prefix).
+    - `token`: the user's session token (required: only their queries are searched).
+    - `sentiment`, `min_score`/`max_score`, `start`/`end` and `country` filter
+      the matches.
+    - `order` is relevance (default) or newest; pass `next_cursor` back as
+      `cursor` for the next page.
+    """
+    user = await resolve_token_async(db, token) if token else None
+    if not user:
+        return JSONResponse({"error": "Invalid session token."}, status_code=401)
+    try:
+        conditions = search_filters(sentiment, min_score, max_score, start, end, country)
+        results, next_cursor = await search_queries_async(db, q, user.id, conditions, order, cursor, limit)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return {"results": results, "next_cursor": next_cursor}
 
 # ---------- About Page ----------
 
 @app.get("/about", response_class=HTMLResponse)
-def about_page(request: Request):
+async def about_page(request: Request):
     """
     Render an About page.
     """
-    return templates.TemplateResponse("about.html", {"request": request})
+    return static_pages.response(request, "about")
 
 # ---------- History Page ----------
 
 @app.get("/history", response_class=HTMLResponse)
-def history(request: Request, token: str | None = None, db: Session = Depends(get_db)):
+async def history(request: Request, token: str | None = None, db: AsyncSession = Depends(get_db)):
     """
     Show the query history for a user identified by session token.
+    Only the first page is rendered; the page fetches the rest from /history/data.
     """
     if token is None:
         return render_error(request, "Missing session token.")
 
-    user = get_user_by_token(db, token)
+    user = await resolve_token_async(db, token)
     if not user:
         return render_error(request, "Invalid session token.")
 
-    queries = db.query(Query).filter(Query.user_id == user.id).order_by(Query.time.desc()).all()
+    queries, next_cursor = await history_page_async(db, user.id)
     return templates.TemplateResponse("history.html", {
         "request": request,
         "queries": queries,
+        "next_cursor": next_cursor,
         "username": user.username
     })
 
+@app.get("/history/data", response_model=HistoryListOut)
+async def history_data(token: str, cursor: str | None = None, limit: int = HISTORY_PAGE_SIZE, db: AsyncSession = Depends(get_db)):
+    """
+    Return one page of a user's history as JSON, newest first.
+    Pass the returned `next_cursor` as `cursor` to get the following page.
+    """
+    user = await resolve_token_async(db, token)
+    if not user:
+        return JSONResponse({"error": "Invalid session token."}, status_code=401)
+
+    try:
+        queries, next_cursor = await history_page_async(db, user.id, cursor=cursor, limit=limit)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    return HistoryListOut(
+        username=user.username,
+        queries=[QueryHistoryOut.model_validate(q) for q in queries],
+        next_cursor=next_cursor,
+    )
+
 # ---------- Delete Query ----------
 
 @app.delete("/delete-query/{query_id}")
-def delete_query(query_id: int, token: str, db: Session = Depends(get_db)):
+async def delete_query(query_id: int, token: str, db: AsyncSession = Depends(get_db)):
     """
     Delete a specific query by ID for a user.
     Returns JSON success or error.
     """
-    user = get_user_by_token(db, token)
+    user = await resolve_token_async(db, token)
     if not user:
         return {"error": "Invalid session token."}
 
-    query = db.query(Query).filter(Query.id == query_id, Query.user_id == user.id).first()
-    if not query:
+    if not await delete_query_async(db, user.id, query_id):
         return {"error": "Query not found."}
-
-    db.delete(query)
-    db.commit()
     return {"success": True}
 
 # ---------- Trend Page ----------
 
 @app.get("/trend_page", response_class=HTMLResponse)
-def trend_page(request: Request):
+async def trend_page(request: Request):
     """
     Render a page for showing sentiment trend over time.
     """
-    return templates.TemplateResponse("trend.html", {"request": request})
+    return static_pages.response(request, "trend")
 
 @app.get("/trend")
-def trend(token: str, db: Session = Depends(get_db)):
+async def trend(request: Request, token: str, db: AsyncSession = Depends(get_db)):
     """
     Generate a sentiment trend plot for a user over time:
     - Fetch user's queries.
     - Plot scores over time with points colored by location.
     - Return as a PNG image.
+
+    Images are cached per user and data version and carry an ETag, so an
+    unchanged trend is answered with 304 (or from cache) without re-rendering.
+    Rendering itself runs in a bounded worker pool, off the event loop.
     """
-    history = db.query(Query).join(User).filter(User.session_token == token).order_by(Query.time.asc()).all()
-    if not history:
+    user = await resolve_token_async(db, token)
+    if not user:
         return {"error": "No history found"}
 
-    times = [q.time for q in history]
-    scores = [q.score for q in history]
-    locations = [f"{q.country or 'Unknown'} - {q.city or 'Unknown'}" for q in history]
+    watermark = await db.run_sync(trend_watermark, user.id)
+    if watermark[0] == 0:
+        return {"error": "No history found"}
+
+    etag = trend_etag(user.id, user.session_token, watermark)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    key = (user.id, user.session_token, watermark)
+    png = png_cache.get(key)
+    if png is MISSING:
+        rows = await db.run_sync(trend_points, user.id)
+        png = await render_trend_png_async(rows)
+        png_cache.set(key, png)
+
+    return Response(png, media_type="image/png", headers=headers)
+
+@app.get("/trend/data")
+async def trend_data(
+    scope: str = "user",
+    key: str | None = None,
+    token: str | None = None,
+    granularity: str = "hour",
+    start: datetime | None = None,
+    end: datetime | None = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Return a sentiment time series as JSON, read from the pre-aggregated rollups.
+
+    - `scope=user` (default) uses the user identified by `token`.
+    - `scope=country&key=<country>` gives a per-country trend.
+    - `scope=global` covers every query.
+    `granularity` is minute, hour or day; `start`/`end` bound the range.
+    """
+    if scope == "user":
+        user = await resolve_token_async(db, token) if token else None
+        if not user:
+            return JSONResponse({"error": "Invalid session token."}, status_code=401)
+        key = str(user.id)
+    elif scope == "global":
+        key = ""
+    elif not key:
+        return JSONResponse({"error": "Missing key for this scope."}, status_code=400)
+
+    try:
+        buckets = await db.run_sync(trend_series, scope, key, granularity, start, end)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
 
-    unique_locations = list(set(locations))
-    cmap = cm.get_cmap("tab10", len(unique_locations))
-    color_map = {loc: cmap(i) for i, loc in enumerate(unique_locations)}
+    return {"scope": scope, "key": key, "granularity": granularity, "buckets": buckets}
+
+# ---------- WebSockets ----------
+
+def parse_ws_text(message: str) -> str:
+    """
+    Accept either a raw text message or a JSON `{"text": ...}` object.
+    """
+    if message.lstrip().startswith("{"):
+        try:
+            return SentimentRequest.model_validate_json(message).text
+        except ValidationError:
+            pass
+    return message
+
+
+@app.websocket("/ws/sentiment")
+async def ws_sentiment(websocket: WebSocket, token: str, db: AsyncSession = Depends(get_db)):
+    """
+    Score texts as they arrive over a WebSocket.
 
-    plt.figure(figsize=(12, 6))
-    plt.title("Sentiment Trend Colored by Location")
-    plt.xlabel("Time")
-    plt.ylabel("Sentiment Score (Compound)")
-    plt.grid(True)
+    Each message (raw text or `{"text": ...}`) is analyzed, saved like a
+    /sentiment request, and answered with one `SentimentAnalysisOut` message,
+    in order. Messages over the rate limit or TEXT_MAX_LENGTH are answered
+    with `{"error": ...}` instead.
+    """
+    user = await resolve_token_async(db, token)
+    if not user:
+        await websocket.close(code=1008, reason="Invalid session token.")
+        return
 
-    for i, q in enumerate(history):
-        plt.scatter(
-            q.time,
-            q.score,
-            color=color_map[locations[i]],
-            s=60,
-            label=locations[i] if i == locations.index(locations[i]) else ""
-        )
+    await websocket.accept()
+    ip_address = websocket.client.host
+    try:
+        while True:
+            text = parse_ws_text(await websocket.receive_text())
+            wait = admission.allow_message(ip_address, token)
+            if wait:
+                await websocket.send_json({"error": "Rate limit exceeded.", "retry_after": round(wait, 3)})
+                continue
+            if len(text) > TEXT_MAX_LENGTH:
+                await websocket.send_json({"error": f"Text too long (max {TEXT_MAX_LENGTH} characters)."})
+                continue
+            result = await analyze_sentiment_async(text, lean=True)
+            await save_query_async(db, user, text, result["sentiment"], result["score"], ip_address,
+                                   result["confidence"], result["details"])
+            await websocket.send_text(SentimentAnalysisOut(text=text, **result).model_dump_json())
+    except WebSocketDisconnect:
+        pass
+
+
+@app.websocket("/ws/live")
+async def ws_live(websocket: WebSocket, token: str | None = None, db: AsyncSession = Depends(get_db)):
+    """
+    Push live map and trend updates.
+
+    The client sends `{"subscribe": [...], "unsubscribe": [...]}` with topic
+    names such as "map:<zoom>", "trend:global:minute",
+    "trend:country:<name>:hour" or "trend:user:day" (needs `token`), and
+    receives JSON arrays of `{"topic", "data"}` deltas. Each connection has a
+    bounded buffer where updates to the same cell or bucket are merged, so a
+    slow client gets fewer, larger updates instead of slowing the server; if
+    it still overflows, a topic's pending deltas are replaced by a
+    `{"resync": topic}` marker and the client reloads that topic's state.
+    """
+    user = await resolve_token_async(db, token) if token else None
+    await websocket.accept()
+    subscription = broker.subscribe()
+
+    async def pump():
+        while True:
+            events = await subscription.get_many()
+            await websocket.send_json([
+                {"resync": topic} if data is RESYNC else {"topic": topic, "data": data} for topic, data in events
+            ])
+
+    sender = asyncio.create_task(pump())
+    try:
+        while True:
+            message = await websocket.receive_json()
+            try:
+                add = [resolve_topic(name, user) for name in message.get("subscribe", [])]
+                remove = [resolve_topic(name, user) for name in message.get("unsubscribe", [])]
+            except (ValueError, AttributeError) as e:
+                await websocket.send_json({"error": str(e)})
+                continue
+            broker.unsubscribe(subscription, remove)
+            broker.subscribe(subscription, add)
+            await websocket.send_json({"subscribed": sorted(subscription.topics)})
+    except (WebSocketDisconnect, json.JSONDecodeError):
+        pass
+    finally:
+        sender.cancel()
+        broker.unsubscribe(subscription)
 
-    plt.plot(times, scores, linestyle="--", color="gray", alpha=0.4)
-    plt.legend(title="Country - City", fontsize=8)
+# ---------- Runtime Stats ----------
 
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png", dpi=150, bbox_inches="tight")
-    buf.seek(0)
-    plt.close()
+@app.get("/stats")
+def runtime_stats():
+    """
+    Return cache and background queue counters as JSON.
+    """
+    return {
+        "sentiment_cache": result_cache.stats(),
+        "geoip_cache": location_cache.stats(),
+        "geoip_shared_cache": shared_location_cache.stats() if shared_location_cache is not None else None,
+        "auth_cache": token_cache.stats(),
+        "query_writer": query_writer.stats(),
+        "geo_queue": geo_queue.stats(),
+        "upload_jobs": upload_jobs.stats(),
+        "retention": retention_job.stats(),
+        "static_pages": static_pages.stats(),
+        "live": broker.stats(),
+        "admission": admission.stats(),
+    }
 
-    return StreamingResponse(buf, media_type="image/png")
+@collector
+def app_gauges():
+    """
+    Cache, pool and queue gauges reported by /metrics.
+    """
+    gauges = []
+    gauges += cache_gauges("sentiment_results", result_cache.stats()["memory"])
+    gauges += cache_gauges("geoip", location_cache.stats())
+    gauges += cache_gauges("auth", token_cache.stats())
+    gauges += cache_gauges("trend_png", png_cache.stats())
+    gauges += pool_gauges("sync", database.engine)
+    if database._async_engine is not None:
+        gauges += pool_gauges("async", database._async_engine.sync_engine)
+    for name, queue in (("query_writer", query_writer), ("geo_enrichment", geo_queue)):
+        stats = queue.stats()
+        gauges.append(("queue_depth", {"queue": name}, stats["depth"]))
+        gauges.append(("queue_capacity", {"queue": name}, stats["capacity"]))
+    gauges.append(("live_subscribers", {}, broker.stats()["subscribers"]))
+    stats = admission.stats()
+    gauges.append(("admission_inflight", {}, stats["inflight"]))
+    gauges.append(("admission_concurrency_limit", {}, stats["limit"]))
+    for reason, count in stats["rejected"].items():
+        gauges.append(("admission_rejected", {"reason": reason}, count))
+    return gauges
+
+
+@app.get("/metrics")
+def metrics():
+    """
+    Stage and endpoint latency histograms plus cache/pool/queue gauges,
+    in the Prometheus text format.
+    """
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
 
 # ---------- Home Page ----------
 
 @app.get("/", response_class=HTMLResponse)
-def index(request: Request):
+async def index(request: Request):
     """
     Render the main welcome/home page.
     """
-    return templates.TemplateResponse("welcome.html", {"request": request})
+    return static_pages.response(request, "home")
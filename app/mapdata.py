@@ -0,0 +1,212 @@
+import math
+from sqlalchemy import and_, delete
+from sqlalchemy.orm import Session
+from database import MapCell, Query, SessionLocal, dialect_insert, init_db
+
+# Grid levels maintained in map_cells; a map zoom uses the closest level below it
+CLUSTER_LEVELS = (2, 4, 6, 8, 10, 12)
+
+# At this map zoom and above the map shows individual points instead of cells
+POINTS_MIN_ZOOM = 13
+
+# Columns streamed for individual map points
+POINT_COLUMNS = (
+    Query.latitude, Query.longitude, Query.sentiment, Query.score,
+    Query.city, Query.country, Query.text, Query.user_id,
+)
+
+
+def cell_of(lat: float, lon: float, zoom: int):
+    """
+    Return the (cell_x, cell_y) grid index of a coordinate at a grid level.
+    """
+    n = 1 << zoom
+    x = int((min(max(lon, -180.0), 180.0) + 180.0) / 360.0 * n)
+    y = int((min(max(lat, -90.0), 90.0) + 90.0) / 180.0 * n)
+    return min(x, n - 1), min(y, n - 1)
+
+
+def level_for_zoom(zoom: int) -> int:
+    """
+    Pick the grid level to use for a Leaflet zoom level.
+    """
+    levels = [level for level in CLUSTER_LEVELS if level <= zoom]
+    return levels[-1] if levels else CLUSTER_LEVELS[0]
+
+
+# ---------- Incremental maintenance ----------
+
+def _apply(db: Session, points, sign: int):
+    """
+    Add (sign=1) or subtract (sign=-1) points from every grid level.
+    Points are pre-aggregated per cell, so each cell gets one upsert.
+    """
+    deltas = {}
+    for lat, lon, score in points:
+        if lat is None or lon is None:
+            continue  # not located (yet)
+        for zoom in CLUSTER_LEVELS:
+            key = (zoom, *cell_of(lat, lon, zoom))
+            d = deltas.setdefault(key, [0, 0.0, 0.0, 0.0])
+            d[0] += sign
+            d[1] += sign * (score or 0.0)
+            d[2] += sign * lat
+            d[3] += sign * lon
+    if not deltas:
+        return
+
+    rows = [
+        {"zoom": z, "cell_x": x, "cell_y": y, "count": c, "score_sum": s, "lat_sum": la, "lon_sum": lo}
+        for (z, x, y), (c, s, la, lo) in deltas.items()
+    ]
+    stmt = dialect_insert(db, MapCell)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[MapCell.zoom, MapCell.cell_x, MapCell.cell_y],
+        set_={
+            "count": MapCell.count + stmt.excluded.count,
+            "score_sum": MapCell.score_sum + stmt.excluded.score_sum,
+            "lat_sum": MapCell.lat_sum + stmt.excluded.lat_sum,
+            "lon_sum": MapCell.lon_sum + stmt.excluded.lon_sum,
+        },
+    )
+    db.execute(stmt, rows)
+
+    if sign < 0:
+        db.execute(delete(MapCell).where(MapCell.count <= 0))
+
+
+def add_points(db: Session, points):
+    """
+    Record located queries in the map cells (part of the caller's transaction).
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        points (iterable): (latitude, longitude, score) tuples; unlocated ones are skipped.
+    """
+    _apply(db, points, 1)
+
+
+def remove_points(db: Session, points):
+    """
+    Remove deleted queries from the map cells (part of the caller's transaction).
+    """
+    _apply(db, points, -1)
+
+
+def rebuild_map_cells(db: Session, chunk_size: int = 10000):
+    """
+    Recompute every map cell from the queries table (backfill / repair).
+    """
+    db.execute(delete(MapCell))
+    rows = (
+        db.query(Query.latitude, Query.longitude, Query.score)
+        .filter(Query.latitude.isnot(None), Query.longitude.isnot(None))
+        .execution_options(yield_per=chunk_size)
+    )
+    chunk = []
+    for row in rows:
+        chunk.append(tuple(row))
+        if len(chunk) >= chunk_size:
+            add_points(db, chunk)
+            chunk = []
+    add_points(db, chunk)
+    db.commit()
+
+
+# ---------- Reads ----------
+
+def parse_bbox(bbox: str):
+    """
+    Parse "west,south,east,north" into floats (None means the whole world).
+    Raises ValueError on malformed input.
+    """
+    if not bbox:
+        return None
+    west, south, east, north = (float(v) for v in bbox.split(","))
+    if any(math.isnan(v) for v in (west, south, east, north)):
+        raise ValueError("bbox contains NaN")
+    return max(west, -180.0), max(south, -90.0), min(east, 180.0), min(north, 90.0)
+
+
+def clusters(db: Session, zoom: int, bbox=None):
+    """
+    Return aggregated cells visible in a bounding box at a map zoom level.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        zoom (int): Leaflet zoom level of the map.
+        bbox (tuple): (west, south, east, north), or None for the whole world.
+
+    Returns:
+        list[dict]: One entry per non-empty cell with its centroid, query
+                    count and mean compound score.
+    """
+    level = level_for_zoom(zoom)
+    query = db.query(MapCell).filter(MapCell.zoom == level, MapCell.count > 0)
+    if bbox:
+        west, south, east, north = bbox
+        x0, y0 = cell_of(south, west, level)
+        x1, y1 = cell_of(north, east, level)
+        query = query.filter(and_(MapCell.cell_x.between(x0, x1), MapCell.cell_y.between(y0, y1)))
+
+    return [
+        {
+            "lat": round(cell.lat_sum / cell.count, 6),
+            "lng": round(cell.lon_sum / cell.count, 6),
+            "count": cell.count,
+            "mean_score": round(cell.score_sum / cell.count, 4),
+            "cell": f"{level}/{cell.cell_x}/{cell.cell_y}",
+        }
+        for cell in query
+    ]
+
+
+def points_query(db: Session, bbox=None):
+    """
+    Column-projected query over located points, optionally inside a bbox.
+    """
+    query = db.query(*POINT_COLUMNS).filter(Query.latitude.isnot(None), Query.longitude.isnot(None))
+    if bbox:
+        west, south, east, north = bbox
+        query = query.filter(Query.longitude.between(west, east), Query.latitude.between(south, north))
+    return query
+
+
+def point_dict(row) -> dict:
+    """
+    Convert a projected point row to the JSON shape used by the map page.
+    """
+    return {
+        "lat": row.latitude,
+        "lng": row.longitude,
+        "sentiment": row.sentiment if row.sentiment else "Unknown",
+        "score": float(row.score) if row.score is not None else 0.0,
+        "city": row.city if row.city else "Unknown City",
+        "country": row.country if row.country else "Unknown Country",
+        "text": row.text if row.text else "No text",
+        "uid": row.user_id,
+    }
+
+
+def stream_points(bbox=None, chunk_size: int = 1000):
+    """
+    Yield located points as dicts with constant memory, using its own session
+    so it can run after the request's session has been closed.
+    """
+    db = SessionLocal()
+    try:
+        for row in points_query(db, bbox).execution_options(yield_per=chunk_size):
+            yield point_dict(row)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    # Backfill map cells for queries saved before they existed
+    init_db()
+    session = SessionLocal()
+    try:
+        rebuild_map_cells(session)
+        print("Map cells rebuilt.")
+    finally:
+        session.close()
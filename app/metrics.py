@@ -0,0 +1,316 @@
+"""
+Low-overhead latency metrics for the request pipeline.
+
+- `stage("clean_text")` times a pipeline stage (context manager or decorator)
+  into the `sentiment_stage_seconds` histogram;
+- `MetricsMiddleware` times every HTTP request per route and status;
+- `collector(fn)` registers a callback that reports gauges (cache hit ratios,
+  pool and queue stats) when /metrics is scraped;
+- `render_prometheus()` renders everything in the Prometheus text format.
+
+Set `METRICS_ENABLED=0` to turn the timers into no-ops.
+
+Slow-request profiling is opt-in: with `PROFILE_SLOW_MS` set, a background
+thread samples every thread's stack every `PROFILE_INTERVAL_MS`, and requests
+slower than the threshold append the samples taken while they ran to
+`PROFILE_OUTPUT` as collapsed stacks (`frame;frame;frame count`), the input
+format of flamegraph.pl and speedscope. Samples include any work running
+concurrently with the request.
+"""
+import bisect
+import collections
+import os
+import sys
+import threading
+import time
+from functools import wraps
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+
+# Upper bounds (seconds) shared by every latency histogram
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram keyed by a tuple of label values.
+
+    Args:
+        name (str): Metric name.
+        help (str): One-line description.
+        labels (tuple): Label names.
+        buckets (tuple): Sorted bucket upper bounds.
+    """
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        """
+        Return {label values: (cumulative counts per bucket, count, sum)}.
+        """
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        result = {}
+        for key, series in items:
+            cumulative, total = [], 0
+            for count in series[:-1]:
+                total += count
+                cumulative.append(total)
+            result[key] = (cumulative[:-1], total, series[-1])
+        return result
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (cumulative, count, total) in sorted(self.snapshot().items()):
+            labels = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, key)]
+            bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+            for bound, value in zip(bounds, cumulative + [count]):
+                label_text = ",".join(labels + ['le="%s"' % bound])
+                lines.append(f"{self.name}_bucket{{{label_text}}} {value}")
+            suffix = "{%s}" % ",".join(labels) if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+stage_seconds = Histogram("sentiment_stage_seconds", "Time spent in each pipeline stage.", ("stage",))
+request_seconds = Histogram("http_request_duration_seconds", "HTTP request latency.", ("method", "route", "status"))
+
+_collectors = []
+
+
+# ---------- Stage timers ----------
+
+class stage:
+    """
+    Time a pipeline stage, as a context manager or a decorator:
+
+        with stage("db_commit"):
+            db.commit()
+
+        @stage("clean_text")
+        def clean_text(text): ...
+    """
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if METRICS_ENABLED:
+            stage_seconds.observe(time.perf_counter() - self.start, self.name)
+        return False
+
+    def __call__(self, fn):
+        name = self.name
+
+        @wraps(fn)
+        def timed(*args, **kwargs):
+            if not METRICS_ENABLED:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stage_seconds.observe(time.perf_counter() - start, name)
+        return timed
+
+
+def astage(name: str):
+    """
+    Decorator timing an async function as a pipeline stage.
+    """
+    def decorate(fn):
+        @wraps(fn)
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                if METRICS_ENABLED:
+                    stage_seconds.observe(time.perf_counter() - start, name)
+        return timed
+    return decorate
+
+
+# ---------- Gauges ----------
+
+def collector(fn):
+    """
+    Register `fn() -> iterable of (name, labels dict, value)` gauges, read at scrape time.
+    """
+    _collectors.append(fn)
+    return fn
+
+
+def cache_gauges(name: str, stats: dict):
+    """
+    Gauges for a `TTLCache.stats()` dict, labelled with the cache name.
+    """
+    labels = {"cache": name}
+    return [
+        ("cache_hits_total", labels, stats["hits"]),
+        ("cache_misses_total", labels, stats["misses"]),
+        ("cache_evictions_total", labels, stats["evictions"]),
+        ("cache_size", labels, stats["size"]),
+        ("cache_hit_ratio", labels, stats["hit_ratio"]),
+    ]
+
+
+def pool_gauges(name: str, engine):
+    """
+    Gauges for an engine's connection pool (QueuePool-style pools only).
+    """
+    pool = engine.pool
+    labels = {"engine": name}
+    gauges = []
+    for metric, attr in (("db_pool_size", "size"), ("db_pool_checked_out", "checkedout"),
+                         ("db_pool_checked_in", "checkedin"), ("db_pool_overflow", "overflow")):
+        fn = getattr(pool, attr, None)
+        if fn is not None:
+            gauges.append((metric, labels, fn()))
+    return gauges
+
+
+def render_prometheus() -> str:
+    """
+    Render all histograms and collected gauges in the Prometheus text format.
+    """
+    lines = stage_seconds.render() + request_seconds.render()
+
+    gauges = collections.defaultdict(list)
+    for fn in _collectors:
+        try:
+            for name, labels, value in fn():
+                gauges[name].append((labels, value))
+        except Exception as e:
+            print("Metrics collector failed:", e)
+    for name, samples in gauges.items():
+        lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+        for labels, value in samples:
+            label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_text}}} {float(value)}" if label_text else f"{name} {float(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------- Slow-request profiler ----------
+
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))  # 0 disables profiling
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_OUTPUT = os.getenv("PROFILE_OUTPUT", "./slow_requests.folded")
+
+
+class StackSampler:
+    """
+    Samples the stacks of all threads at a fixed interval into a ring buffer
+    of (timestamp, collapsed stack) covering roughly the last `window` seconds.
+    """
+
+    def __init__(self, interval: float, window: float = 30.0):
+        self.interval = interval
+        self._samples = collections.deque(maxlen=max(1, int(window / interval)))
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self._samples.append((now, ";".join(reversed(stack))))
+
+    def dump(self, start: float, end: float, label: str):
+        """
+        Append the stacks sampled between `start` and `end` to PROFILE_OUTPUT,
+        each prefixed with `label` (e.g. the request route).
+        """
+        counts = collections.Counter(stack for t, stack in list(self._samples) if start <= t <= end)
+        if not counts:
+            return
+        with open(PROFILE_OUTPUT, "a", encoding="utf-8") as fh:
+            for stack, count in counts.items():
+                fh.write(f"{label};{stack} {count}\n")
+
+
+sampler = StackSampler(PROFILE_INTERVAL_MS / 1000.0) if PROFILE_SLOW_MS > 0 else None
+
+
+# ---------- ASGI middleware ----------
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording `http_request_duration_seconds` per route
+    template (never the raw path, to bound label cardinality) and dumping
+    profiler samples for slow requests.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        if sampler is not None:
+            sampler.start()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            end = time.perf_counter()
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            request_seconds.observe(end - start, scope["method"], path, str(status))
+            if sampler is not None and (end - start) * 1000 >= PROFILE_SLOW_MS:
+                sampler.dump(start, end, f"{scope['method']} {path}")
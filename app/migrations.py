@@ -0,0 +1,249 @@
+"""
+Lightweight schema migrations.
+
+The schema version is stored in a one-row `schema_version` table. Each entry
+in MIGRATIONS runs in its own transaction together with the version bump, so
+a failed step leaves the database at the previous version. The bump is a
+compare-and-set (`UPDATE ... WHERE version = old`), so several processes
+starting at once apply each step only once.
+
+Steps are written to be safe on databases created before versioning existed
+(they use `checkfirst`), which then simply adopt the current version.
+
+Show the version or upgrade from the command line:
+
+    python migrations.py [status]
+"""
+import sqlite3
+import sys
+from datetime import datetime
+from sqlalchemy import JSON, Column, DateTime, Integer, MetaData, String, Table, column, inspect, select, table, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.orm import Session
+from database import Base, MapCell, Query, RetentionState, ScoringJob, SentimentRollup, User, engine
+
+version_metadata = MetaData()
+schema_version = Table(
+    "schema_version",
+    version_metadata,
+    Column("id", Integer, primary_key=True),  # always 1: a single row
+    Column("version", Integer, nullable=False),
+    Column("description", String(200)),
+    Column("applied_at", DateTime),
+)
+
+
+# ---------- Steps ----------
+
+def _initial_schema(conn):
+    """
+    Users and queries tables.
+    """
+    Base.metadata.create_all(bind=conn, tables=[User.__table__, Query.__table__])
+
+
+def _history_index(conn):
+    """
+    Composite index for keyset pagination of the history.
+    """
+    for index in Query.__table__.indexes:
+        index.create(bind=conn, checkfirst=True)
+
+
+def _aggregate_tables(conn):
+    """
+    Map cells and sentiment rollups, backfilled from existing queries.
+    """
+    from mapdata import rebuild_map_cells
+    from rollups import rebuild_rollups
+
+    Base.metadata.create_all(bind=conn, tables=[MapCell.__table__, SentimentRollup.__table__])
+    db = Session(bind=conn)
+    try:
+        rebuild_map_cells(db)
+        rebuild_rollups(db)
+    finally:
+        db.close()
+
+
+def _scoring_jobs(conn):
+    """
+    Background scoring jobs for uploaded files.
+    """
+    Base.metadata.create_all(bind=conn, tables=[ScoringJob.__table__])
+
+
+def _compact_details(conn):
+    """
+    Float pos/neg/neu columns instead of the `details` JSON (whose compound
+    duplicated `score`), an index on the query time, and the retention state.
+    The space freed by the dropped column is reclaimed by the next VACUUM.
+    """
+    columns = {c["name"] for c in inspect(conn).get_columns("queries")}
+    for name in ("pos", "neg", "neu"):
+        if name not in columns:
+            conn.execute(text(f"ALTER TABLE queries ADD COLUMN {name} FLOAT"))
+
+    if "details" in columns:
+        details = column("details", JSON)
+        queries = table("queries", details, column("pos"), column("neg"), column("neu"))
+        conn.execute(
+            update(queries)
+            .where(details.isnot(None))
+            .values(pos=details["pos"].as_float(), neg=details["neg"].as_float(), neu=details["neu"].as_float())
+        )
+        if conn.dialect.name == "sqlite" and sqlite3.sqlite_version_info < (3, 35):
+            conn.execute(update(queries).values(details=None))  # no DROP COLUMN before SQLite 3.35
+        else:
+            conn.execute(text("ALTER TABLE queries DROP COLUMN details"))
+
+    for index in Query.__table__.indexes:
+        index.create(bind=conn, checkfirst=True)
+    Base.metadata.create_all(bind=conn, tables=[RetentionState.__table__])
+    if conn.execute(select(RetentionState.name).where(RetentionState.name == "queries")).first() is None:
+        conn.execute(RetentionState.__table__.insert().values(name="queries", archived=0))
+
+
+def _search_index(conn):
+    """
+    Full-text index over the query texts (FTS5 on SQLite, tsvector on
+    PostgreSQL), kept in sync by the database.
+    """
+    from search import create_search_index
+
+    create_search_index(conn)
+
+
+# Bump users.data_version on every change to a user's queries, whatever the
+# write path (ORM, bulk inserts, geolocation updates, retention deletes)
+DATA_VERSION_DDL = {
+    "sqlite": [
+        """CREATE TRIGGER IF NOT EXISTS queries_version_ai AFTER INSERT ON queries BEGIN
+            UPDATE users SET data_version = data_version + 1 WHERE id = new.user_id;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS queries_version_ad AFTER DELETE ON queries BEGIN
+            UPDATE users SET data_version = data_version + 1 WHERE id = old.user_id;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS queries_version_au AFTER UPDATE ON queries BEGIN
+            UPDATE users SET data_version = data_version + 1 WHERE id IN (old.user_id, new.user_id);
+        END""",
+    ],
+    "postgresql": [
+        """CREATE OR REPLACE FUNCTION bump_user_data_version() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP <> 'INSERT' THEN
+                UPDATE users SET data_version = data_version + 1 WHERE id = OLD.user_id;
+            END IF;
+            IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.user_id IS DISTINCT FROM OLD.user_id) THEN
+                UPDATE users SET data_version = data_version + 1 WHERE id = NEW.user_id;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql""",
+        "DROP TRIGGER IF EXISTS queries_data_version ON queries",
+        """CREATE TRIGGER queries_data_version AFTER INSERT OR UPDATE OR DELETE ON queries
+            FOR EACH ROW EXECUTE FUNCTION bump_user_data_version()""",
+    ],
+}
+
+
+def _data_version(conn):
+    """
+    Per-user data version (identifies the data behind a cached trend image;
+    row count and highest ID do not, as SQLite reuses a deleted highest ID).
+    """
+    if "data_version" not in {c["name"] for c in inspect(conn).get_columns("users")}:
+        conn.execute(text("ALTER TABLE users ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0"))
+    for statement in DATA_VERSION_DDL.get(conn.dialect.name, []):
+        conn.execute(text(statement))
+
+
+def _search_owner(conn):
+    """
+    Rebuild the FTS5 index with an owner column, so a user's search is one
+    MATCH (PostgreSQL filters on user_id and needs nothing).
+    """
+    from search import create_search_index, drop_search_index, has_search_index
+
+    if conn.dialect.name != "postgresql" and has_search_index(conn):
+        drop_search_index(conn)
+        create_search_index(conn)
+
+
+# (version, description, step) in the order they are applied
+MIGRATIONS = [
+    (1, "initial schema", _initial_schema),
+    (2, "history keyset index", _history_index),
+    (3, "map cells and sentiment rollups", _aggregate_tables),
+    (4, "scoring jobs", _scoring_jobs),
+    (5, "compact sentiment columns and retention state", _compact_details),
+    (6, "full-text search index", _search_index),
+    (7, "per-user data version", _data_version),
+    (8, "search index owner column", _search_owner),
+]
+
+
+# ---------- Runner ----------
+
+def current_version(conn) -> int:
+    """
+    Return the schema version (0 for an unversioned database).
+    """
+    if not inspect(conn).has_table("schema_version"):
+        return 0
+    version = conn.execute(select(schema_version.c.version)).scalar()
+    return version or 0
+
+
+def _ensure_version_table(bind):
+    # Safe to race: IF NOT EXISTS, and the fixed primary key rejects a second row
+    with bind.begin() as conn:
+        conn.execute(CreateTable(schema_version, if_not_exists=True))
+    try:
+        with bind.begin() as conn:
+            conn.execute(schema_version.insert().values(id=1, version=0, description="unversioned"))
+    except IntegrityError:
+        pass
+
+
+def migrate(bind=engine, target: int = None) -> int:
+    """
+    Apply pending migrations up to `target` (default: the latest).
+
+    Args:
+        bind (Engine): Engine of the database to upgrade.
+        target (int): Version to stop at.
+
+    Returns:
+        int: The schema version after upgrading.
+    """
+    target = MIGRATIONS[-1][0] if target is None else target
+    _ensure_version_table(bind)
+
+    for version, description, step in MIGRATIONS:
+        if version > target:
+            break
+        with bind.begin() as conn:
+            # Take the write lock first; if another process got here before
+            # us, the row no longer matches and this step is skipped.
+            bumped = conn.execute(
+                update(schema_version)
+                .where(schema_version.c.version == version - 1)
+                .values(version=version, description=description, applied_at=datetime.now())
+            ).rowcount
+            if not bumped:
+                continue
+            step(conn)
+            print(f"Applied migration {version}: {description}")
+
+    with bind.connect() as conn:
+        return current_version(conn)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["status"]:
+        with engine.connect() as conn:
+            print(f"Schema version {current_version(conn)} (latest {MIGRATIONS[-1][0]})")
+    else:
+        print(f"Schema version {migrate(engine)}")
@@ -1,12 +1,15 @@
 from datetime import datetime
 from typing import Dict, List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from database import Query
+
+TEXT_MAX_LENGTH = Query.__table__.c.text.type.length  # characters (SQLite does not enforce String(500))
 
 class UserCreate(BaseModel):
     username: str
 
 class SentimentRequest(BaseModel):
-    text: str
+    text: str = Field(max_length=TEXT_MAX_LENGTH)
 
 class SentimentResponse(BaseModel):
     sentiment: str
@@ -42,6 +45,7 @@ class QueryHistoryOut(BaseModel):
     city: Optional[str] = None
     country: Optional[str] = None
     confidence: Optional[float] = None
+    details: Optional[Dict] = None
 
     class Config:
         from_attributes = True
@@ -49,6 +53,7 @@ class QueryHistoryOut(BaseModel):
 class HistoryListOut(BaseModel):
     username: str
     queries: List[QueryHistoryOut]
+    next_cursor: Optional[str] = None  # pass back as `cursor` to get the next page
 
 
 class SentimentAnalysisOut(BaseModel):
@@ -0,0 +1,151 @@
+"""
+Pre-rendered responses for pages whose HTML never varies between requests
+(the home, about, register, map and trend pages and the empty sentiment form).
+
+Each page is rendered once at startup and kept as identity, gzip and (with
+the optional `brotli` package) brotli bodies, each with a strong ETag. A hit
+is a dict lookup: no template rendering and no compression per request, and
+a conditional request with a matching `If-None-Match` gets a bodiless 304.
+"""
+import gzip
+import hashlib
+import os
+from fastapi import Request
+from fastapi.responses import Response
+
+STATIC_PAGE_MAX_AGE = int(os.getenv("STATIC_PAGE_MAX_AGE", "300"))  # seconds, for Cache-Control
+COMPRESS_MIN_SIZE = 512  # smaller bodies are only served uncompressed
+
+# Directory for Jinja2's compiled-template cache (empty disables it)
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR", "./.template_cache")
+
+
+def enable_bytecode_cache(env, directory: str = TEMPLATE_CACHE_DIR):
+    """
+    Store compiled templates on disk, so a restarted process loads them
+    instead of compiling every template again. Jinja2 checks each entry
+    against the template source, so an edited template is recompiled.
+
+    Args:
+        env (jinja2.Environment): The templates' environment.
+        directory (str): Cache directory (created if missing).
+    """
+    if not directory:
+        return
+    from jinja2 import FileSystemBytecodeCache
+
+    os.makedirs(directory, exist_ok=True)
+    env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+
+def _brotli():
+    try:
+        import brotli  # optional dependency
+    except ImportError:
+        return None
+    return brotli
+
+
+def accepted_encodings(header: str) -> set:
+    """
+    Content codings allowed by an Accept-Encoding header (q=0 excluded).
+    """
+    accepted = set()
+    for part in header.split(","):
+        coding, *params = (item.strip() for item in part.split(";"))
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding and q > 0:
+            accepted.add(coding.lower())
+    return accepted
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """
+    Weak comparison of an If-None-Match header against an ETag (RFC 9110).
+    """
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+class StaticPageCache:
+    """
+    Pre-rendered pages, served by name.
+
+    Args:
+        templates (Jinja2Templates): Templates used to render the pages.
+        max_age (int): `Cache-Control` max-age for the responses.
+    """
+
+    def __init__(self, templates, max_age: int = STATIC_PAGE_MAX_AGE):
+        self.templates = templates
+        self.cache_control = f"public, max-age={max_age}"
+        self.pages = {}  # name -> (template, context)
+        self._bodies = {}  # name -> {coding: (body, etag)}
+        self.hits = 0
+        self.not_modified = 0
+
+    def add(self, name: str, template: str, context: dict = None):
+        """
+        Register a page. It is rendered by `prerender` (or on first use).
+        """
+        self.pages[name] = (template, context or {})
+        self._bodies.pop(name, None)
+
+    def _render(self, name: str) -> dict:
+        template, context = self.pages[name]
+        body = self.templates.get_template(template).render(context).encode("utf-8")
+        digest = hashlib.blake2b(body, digest_size=12).hexdigest()
+        bodies = {"identity": (body, f'"{digest}"')}
+        if len(body) >= COMPRESS_MIN_SIZE:
+            bodies["gzip"] = (gzip.compress(body, compresslevel=9, mtime=0), f'"{digest}-gzip"')
+            brotli = _brotli()
+            if brotli is not None:
+                bodies["br"] = (brotli.compress(body, quality=11), f'"{digest}-br"')
+        return bodies
+
+    def prerender(self):
+        """
+        Render and compress every registered page (called at startup).
+        """
+        for name in self.pages:
+            self._bodies[name] = self._render(name)
+
+    def response(self, request: Request, name: str) -> Response:
+        """
+        Serve a page in the best encoding the client accepts, or 304 if the
+        client's `If-None-Match` matches it.
+        """
+        bodies = self._bodies.get(name)
+        if bodies is None:
+            bodies = self._bodies[name] = self._render(name)
+
+        accepted = accepted_encodings(request.headers.get("accept-encoding", ""))
+        coding = next((c for c in ("br", "gzip") if c in bodies and c in accepted), "identity")
+        body, etag = bodies[coding]
+
+        headers = {"ETag": etag, "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+        self.hits += 1
+        return Response(body, media_type="text/html", headers=headers)
+
+    def stats(self) -> dict:
+        return {
+            "pages": len(self.pages),
+            "rendered": len(self._bodies),
+            "hits": self.hits,
+            "not_modified": self.not_modified,
+        }
@@ -0,0 +1,281 @@
+"""
+Bulk user provisioning (account migrations, pre-registered users).
+
+`provision_users` registers many usernames at once instead of one
+`create_user` commit per user. The input is consumed PROVISION_CHUNK_SIZE
+rows at a time, so memory stays flat for millions of accounts. For each chunk:
+
+- existing usernames are found with one `IN` query on the unique username
+  index;
+- new users get generated session tokens and are inserted with one
+  executemany INSERT ... ON CONFLICT (username) DO NOTHING, so a username
+  registered concurrently is reported as existing instead of aborting the
+  transaction;
+- with `on_existing="rotate"`, existing users are issued new tokens in one
+  bulk UPDATE (their old tokens stop working).
+
+Every input row gets a `ProvisionResult` with one of these statuses:
+created, rotated, exists, duplicate (repeated within its chunk) or invalid.
+A repeat in a later chunk is handled as an existing user; with "rotate" it
+gets another token, so the last result for a username is the valid one.
+
+By default all chunks share one transaction: either every user is written
+or none is, and the results are only final once the iterator is exhausted.
+With `atomic=False` each chunk commits on its own, so a long run holds the
+write lock briefly, and running it again after a failure skips the users
+already created.
+
+Command line (one username per line, or a .csv / .jsonl file with
+`username` and optional `ip_address` fields); the results, including the new
+tokens, are written as NDJSON to `--output` once committed:
+
+    python provisioning.py USERS_FILE [--output tokens.ndjson] [--rotate] [--per-chunk]
+"""
+import csv
+import json
+import os
+import sys
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import NamedTuple
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.orm import Session
+from crud import token_cache
+from database import User, SessionLocal, dialect_insert
+
+PROVISION_CHUNK_SIZE = int(os.getenv("PROVISION_CHUNK_SIZE", "5000"))  # usernames per lookup and INSERT
+PROVISION_MAX_BATCH = int(os.getenv("PROVISION_MAX_BATCH", "10000"))  # rows per POST /users/bulk
+PROVISION_API_KEY = os.getenv("PROVISION_API_KEY", "")  # X-API-Key for POST /users/bulk (empty disables it)
+USERNAME_MAX_LENGTH = User.__table__.c.username.type.length
+ON_EXISTING = ("skip", "rotate")
+
+
+class ProvisionResult(NamedTuple):
+    """
+    Outcome for one input row. `session_token` is only set for created and
+    rotated users.
+    """
+    username: str
+    status: str
+    user_id: int = None
+    session_token: str = None
+
+
+def _normalize(row):
+    """
+    Return (username, ip_address) from a username string or a dict row.
+    """
+    if isinstance(row, dict):
+        username, ip_address = row.get("username"), row.get("ip_address")
+    else:
+        username, ip_address = row, None
+    if not isinstance(username, str):
+        username = "" if username is None else str(username)
+    return username.strip(), ip_address
+
+
+def provision_chunk(db: Session, rows, on_existing: str = "skip"):
+    """
+    Provision one chunk of users in the session's transaction (not committed).
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        rows (list): Usernames, or dicts with `username` and `ip_address`.
+        on_existing (str): "skip" leaves existing users alone, "rotate"
+            issues them new session tokens.
+
+    Returns:
+        tuple[list[ProvisionResult], list[str]]: One result per row, in input
+        order, and the issued and replaced tokens to evict from the token
+        cache once the chunk is committed.
+    """
+    if on_existing not in ON_EXISTING:
+        raise ValueError(f"on_existing must be one of {', '.join(ON_EXISTING)}")
+
+    entries = [_normalize(row) for row in rows]
+    first_ip = {}
+    for username, ip_address in entries:
+        if username and len(username) <= USERNAME_MAX_LENGTH:
+            first_ip.setdefault(username, ip_address)
+    if not first_ip:
+        return [ProvisionResult(username, "invalid") for username, _ in entries], []
+
+    # One indexed IN lookup for the whole chunk
+    existing = {
+        username: (user_id, token)
+        for user_id, username, token in db.execute(
+            select(User.id, User.username, User.session_token).where(User.username.in_(list(first_ip)))
+        )
+    }
+
+    now = datetime.now()
+    new_rows = [
+        {"username": username, "session_token": str(uuid.uuid4()), "ip_address": ip_address, "created_at": now}
+        for username, ip_address in first_ip.items()
+        if username not in existing
+    ]
+    created = {}
+    if new_rows:
+        tokens = {row["username"]: row["session_token"] for row in new_rows}
+        # Core INSERT on the table: no ORM bulk-persistence bookkeeping per row
+        users = User.__table__
+        stmt = dialect_insert(db, users).on_conflict_do_nothing(index_elements=[users.c.username])
+        for user_id, username in db.execute(stmt.returning(users.c.id, users.c.username), new_rows):
+            created[username] = (user_id, tokens[username])
+        # Rows skipped by ON CONFLICT were registered since the lookup
+        missed = [row["username"] for row in new_rows if row["username"] not in created]
+        if missed:
+            existing.update(
+                (username, (user_id, token))
+                for user_id, username, token in db.execute(
+                    select(User.id, User.username, User.session_token).where(User.username.in_(missed))
+                )
+            )
+
+    rotated, replaced = {}, []
+    if on_existing == "rotate" and existing:
+        users = User.__table__
+        updates = [
+            {"user_id": user_id, "new_token": str(uuid.uuid4())}
+            for user_id, _ in existing.values()
+        ]
+        stmt = update(users).where(users.c.id == bindparam("user_id")).values(session_token=bindparam("new_token"))
+        db.execute(stmt, updates)  # executemany UPDATE by primary key
+        for (username, (user_id, old_token)), values in zip(existing.items(), updates):
+            rotated[username] = (user_id, values["new_token"])
+            replaced.append(old_token)
+
+    results, seen = [], set()
+    for username, _ in entries:
+        if username not in first_ip:
+            results.append(ProvisionResult(username, "invalid"))
+        elif username in seen:
+            results.append(ProvisionResult(username, "duplicate"))
+        else:
+            seen.add(username)
+            if username in created:
+                results.append(ProvisionResult(username, "created", *created[username]))
+            elif username in rotated:
+                results.append(ProvisionResult(username, "rotated", *rotated[username]))
+            else:
+                results.append(ProvisionResult(username, "exists", existing[username][0]))
+    return results, replaced + [r.session_token for r in results if r.session_token]
+
+
+def _evict(tokens):
+    """
+    Drop tokens from the token cache after a commit (replaced tokens may be
+    cached as valid, new ones as unknown).
+    """
+    if len(tokens) > token_cache.maxsize:
+        token_cache.clear()  # cheaper than evicting more keys than the cache holds
+        return
+    for token in tokens:
+        token_cache.invalidate(token)
+
+
+def provision_users(db: Session, rows, on_existing: str = "skip", atomic: bool = True,
+                    chunk_size: int = PROVISION_CHUNK_SIZE):
+    """
+    Provision users from any iterable of rows, chunk by chunk.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        rows (iterable): Usernames, or dicts with `username` and `ip_address`.
+        on_existing (str): "skip" or "rotate" (see `provision_chunk`).
+        atomic (bool): Commit once after the last chunk (True), or after
+            every chunk (False).
+        chunk_size (int): Rows per lookup and INSERT.
+
+    Yields:
+        ProvisionResult: One per input row, in input order.
+    """
+    pending = []  # tokens to evict at the next commit
+    chunk = []
+    try:
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) < chunk_size:
+                continue
+            results, tokens = provision_chunk(db, chunk, on_existing)
+            chunk = []
+            if atomic:
+                if len(pending) <= token_cache.maxsize:  # past that, _evict clears the whole cache
+                    pending.extend(tokens)
+            else:
+                db.commit()
+                _evict(tokens)
+            yield from results
+
+        results, tokens = provision_chunk(db, chunk, on_existing) if chunk else ([], [])
+        db.commit()
+        _evict(pending + tokens)
+        yield from results
+    except BaseException:
+        db.rollback()
+        raise
+
+
+async def provision_users_async(db, rows, on_existing: str = "skip"):
+    """
+    Provision a list of users in one transaction on an AsyncSession.
+
+    Returns:
+        list[ProvisionResult]: One per input row, in input order.
+    """
+    return await db.run_sync(lambda session: list(provision_users(session, rows, on_existing)))
+
+
+# ---------- Command line ----------
+
+def read_users(path: str):
+    """
+    Yield username strings or dicts from a text, CSV or JSONL file, lazily.
+    """
+    with open(path, newline="", encoding="utf-8") as fh:
+        if path.endswith(".csv"):
+            yield from csv.DictReader(fh)
+        elif path.endswith((".jsonl", ".ndjson")):
+            for line in fh:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            for line in fh:
+                if line.strip():
+                    yield line
+
+
+def main(argv=None):
+    import argparse
+    from database import init_db
+
+    parser = argparse.ArgumentParser(description="Provision users in bulk and issue session tokens.")
+    parser.add_argument("users", help="text (one username per line), .csv or .jsonl file")
+    parser.add_argument("--output", default="tokens.ndjson", help="NDJSON results file (written after the commit)")
+    parser.add_argument("--rotate", action="store_true", help="issue new tokens to existing users")
+    parser.add_argument("--per-chunk", action="store_true", help="commit every chunk instead of one transaction")
+    parser.add_argument("--chunk-size", type=int, default=PROVISION_CHUNK_SIZE, help="rows per lookup and INSERT")
+    args = parser.parse_args(argv)
+
+    init_db()
+    counts = Counter()
+    tmp_path = args.output + ".tmp"
+    db = SessionLocal()
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as out:
+            results = provision_users(db, read_users(args.users), "rotate" if args.rotate else "skip",
+                                      atomic=not args.per_chunk, chunk_size=args.chunk_size)
+            for result in results:
+                counts[result.status] += 1
+                out.write(json.dumps(result._asdict()) + "\n")
+        os.replace(tmp_path, args.output)  # only complete, committed results are published
+    finally:
+        db.close()
+    print(f"{sum(counts.values())} rows: " + ", ".join(f"{n} {status}" for status, n in sorted(counts.items())))
+    print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+import asyncio
+import itertools
+import threading
+from collections import OrderedDict
+
+RESYNC = object()  # payload of a resync marker: the client must reload the topic
+
+
+class Subscription:
+    """
+    One subscriber's bounded, coalescing event buffer.
+
+    Events published with a key replace (or are merged into) a pending event
+    with the same key, so a slow subscriber receives the latest state of each
+    key rather than every intermediate update. Events are additive deltas, so
+    none is ever dropped: when the buffer is full, the pending events of the
+    new event's topic (and the new event) are replaced by one resync marker,
+    which absorbs further events of that topic until it is delivered. Markers
+    may exceed `maxsize` by at most one per subscribed topic.
+
+    Only touched from the event loop thread (the broker hands events over with
+    `call_soon_threadsafe`).
+
+    Args:
+        maxsize (int): Maximum number of pending events.
+        counters (dict): Shared delivered/coalesced/resynced counters to update.
+    """
+
+    def __init__(self, maxsize: int = 256, counters: dict = None):
+        self.maxsize = maxsize
+        self.topics = set()
+        self._pending = OrderedDict()  # key -> (topic, payload, merge)
+        self._ready = asyncio.Event()
+        self._seq = itertools.count()
+        self.counters = counters if counters is not None else {"delivered": 0, "coalesced": 0, "resynced": 0}
+
+    def _offer(self, topic: str, payload, key, merge):
+        if ("_resync", topic) in self._pending:
+            self.counters["resynced"] += 1  # the client reloads this topic anyway
+            return
+
+        if key is None:
+            key = ("_seq", next(self._seq))  # never coalesced
+        else:
+            key = (topic, key)
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.counters["coalesced"] += 1
+            self._pending[key] = (topic, merge(pending[1], payload) if merge else payload, merge)
+            return
+
+        if len(self._pending) >= self.maxsize:
+            self._resync(topic)
+            return
+        self._pending[key] = (topic, payload, merge)
+        self._ready.set()
+
+    def _resync(self, topic: str):
+        stale = [key for key, (t, _, _) in self._pending.items() if t == topic]
+        for key in stale:
+            del self._pending[key]
+        self.counters["resynced"] += len(stale) + 1
+        self._pending[("_resync", topic)] = (topic, RESYNC, None)
+        self._ready.set()
+
+    async def get_many(self):
+        """
+        Wait for events, then return every pending one as (topic, payload)
+        pairs; the payload of a resync marker is `RESYNC`.
+        """
+        await self._ready.wait()
+        events = [(topic, payload) for topic, payload, _ in self._pending.values()]
+        self._pending.clear()
+        self._ready.clear()
+        self.counters["delivered"] += len(events)
+        return events
+
+
+class Broker:
+    """
+    In-process pub/sub fan-out from publishers (any thread) to async subscribers.
+
+    `publish` never blocks: each subscriber has its own bounded buffer (see
+    `Subscription`), so a slow client only coalesces or resyncs its own events
+    and cannot back up publishers or other subscribers.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._topics = {}  # topic -> set of Subscription
+        self._lock = threading.Lock()
+        self._loop = None
+        self.published = 0
+        self._counters = {"delivered": 0, "coalesced": 0, "resynced": 0}  # over all subscriptions
+
+    def bind(self, loop):
+        """
+        Set the event loop subscribers run on (call once at startup).
+        """
+        self._loop = loop
+
+    def has_subscribers(self, topic: str) -> bool:
+        return bool(self._topics.get(topic))
+
+    def active_topics(self, prefix: str = ""):
+        """
+        Return the topics that currently have subscribers.
+        """
+        with self._lock:
+            return [topic for topic, subs in self._topics.items() if subs and topic.startswith(prefix)]
+
+    # ---------- Subscribers ----------
+
+    def subscribe(self, subscription: Subscription = None, topics=()):
+        """
+        Add topics to a subscription (a new one if None) and return it.
+        """
+        subscription = subscription or Subscription(self.maxsize, self._counters)
+        with self._lock:
+            for topic in topics:
+                self._topics.setdefault(topic, set()).add(subscription)
+                subscription.topics.add(topic)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription, topics=None):
+        """
+        Remove topics from a subscription (all of them if None).
+        """
+        with self._lock:
+            for topic in list(subscription.topics if topics is None else topics):
+                subs = self._topics.get(topic)
+                if subs is not None:
+                    subs.discard(subscription)
+                    if not subs:
+                        del self._topics[topic]
+                subscription.topics.discard(topic)
+
+    # ---------- Publishers ----------
+
+    def publish(self, topic: str, payload, key=None, merge=None):
+        """
+        Send an event to every subscriber of `topic`. Thread-safe.
+
+        Args:
+            topic (str): Topic name.
+            payload: JSON-serialisable event body.
+            key: Coalescing key; a pending event with the same topic and key is
+                 replaced, or combined with `merge(old, new)` if given.
+            merge (callable): Combines two payloads with the same key.
+        """
+        if self._loop is None or not self._topics.get(topic):
+            return
+        self.published += 1
+        try:
+            self._loop.call_soon_threadsafe(self._deliver, topic, payload, key, merge)
+        except RuntimeError:
+            pass  # loop already closed (shutdown)
+
+    def _deliver(self, topic, payload, key, merge):
+        for subscription in list(self._topics.get(topic, ())):
+            subscription._offer(topic, payload, key, merge)
+
+    def stats(self) -> dict:
+        """
+        Subscriber and delivery counters.
+        """
+        with self._lock:
+            subscriptions = {s for subs in self._topics.values() for s in subs}
+            topics = {topic: len(subs) for topic, subs in self._topics.items()}
+        return {
+            "subscribers": len(subscriptions),
+            "topics": topics,
+            "published": self.published,
+            **self._counters,
+        }
@@ -0,0 +1,451 @@
+"""
+Retention for the queries table.
+
+A background job (one process at a time, through a lease in
+`retention_state`) periodically:
+
+- archives queries older than RETENTION_DAYS, and each user's queries beyond
+  their newest RETENTION_MAX_PER_USER, to gzip-compressed NDJSON files in
+  RETENTION_ARCHIVE_DIR, then deletes them, one batch per transaction;
+- deletes minute rollup buckets older than RETENTION_MINUTE_ROLLUP_DAYS (the
+  hour and day buckets still cover that time; the minute buckets are usually
+  the largest table);
+- runs ANALYZE after rows were removed (and at least every ANALYZE_INTERVAL);
+- runs VACUUM every VACUUM_INTERVAL, on SQLite only once at least
+  VACUUM_MIN_FREE of the file's pages are free.
+
+Archived rows stay counted in the aggregates: map cells and sentiment rollups
+are maintained as queries are saved, and archiving does not subtract from
+them, so trends and map clusters keep their full history. (Rebuilding the
+aggregates from the table would drop the archived rows again.)
+
+An archive batch is written and synced before its rows are deleted, so rows
+are never lost. A crash between the two writes the batch again on the next
+run; drop duplicate `id`s when loading archives.
+
+Run one pass by hand (`--vacuum` forces ANALYZE and VACUUM), or show the state:
+
+    python retention.py [run [--vacuum] | status]
+"""
+import gzip
+import json
+import os
+import sys
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, func, or_, select, text, tuple_, update
+from sqlalchemy.orm import Session
+from database import Query, RetentionState, SentimentRollup, SessionLocal, engine
+
+RETENTION_DAYS = float(os.getenv("RETENTION_DAYS", "0"))  # 0 keeps queries forever
+RETENTION_MAX_PER_USER = int(os.getenv("RETENTION_MAX_PER_USER", "0"))  # 0: no per-user limit
+RETENTION_MINUTE_ROLLUP_DAYS = float(os.getenv("RETENTION_MINUTE_ROLLUP_DAYS", "0"))  # 0 keeps them forever
+RETENTION_ARCHIVE_DIR = os.getenv("RETENTION_ARCHIVE_DIR", "./archive")
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "5000"))  # rows per archive file
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "3600"))  # seconds between runs (0 disables the job)
+RETENTION_LEASE = 600.0  # seconds before another process may take over a silent run (renewed per batch)
+
+ANALYZE_INTERVAL = float(os.getenv("ANALYZE_INTERVAL", "86400"))
+VACUUM_INTERVAL = float(os.getenv("VACUUM_INTERVAL", "604800"))
+VACUUM_MIN_FREE = float(os.getenv("VACUUM_MIN_FREE", "0.2"))  # free page fraction (SQLite)
+
+ARCHIVE_COLUMNS = tuple(Query.__table__.columns)
+USERS_PER_CONDITION = 100  # per-user limits checked per archive query
+STATE_NAME = "queries"
+
+
+def _now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+# ---------- Selection ----------
+
+def expired_condition(max_age_days: float = RETENTION_DAYS, now: datetime = None):
+    """
+    Condition for queries older than the age limit (None without a limit).
+    `now` is naive UTC, like the stored times.
+    """
+    if max_age_days <= 0:
+        return None
+    cutoff = (now or _now()) - timedelta(days=max_age_days)
+    return Query.time < cutoff
+
+
+def over_limit_conditions(db: Session, max_per_user: int = RETENTION_MAX_PER_USER):
+    """
+    Conditions matching, for every user with more than `max_per_user`
+    queries, the queries beyond their newest `max_per_user` (users are
+    grouped by USERS_PER_CONDITION, so small overflows share archive files).
+    """
+    if max_per_user <= 0:
+        return []
+    users = db.scalars(
+        select(Query.user_id).where(Query.user_id.isnot(None))
+        .group_by(Query.user_id).having(func.count() > max_per_user)
+    ).all()
+    conditions = []
+    for user_id in users:
+        # Newest (time, id) that falls outside the limit, found on the history index
+        boundary = db.execute(
+            select(Query.time, Query.id).where(Query.user_id == user_id)
+            .order_by(Query.time.desc(), Query.id.desc()).offset(max_per_user).limit(1)
+        ).first()
+        if boundary is not None:
+            conditions.append((Query.user_id == user_id) & (tuple_(Query.time, Query.id) <= tuple(boundary)))
+    return [
+        or_(*conditions[i:i + USERS_PER_CONDITION])
+        for i in range(0, len(conditions), USERS_PER_CONDITION)
+    ]
+
+
+# ---------- Archiving ----------
+
+def write_archive(rows, directory: str = RETENTION_ARCHIVE_DIR) -> str:
+    """
+    Write rows (ARCHIVE_COLUMNS) to a gzip NDJSON file named after their ID
+    range, synced to disk before it becomes visible under its final name.
+    """
+    os.makedirs(directory, exist_ok=True)
+    fields = [column.key for column in ARCHIVE_COLUMNS]
+    path = os.path.join(directory, f"queries-{rows[0].id:010d}-{rows[-1].id:010d}.ndjson.gz")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as fh:
+            for row in rows:
+                fh.write((json.dumps(dict(zip(fields, (_plain(value) for value in row)))) + "\n").encode("utf-8"))
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+
+def archive_matching(db: Session, condition, batch_size: int = RETENTION_BATCH_SIZE,
+                     directory: str = RETENTION_ARCHIVE_DIR, should_stop=None) -> int:
+    """
+    Archive and delete every query matching `condition`, one batch (file and
+    transaction) at a time, oldest IDs first. The aggregates are left as they are.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        condition: SQLAlchemy condition selecting the queries to remove.
+        batch_size (int): Rows per archive file and per DELETE.
+        directory (str): Archive directory.
+        should_stop (callable): Checked between batches; True ends the pass early.
+
+    Returns:
+        int: Number of rows archived.
+    """
+    archived = 0
+    while should_stop is None or not should_stop():
+        rows = db.execute(
+            select(*ARCHIVE_COLUMNS).where(condition).order_by(Query.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        write_archive(rows, directory)
+        db.execute(delete(Query).where(Query.id.in_([row.id for row in rows])))
+        db.execute(
+            update(RetentionState).where(RetentionState.name == STATE_NAME)
+            .values(archived=RetentionState.archived + len(rows))
+        )
+        db.commit()
+        archived += len(rows)
+    return archived
+
+
+def prune_rollups(db: Session, granularity: str = "minute", max_age_days: float = RETENTION_MINUTE_ROLLUP_DAYS) -> int:
+    """
+    Delete `granularity` rollup buckets older than `max_age_days`; trends
+    over that time are still served at the coarser granularities.
+
+    Returns:
+        int: Number of buckets deleted.
+    """
+    if max_age_days <= 0:
+        return 0
+    cutoff = _now() - timedelta(days=max_age_days)
+    deleted = db.execute(
+        delete(SentimentRollup)
+        .where(SentimentRollup.granularity == granularity, SentimentRollup.bucket_start < cutoff)
+    ).rowcount
+    db.commit()
+    return deleted
+
+
+# ---------- Database maintenance ----------
+
+def free_page_ratio(bind=engine) -> float:
+    """
+    Fraction of the SQLite file's pages that are free (0.0 on other databases).
+    """
+    if bind.dialect.name != "sqlite":
+        return 0.0
+    with bind.connect() as conn:
+        pages = conn.exec_driver_sql("PRAGMA page_count").scalar()
+        free = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+    return free / pages if pages else 0.0
+
+
+def analyze(bind=engine):
+    """
+    Refresh the query planner's statistics.
+    """
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("ANALYZE"))
+
+
+def vacuum(bind=engine):
+    """
+    Rebuild the database to return free pages to the file system. On SQLite
+    this blocks writers while it runs and the WAL is truncated afterwards;
+    on PostgreSQL it is a plain `VACUUM (ANALYZE) queries`.
+    """
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if bind.dialect.name == "sqlite":
+            conn.execute(text("VACUUM"))
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        else:
+            conn.execute(text("VACUUM (ANALYZE) queries"))
+
+
+# ---------- Background job ----------
+
+class RetentionJob:
+    """
+    Background thread that runs retention and maintenance every `interval`
+    seconds. Across processes, only the holder of the lease in
+    `retention_state` runs a pass; the lease is renewed after every archive
+    batch, and a pass that fails to renew it (another process took over)
+    stops at once.
+
+    Args:
+        session_factory (callable): Creates the job's database sessions.
+        bind (Engine): Engine used for ANALYZE and VACUUM.
+        interval (float): Seconds between passes.
+        max_age_days (float): Age limit (0 disables it).
+        max_per_user (int): Per-user limit (0 disables it).
+        minute_rollup_days (float): Age limit of minute rollup buckets (0 disables it).
+        archive_dir (str): Where archive files are written.
+        batch_size (int): Rows per archive file.
+    """
+
+    def __init__(self, session_factory=SessionLocal, bind=engine, interval: float = RETENTION_INTERVAL,
+                 max_age_days: float = RETENTION_DAYS, max_per_user: int = RETENTION_MAX_PER_USER,
+                 minute_rollup_days: float = RETENTION_MINUTE_ROLLUP_DAYS,
+                 archive_dir: str = RETENTION_ARCHIVE_DIR, batch_size: int = RETENTION_BATCH_SIZE):
+        self.session_factory = session_factory
+        self.bind = bind
+        self.interval = interval
+        self.max_age_days = max_age_days
+        self.max_per_user = max_per_user
+        self.minute_rollup_days = minute_rollup_days
+        self.archive_dir = archive_dir
+        self.batch_size = batch_size
+        self.holder = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+        # Metrics
+        self.runs = 0
+        self.archived = 0
+        self.rollups_pruned = 0
+        self.analyzes = 0
+        self.vacuums = 0
+        self.errors = 0
+        self.leases_lost = 0
+
+    # ---------- Lifecycle ----------
+
+    def start(self):
+        """
+        Start the job thread (no-op if already running or disabled).
+        """
+        if self.interval <= 0:
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self.holder = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"  # not the parent's, after a fork
+                self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        """
+        Stop after the batch in progress.
+        """
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is None or not thread.is_alive():
+            return
+        self._stopping.set()
+        thread.join(timeout)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "runs": self.runs,
+            "archived": self.archived,
+            "rollups_pruned": self.rollups_pruned,
+            "analyzes": self.analyzes,
+            "vacuums": self.vacuums,
+            "errors": self.errors,
+            "leases_lost": self.leases_lost,
+        }
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                self.errors += 1
+                print("Retention run failed:", e)
+
+    # ---------- Work ----------
+
+    def _claim(self, db: Session) -> bool:
+        # Compare-and-set on the lease, so one process runs at a time
+        now = _now()
+        claimed = db.execute(
+            update(RetentionState)
+            .where(
+                RetentionState.name == STATE_NAME,
+                or_(RetentionState.lease_until.is_(None), RetentionState.lease_until < now,
+                    RetentionState.holder == self.holder),
+            )
+            .values(holder=self.holder, lease_until=now + timedelta(seconds=RETENTION_LEASE))
+        ).rowcount
+        db.commit()
+        return bool(claimed)
+
+    def _renew(self, db: Session) -> bool:
+        # Extend the lease only while this process still holds it
+        renewed = db.execute(
+            update(RetentionState)
+            .where(RetentionState.name == STATE_NAME, RetentionState.holder == self.holder)
+            .values(lease_until=_now() + timedelta(seconds=RETENTION_LEASE))
+        ).rowcount
+        db.commit()
+        if not renewed:
+            self.leases_lost += 1
+            print("Retention lease taken over by another process; stopping this pass")
+        return bool(renewed)
+
+    def _release(self, db: Session, **values):
+        db.execute(
+            update(RetentionState)
+            .where(RetentionState.name == STATE_NAME, RetentionState.holder == self.holder)
+            .values(lease_until=None, **values)
+        )
+        db.commit()
+
+    def run_once(self, force_maintenance: bool = False) -> dict:
+        """
+        Run one retention and maintenance pass if this process gets the lease.
+
+        Args:
+            force_maintenance (bool): Run ANALYZE and VACUUM regardless of the schedule.
+
+        Returns:
+            dict: Rows archived, buckets pruned and maintenance run,
+                {"skipped": True}, or the rows archived and
+                {"lease_lost": True} if another process took over.
+        """
+        db = self.session_factory()
+        try:
+            if not self._claim(db):
+                return {"skipped": True}
+            state = db.get(RetentionState, STATE_NAME)
+            last_analyze, last_vacuum = state.last_analyze_at, state.last_vacuum_at
+
+            archived = 0
+            lost = False
+
+            def should_stop():
+                # Checked between batches: renew the lease for the next one
+                nonlocal lost
+                if self._stopping.is_set():
+                    return True
+                lost = not self._renew(db)
+                return lost
+
+            conditions = over_limit_conditions(db, self.max_per_user)
+            expired = expired_condition(self.max_age_days)
+            if expired is not None:
+                conditions.insert(0, expired)
+            for condition in conditions:
+                archived += archive_matching(db, condition, self.batch_size, self.archive_dir, should_stop)
+                if lost:
+                    break
+            self.archived += archived
+            if lost or not self._renew(db):
+                return {"archived": archived, "lease_lost": True}
+            pruned = prune_rollups(db, "minute", self.minute_rollup_days)
+            self.rollups_pruned += pruned
+
+            now = _now()
+            done = {"archived": archived, "rollups_pruned": pruned, "analyzed": False, "vacuumed": False}
+            finished = {"last_run_at": now}
+            if force_maintenance or archived or pruned or last_analyze is None \
+                    or now - last_analyze >= timedelta(seconds=ANALYZE_INTERVAL):
+                analyze(self.bind)
+                self.analyzes += 1
+                done["analyzed"] = True
+                finished["last_analyze_at"] = now
+            if force_maintenance or last_vacuum is None or now - last_vacuum >= timedelta(seconds=VACUUM_INTERVAL):
+                if force_maintenance or free_page_ratio(self.bind) >= VACUUM_MIN_FREE:
+                    db.close()  # VACUUM needs no other transaction on this connection
+                    vacuum(self.bind)
+                    self.vacuums += 1
+                    done["vacuumed"] = True
+                    finished["last_vacuum_at"] = now
+
+            self._release(db, **finished)
+            self.runs += 1
+            return done
+        finally:
+            db.close()
+
+    def status(self) -> dict:
+        """
+        The persisted state of the queries table's retention.
+        """
+        db = self.session_factory()
+        try:
+            state = db.get(RetentionState, STATE_NAME)
+            return {
+                "max_age_days": self.max_age_days,
+                "max_per_user": self.max_per_user,
+                "minute_rollup_days": self.minute_rollup_days,
+                "archived": state.archived if state else 0,
+                "last_run_at": _plain(state.last_run_at) if state else None,
+                "last_analyze_at": _plain(state.last_analyze_at) if state else None,
+                "last_vacuum_at": _plain(state.last_vacuum_at) if state else None,
+                "free_page_ratio": round(free_page_ratio(self.bind), 4),
+            }
+        finally:
+            db.close()
+
+
+# Shared instance started by the app
+retention_job = RetentionJob()
+
+
+if __name__ == "__main__":
+    from database import init_db
+
+    init_db()
+    if sys.argv[1:2] == ["status"]:
+        print(retention_job.status())
+    else:
+        print(retention_job.run_once(force_maintenance="--vacuum" in sys.argv))
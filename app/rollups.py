@@ -0,0 +1,282 @@
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import DateTime, Integer, String, and_, delete, func, literal, or_, select, tuple_, union_all
+from sqlalchemy.orm import Session
+from database import Query, SentimentRollup, SessionLocal, dialect_insert, init_db
+
+# Bucket sizes maintained for every scope
+GRANULARITIES = ("minute", "hour", "day")
+SCOPES = ("global", "user", "country")
+BUCKET_SIZES = {"minute": timedelta(minutes=1), "hour": timedelta(hours=1), "day": timedelta(days=1)}
+UNROLL_CHUNK_SIZE = 200  # buckets per SELECT when removing deleted queries
+
+# Sentiment label -> per-label counter column
+LABEL_COLUMNS = {
+    "Very Positive": "very_positive",
+    "Positive": "positive",
+    "Neutral": "neutral",
+    "Negative": "negative",
+    "Very Negative": "very_negative",
+}
+
+
+def to_utc_naive(time: datetime) -> datetime:
+    """
+    Convert a timestamp to naive UTC (how buckets are stored).
+    """
+    if time.tzinfo is not None:
+        time = time.astimezone(timezone.utc).replace(tzinfo=None)
+    return time
+
+
+def bucket_start(time: datetime, granularity: str) -> datetime:
+    """
+    Truncate a timestamp to the start of its minute/hour/day bucket (naive UTC).
+    """
+    time = to_utc_naive(time)
+    if granularity == "minute":
+        return time.replace(second=0, microsecond=0)
+    if granularity == "hour":
+        return time.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return time.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def scope_keys(row, scopes=SCOPES):
+    """
+    Yield the (scope, scope_key) pairs a query row contributes to.
+    Rows without a user or country are skipped for that scope.
+    """
+    for scope in scopes:
+        if scope == "global":
+            yield scope, ""
+        elif scope == "user" and row.get("user_id") is not None:
+            yield scope, str(row["user_id"])
+        elif scope == "country" and row.get("country"):
+            yield scope, row["country"]
+
+
+# ---------- Incremental maintenance ----------
+
+def record(db: Session, rows, scopes=SCOPES):
+    """
+    Add saved queries to the rollups (part of the caller's transaction).
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        rows (list[dict]): Query values with time, score, sentiment, user_id, country.
+        scopes (tuple): Scopes to update (e.g. only "country" once a row is located).
+    """
+    deltas = {}
+    for row in rows:
+        if row.get("time") is None:
+            continue
+        score = row["score"]
+        label = LABEL_COLUMNS.get(row["sentiment"])
+        for scope, key in scope_keys(row, scopes):
+            for granularity in GRANULARITIES:
+                k = (scope, key, granularity, bucket_start(row["time"], granularity))
+                d = deltas.get(k)
+                if d is None:
+                    d = deltas[k] = {"count": 0, "score_sum": 0.0, "score_min": score, "score_max": score,
+                                     **{col: 0 for col in LABEL_COLUMNS.values()}}
+                d["count"] += 1
+                d["score_sum"] += score
+                d["score_min"] = min(d["score_min"], score)
+                d["score_max"] = max(d["score_max"], score)
+                if label:
+                    d[label] += 1
+    if not deltas:
+        return
+
+    values = [
+        {"scope": s, "scope_key": k, "granularity": g, "bucket_start": b, **d}
+        for (s, k, g, b), d in deltas.items()
+    ]
+    postgres = db.get_bind().dialect.name == "postgresql"
+    least, greatest = (func.least, func.greatest) if postgres else (func.min, func.max)
+
+    stmt = dialect_insert(db, SentimentRollup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SentimentRollup.scope, SentimentRollup.scope_key,
+                        SentimentRollup.granularity, SentimentRollup.bucket_start],
+        set_={
+            "count": SentimentRollup.count + stmt.excluded.count,
+            "score_sum": SentimentRollup.score_sum + stmt.excluded.score_sum,
+            "score_min": least(SentimentRollup.score_min, stmt.excluded.score_min),
+            "score_max": greatest(SentimentRollup.score_max, stmt.excluded.score_max),
+            **{col: getattr(SentimentRollup, col) + getattr(stmt.excluded, col) for col in LABEL_COLUMNS.values()},
+        },
+    )
+    db.execute(stmt, values)
+
+
+def _load_buckets(db: Session, keys):
+    """
+    Load the rollup buckets with the given (scope, key, granularity, start)
+    primary keys, `UNROLL_CHUNK_SIZE` keys per SELECT.
+    """
+    pk = tuple_(SentimentRollup.scope, SentimentRollup.scope_key,
+                SentimentRollup.granularity, SentimentRollup.bucket_start)
+    buckets = []
+    for start in range(0, len(keys), UNROLL_CHUNK_SIZE):
+        buckets.extend(db.scalars(select(SentimentRollup).where(pk.in_(keys[start:start + UNROLL_CHUNK_SIZE]))))
+    return buckets
+
+
+def _recompute_extremes(db: Session, buckets):
+    """
+    Recompute score_min/score_max of buckets from their remaining rows, with
+    one grouped SELECT per `UNROLL_CHUNK_SIZE` buckets.
+
+    A bucket with fewer rows left in the table than it counts still covers
+    archived rows (retention archives without subtracting from the rollups),
+    so its stored min/max are kept: they remain bounds of the whole bucket,
+    while the remaining rows alone would understate them.
+    """
+    for start in range(0, len(buckets), UNROLL_CHUNK_SIZE):
+        chunk = buckets[start:start + UNROLL_CHUNK_SIZE]
+        targets = union_all(*(
+            select(
+                literal(n, Integer).label("n"),
+                literal(b.bucket_start, DateTime).label("start"),
+                literal(b.bucket_start + BUCKET_SIZES[b.granularity], DateTime).label("end"),
+                literal(int(b.scope_key) if b.scope == "user" else None, Integer).label("user_id"),
+                literal(b.scope_key if b.scope == "country" else None, String).label("country"),
+            )
+            for n, b in enumerate(chunk)
+        )).subquery("buckets")
+        stmt = (
+            select(targets.c.n, func.count(), func.min(Query.score), func.max(Query.score))
+            .join(Query, and_(
+                Query.time >= targets.c.start,
+                Query.time < targets.c.end,
+                or_(targets.c.user_id.is_(None), Query.user_id == targets.c.user_id),
+                or_(targets.c.country.is_(None), Query.country == targets.c.country),
+            ))
+            .group_by(targets.c.n)
+        )
+        for n, count, score_min, score_max in db.execute(stmt):
+            bucket = chunk[n]
+            if count == bucket.count:
+                bucket.score_min, bucket.score_max = score_min, score_max
+
+
+def unrecord(db: Session, rows, scopes=SCOPES):
+    """
+    Remove deleted queries from the rollups (part of the caller's transaction).
+
+    The rows are grouped by bucket first, and each bucket's counts, sums and
+    label counters are decremented once. Min/max cannot be decremented: they
+    are recomputed from the bucket's remaining rows, only when a deleted
+    score was the bucket's min or max (see `_recompute_extremes` for buckets
+    with archived rows). Call this after the rows have been deleted (and
+    flushed).
+    """
+    deltas = {}
+    for row in rows:
+        if row.get("time") is None:
+            continue
+        score = row["score"]
+        label = LABEL_COLUMNS.get(row["sentiment"])
+        for scope, key in scope_keys(row, scopes):
+            for granularity in GRANULARITIES:
+                k = (scope, key, granularity, bucket_start(row["time"], granularity))
+                d = deltas.get(k)
+                if d is None:
+                    d = deltas[k] = {"count": 0, "score_sum": 0.0, "scores": set(),
+                                     **{col: 0 for col in LABEL_COLUMNS.values()}}
+                d["count"] += 1
+                d["score_sum"] += score
+                d["scores"].add(score)
+                if label:
+                    d[label] += 1
+    if not deltas:
+        return
+
+    stale = []
+    for bucket in _load_buckets(db, list(deltas)):
+        d = deltas[(bucket.scope, bucket.scope_key, bucket.granularity, bucket.bucket_start)]
+        bucket.count -= d["count"]
+        bucket.score_sum -= d["score_sum"]
+        for col in LABEL_COLUMNS.values():
+            setattr(bucket, col, getattr(bucket, col) - d[col])
+        if bucket.count <= 0:
+            db.delete(bucket)
+        elif bucket.score_min in d["scores"] or bucket.score_max in d["scores"]:
+            stale.append(bucket)
+    _recompute_extremes(db, stale)
+
+
+def rebuild_rollups(db: Session, chunk_size: int = 10000):
+    """
+    Recompute every rollup from the queries table (backfill / repair).
+    """
+    db.execute(delete(SentimentRollup))
+    rows = db.query(
+        Query.time, Query.score, Query.sentiment, Query.user_id, Query.country
+    ).execution_options(yield_per=chunk_size)
+    chunk = []
+    for row in rows:
+        chunk.append(row._asdict())
+        if len(chunk) >= chunk_size:
+            record(db, chunk)
+            chunk = []
+    record(db, chunk)
+    db.commit()
+
+
+# ---------- Reads ----------
+
+def trend_series(db: Session, scope: str, key: str, granularity: str, start: datetime = None, end: datetime = None):
+    """
+    Read a sentiment time series straight from the rollups.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        scope (str): "global", "user" or "country".
+        key (str): User ID or country ("" for global).
+        granularity (str): "minute", "hour" or "day".
+        start, end (datetime): Optional time range (inclusive start, exclusive end).
+
+    Returns:
+        list[dict]: One entry per bucket, oldest first, with count, mean/min/max
+                    compound score and per-label counts.
+    """
+    if scope not in SCOPES:
+        raise ValueError(f"Unknown scope: {scope}")
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity: {granularity}")
+
+    query = db.query(SentimentRollup).filter(
+        SentimentRollup.scope == scope,
+        SentimentRollup.scope_key == key,
+        SentimentRollup.granularity == granularity,
+    )
+    if start is not None:
+        query = query.filter(SentimentRollup.bucket_start >= bucket_start(start, granularity))
+    if end is not None:
+        query = query.filter(SentimentRollup.bucket_start < to_utc_naive(end))
+
+    return [
+        {
+            "bucket": r.bucket_start.isoformat(),
+            "count": r.count,
+            "mean": round(r.score_sum / r.count, 4),
+            "min": r.score_min,
+            "max": r.score_max,
+            "labels": {label: getattr(r, col) for label, col in LABEL_COLUMNS.items()},
+        }
+        for r in query.order_by(SentimentRollup.bucket_start)
+    ]
+
+
+if __name__ == "__main__":
+    # Backfill rollups for queries saved before they existed
+    init_db()
+    session = SessionLocal()
+    try:
+        rebuild_rollups(session)
+        print("Sentiment rollups rebuilt.")
+    finally:
+        session.close()
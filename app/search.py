@@ -0,0 +1,398 @@
+"""
+Keyword search over saved queries.
+
+The index is created by migration 6 (rebuilt with an owner column by
+migration 8) and kept in sync with `queries` by the database itself, so
+every write path (ORM saves, bulk inserts, the group-commit writer, deletes,
+retention) updates it:
+- SQLite: `queries_fts`, an FTS5 table over `queries.text` and the query's
+  owner (external content read through a view, so the text is not stored
+  twice) with insert, delete and update triggers;
+- PostgreSQL: a generated `text_tsv` tsvector column with a GIN index.
+
+Search input is split into words that must all match; `word*` matches a
+prefix. Words are matched without stemming or stop words, so negations like
+"not" stay searchable. Filters (user, label, score range, time, country) are
+applied in the same statement. On SQLite a user's search matches a
+"u<user ID>" word in the owner column, so FTS5 intersects the user's rows
+with the words' rows instead of joining every match.
+
+Results come newest first, or by relevance: FTS5's bm25() (ts_rank() on
+PostgreSQL), paged with a keyset cursor on (rank, id), so every match is
+reachable. bm25() counts each word's matching rows once per search, which
+takes longer the more common the word is. Newest first, a user's history of
+up to SEARCH_USER_SCAN queries is read whole and matched here, which is
+faster than probing the index once per row.
+
+Rebuild the index from the table (e.g. after restoring a backup):
+
+    python search.py
+"""
+import base64
+import os
+import re
+import string
+import unicodedata
+from datetime import datetime
+from sqlalchemy import Integer, and_, column, func, literal, literal_column, or_, select, table, text, tuple_
+from sqlalchemy.orm import Session
+from database import Query, SessionLocal, init_db
+from export import export_filters
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+SEARCH_USER_SCAN = int(os.getenv("SEARCH_USER_SCAN", "2000"))  # histories up to this size are matched without the index
+SEARCH_MAX_TERMS = 16
+SEARCH_ORDERS = ("relevance", "newest")
+TS_CONFIG = "simple"  # PostgreSQL text search configuration (no stemming, no stop words)
+
+SEARCH_COLUMNS = (
+    Query.id, Query.time, Query.user_id, Query.text, Query.sentiment,
+    Query.score, Query.confidence, Query.city, Query.country,
+)
+
+# Words of letters and digits, as FTS5's unicode61 tokenizer splits them
+WORD_RE = re.compile(r"[^\W_]+")
+TERM_RE = re.compile(r"[^\W_]+\*?")
+ASCII_SEPARATORS = bytes.maketrans(string.punctuation.encode(), b" " * len(string.punctuation))
+
+queries_fts = table("queries_fts", column("rowid", Integer))
+
+
+# ---------- Index ----------
+
+# The index reads its columns through a view: `owner` is a "u<user ID>" word,
+# so a user's search is one MATCH over both columns
+FTS_DDL = (
+    "CREATE VIEW IF NOT EXISTS queries_fts_source AS "
+    "SELECT id, text, 'u' || user_id AS owner FROM queries",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS queries_fts USING fts5("
+    "text, owner, content='queries_fts_source', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS queries_fts_insert AFTER INSERT ON queries BEGIN "
+    "INSERT INTO queries_fts(rowid, text, owner) VALUES (new.id, new.text, 'u' || new.user_id); END",
+    "CREATE TRIGGER IF NOT EXISTS queries_fts_delete AFTER DELETE ON queries BEGIN "
+    "INSERT INTO queries_fts(queries_fts, rowid, text, owner) "
+    "VALUES ('delete', old.id, old.text, 'u' || old.user_id); END",
+    "CREATE TRIGGER IF NOT EXISTS queries_fts_update AFTER UPDATE OF text, user_id ON queries BEGIN "
+    "INSERT INTO queries_fts(queries_fts, rowid, text, owner) "
+    "VALUES ('delete', old.id, old.text, 'u' || old.user_id); "
+    "INSERT INTO queries_fts(rowid, text, owner) VALUES (new.id, new.text, 'u' || new.user_id); END",
+)
+
+# Everything FTS_DDL creates, in the order it can be dropped
+FTS_OBJECTS = (
+    ("TRIGGER", "queries_fts_insert"),
+    ("TRIGGER", "queries_fts_delete"),
+    ("TRIGGER", "queries_fts_update"),
+    ("TABLE", "queries_fts"),
+    ("VIEW", "queries_fts_source"),
+)
+
+TSVECTOR_DDL = (
+    "ALTER TABLE queries ADD COLUMN IF NOT EXISTS text_tsv tsvector "
+    f"GENERATED ALWAYS AS (to_tsvector('{TS_CONFIG}', coalesce(text, ''))) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_queries_text_tsv ON queries USING gin (text_tsv)",
+)
+
+
+def fts5_available(conn) -> bool:
+    """
+    Whether the SQLite library was compiled with FTS5.
+    """
+    options = {row[0] for row in conn.execute(text("PRAGMA compile_options"))}
+    return "ENABLE_FTS5" in options
+
+
+def has_search_index(conn) -> bool:
+    """
+    Whether the FTS5 table exists (always True on PostgreSQL).
+    """
+    if conn.dialect.name == "postgresql":
+        return True
+    stmt = text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'queries_fts'")
+    return conn.execute(stmt).first() is not None
+
+
+def create_search_index(conn):
+    """
+    Create the full-text index and its sync triggers, and index existing rows.
+    On a SQLite build without FTS5, searches fall back to scanning the table.
+    """
+    if conn.dialect.name == "postgresql":
+        for statement in TSVECTOR_DDL:
+            conn.execute(text(statement))  # the generated column indexes existing rows
+        return
+    if not fts5_available(conn):
+        print("SQLite was built without FTS5: /search will scan the queries table.")
+        return
+    for statement in FTS_DDL:
+        conn.execute(text(statement))
+    rebuild_search_index(conn)
+
+
+def drop_search_index(conn):
+    """
+    Drop the FTS5 table and its triggers (SQLite; the PostgreSQL column stays).
+    """
+    if conn.dialect.name == "postgresql":
+        return
+    for kind, name in FTS_OBJECTS:
+        conn.execute(text(f"DROP {kind} IF EXISTS {name}"))
+
+
+def rebuild_search_index(conn):
+    """
+    Re-index every query from the table (SQLite; PostgreSQL needs nothing).
+    """
+    if conn.dialect.name != "postgresql" and has_search_index(conn):
+        conn.execute(text("INSERT INTO queries_fts(queries_fts) VALUES ('rebuild')"))
+
+
+# ---------- Query parsing ----------
+
+def _fold(value: str) -> str:
+    """
+    Lowercase and strip diacritics, like the FTS5 tokenizer.
+    """
+    value = value.lower()
+    if value.isascii():
+        return value
+    return "".join(c for c in unicodedata.normalize("NFKD", value) if not unicodedata.combining(c))
+
+
+def _words(value: str):
+    """
+    Return (is_ascii, words) for a text: words as bytes for ASCII text,
+    otherwise as strings.
+    """
+    value = _fold(value)
+    if value.isascii():
+        return True, value.encode().translate(ASCII_SEPARATORS).split()
+    return False, WORD_RE.findall(value)
+
+
+def parse_terms(q: str):
+    """
+    Split search input into (word, is_prefix) terms, all of which must match.
+    Raises ValueError if there are no words.
+    """
+    terms = []
+    for match in TERM_RE.finditer(_fold(q)):
+        word = match.group()
+        terms.append((word.rstrip("*"), word.endswith("*")))
+    if not terms:
+        raise ValueError("Search needs at least one word.")
+    return terms[:SEARCH_MAX_TERMS]
+
+
+def fts5_query(terms, user_id: int = None) -> str:
+    # Each word quoted, so FTS5 operators in the input are searched literally
+    words = " ".join(f'"{word}"' + ("*" if prefix else "") for word, prefix in terms)
+    if user_id is None:
+        return f"text : ({words})"
+    return f'text : ({words}) AND owner : "u{int(user_id)}"'
+
+
+def tsquery(terms) -> str:
+    return " & ".join(word + (":*" if prefix else "") for word, prefix in terms)
+
+
+def _contains(query_text: str, terms) -> bool:
+    """
+    Whether a text has every term as a word (or word prefix), as the index
+    would match it.
+    """
+    ascii_text, words = _words(query_text or "")
+    for word, prefix in terms:
+        if ascii_text:
+            if not word.isascii():
+                return False
+            word = word.encode()
+        if not (any(w.startswith(word) for w in words) if prefix else word in words):
+            return False
+    return True
+
+
+def _small_history(db: Session, user_id: int) -> bool:
+    # Counts at most SEARCH_USER_SCAN + 1 entries of the user's index
+    ids = select(Query.id).where(Query.user_id == user_id).limit(SEARCH_USER_SCAN + 1).subquery()
+    return db.scalar(select(func.count()).select_from(ids)) <= SEARCH_USER_SCAN
+
+
+def _matches(conn, terms, user_id: int = None):
+    """
+    Return (conditions matching all terms, row ID column, rank) for the
+    backend. The row ID is the FTS5 rowid when the FTS5 table drives the
+    query, in which case the conditions also select the user's rows. The
+    rank is lower for more relevant rows: FTS5's bm25() over the text column,
+    or the negated ts_rank() on PostgreSQL.
+    """
+    if conn.dialect.name == "postgresql":
+        query = func.to_tsquery(TS_CONFIG, tsquery(terms))
+        tsv = literal_column("queries.text_tsv")
+        return [tsv.op("@@")(query)], Query.id, -func.ts_rank(tsv, query)
+    if has_search_index(conn):
+        match = literal_column("queries_fts").op("MATCH")(fts5_query(terms, user_id))
+        return [match], queries_fts.c.rowid, func.bm25(literal_column("queries_fts"), 1.0, 0.0)
+    # No FTS5: a scan with LIKE (case-insensitive for ASCII only), unranked
+    conditions = []
+    for word, _ in terms:
+        escaped = word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        conditions.append(Query.text.ilike(f"%{escaped}%", escape="\\"))
+    return conditions, Query.id, literal(0.0)
+
+
+def _from(stmt, row_id):
+    if row_id is Query.id:
+        return stmt
+    return stmt.select_from(queries_fts).join(Query, Query.id == queries_fts.c.rowid)
+
+
+# ---------- Cursors ----------
+
+def encode_search_cursor(*values) -> str:
+    """
+    Encode the position after a page as an opaque cursor: (rank, ID) for
+    relevance, (ID,) or (time, ID) for newest first.
+    """
+    raw = "|".join(value.isoformat() if isinstance(value, datetime) else str(value) for value in values)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_search_cursor(cursor: str, *types):
+    """
+    Decode a search cursor into one value per type (e.g. `float, int`; use
+    `datetime.fromisoformat` for a time). Raises ValueError if malformed.
+    """
+    try:
+        values = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        if len(values) != len(types):
+            raise ValueError(cursor)
+        return tuple(parse(value) for parse, value in zip(types, values))
+    except Exception as e:
+        raise ValueError("Invalid search cursor") from e
+
+
+# ---------- Search ----------
+
+def search_filters(sentiment: str = None, min_score: float = None, max_score: float = None,
+                   start=None, end=None, country: str = None):
+    """
+    Build the WHERE conditions of a search (see `export.export_filters`).
+    Raises ValueError for an unknown label.
+    """
+    conditions = export_filters(start, end, sentiment, country)
+    if min_score is not None:
+        conditions.append(Query.score >= min_score)
+    if max_score is not None:
+        conditions.append(Query.score <= max_score)
+    return conditions
+
+
+def search_queries(db: Session, q: str, user_id: int = None, conditions=(), order: str = "relevance",
+                   cursor: str = None, limit: int = SEARCH_PAGE_SIZE):
+    """
+    Search saved queries by keyword.
+
+    With `user_id` only that user's queries are read: through the index's
+    owner column, or by scanning a small history newest first.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        q (str): Search words (all must match; `word*` for a prefix).
+        user_id (int): Only search this user's queries.
+        conditions (list): More filters, from `search_filters`.
+        order (str): "relevance" or "newest".
+        cursor (str): `next_cursor` of the previous page, or None.
+        limit (int): Results per page (at most SEARCH_MAX_PAGE_SIZE).
+
+    Returns:
+        tuple[list[dict], str or None]: The page of results and the cursor of
+        the next page (None on the last page). Raises ValueError for empty
+        input, an unknown order or a malformed cursor.
+    """
+    if order not in SEARCH_ORDERS:
+        raise ValueError(f"order must be one of {', '.join(SEARCH_ORDERS)}")
+    terms = parse_terms(q)
+    limit = max(1, min(limit, SEARCH_MAX_PAGE_SIZE))
+    # A small history is read whole and matched by `_contains` instead
+    # (newest first only: ranking needs the index's statistics)
+    scan = order == "newest" and user_id is not None and _small_history(db, user_id)
+    match, row_id, rank = ([], Query.id, None) if scan else _matches(db.connection(), terms, user_id)
+
+    stmt = _from(select(*SEARCH_COLUMNS), row_id).where(*match, *conditions)
+    if user_id is not None and row_id is Query.id:
+        stmt = stmt.where(Query.user_id == user_id)
+
+    if order == "newest":
+        if user_id is None:
+            newest = (row_id.desc(),)
+            if cursor:
+                (last_id,) = decode_search_cursor(cursor, int)
+                stmt = stmt.where(row_id < last_id)
+        else:
+            # (time, id) order, so a scan walks the user's history index
+            newest = (Query.time.desc(), Query.id.desc())
+            if cursor:
+                stmt = stmt.where(tuple_(Query.time, Query.id) < decode_search_cursor(cursor, datetime.fromisoformat, int))
+        stmt = stmt.order_by(*newest)
+        if scan:
+            rows = [row for row in db.execute(stmt) if _contains(row.text, terms)][:limit + 1]
+        else:
+            rows = db.execute(stmt.limit(limit + 1)).all()
+        page = [(None, row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_search_cursor(last.id) if user_id is None else encode_search_cursor(last.time, last.id)
+    else:
+        # Keyset on (rank, id): each page starts after the last row of the
+        # previous one, so every match is reachable however deep
+        ranked = rank.label("search_rank")
+        if cursor:
+            last_rank, last_id = decode_search_cursor(cursor, float, int)
+            stmt = stmt.where(or_(rank > last_rank, and_(rank == last_rank, row_id < last_id)))
+        stmt = stmt.add_columns(ranked).order_by(ranked, row_id.desc())
+        rows = db.execute(stmt.limit(limit + 1)).all()
+        page = [(-row.search_rank, row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_search_cursor(last.search_rank, last.id)
+
+    return [search_result(row, relevance) for relevance, row in page], next_cursor
+
+
+def search_result(row, relevance: float = None) -> dict:
+    return {
+        "id": row.id,
+        "time": row.time.isoformat() if row.time else None,
+        "user_id": row.user_id,
+        "text": row.text,
+        "sentiment": row.sentiment,
+        "score": row.score,
+        "confidence": row.confidence,
+        "city": row.city,
+        "country": row.country,
+        "relevance": round(relevance, 4) if relevance is not None else None,
+    }
+
+
+async def search_queries_async(db, q: str, user_id: int = None, conditions=(), order: str = "relevance",
+                               cursor: str = None, limit: int = SEARCH_PAGE_SIZE):
+    """
+    Async version of `search_queries`.
+    """
+    return await db.run_sync(search_queries, q, user_id, conditions, order, cursor, limit)
+
+
+if __name__ == "__main__":
+    init_db()
+    session = SessionLocal()
+    try:
+        rebuild_search_index(session.connection())
+        session.commit()
+        print("Search index rebuilt.")
+    finally:
+        session.close()
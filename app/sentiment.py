@@ -1,13 +1,338 @@
+import asyncio
+import math
+import multiprocessing
+import os
 import re
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
-import nltk
+import string
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from lexicon import load_lexicon
+from metrics import stage
+from sentiment_cache import lexicon_digest, result_cache, text_key
+from textnorm import build_default_normalizer
 
-# Download the VADER lexicon for sentiment analysis (only needed once)
-nltk.download("vader_lexicon")
+# Precompiled single-pass normalizer used by clean_text
+normalizer = build_default_normalizer()
 
-# Initialize the VADER sentiment analyzer
-sia = SentimentIntensityAnalyzer()
+# Compound score thresholds used by classify_sentiment
+VERY_POSITIVE_THRESHOLD = 0.7
+POSITIVE_THRESHOLD = 0.25
+NEGATIVE_THRESHOLD = -0.25
+VERY_NEGATIVE_THRESHOLD = -0.7
 
+# "fast": FastVader (same scores as NLTK, several times faster); "nltk": NLTK's analyzer
+SENTIMENT_SCORER = os.getenv("SENTIMENT_SCORER", "fast")
+
+
+def build_analyzer(lexicon: dict):
+    """
+    Build NLTK's VADER analyzer from an already loaded lexicon dict, instead of
+    reading the lexicon through `nltk.data` on construction.
+    NLTK is imported here because importing it is slow.
+    """
+    from nltk.sentiment.vader import SentimentIntensityAnalyzer, VaderConstants
+
+    sia = SentimentIntensityAnalyzer.__new__(SentimentIntensityAnalyzer)
+    sia.lexicon_file = None
+    sia.lexicon = lexicon
+    sia.constants = VaderConstants()
+    return sia
+
+
+# ---------- Fast VADER scorer ----------
+
+_PUNCTUATION = frozenset(string.punctuation)
+_HAS_PUNCTUATION = re.compile(f"[{re.escape(string.punctuation)}]")
+
+
+class FastVader:
+    """
+    Re-implementation of NLTK's `SentimentIntensityAnalyzer.polarity_scores`
+    that returns bit-identical scores (see benchmarks/bench_vader.py).
+
+    NLTK rebuilds a punctuation x word dict, lowercases every token several
+    times and scans lists for boosters and negations on every call. Here the
+    lexicon, booster, negation and idiom tables are built once, the text is
+    tokenized in a single pass, and each token is lowercased once. The rules
+    (including NLTK's quirks, such as repeated tokens being scored at the
+    position of their first occurrence) and the order of floating-point
+    operations are unchanged.
+
+    The tables come from NLTK's `VaderConstants`, so they always match the
+    installed NLTK version.
+
+    Args:
+        lexicon (dict): {word: valence}, as returned by `load_lexicon`.
+    """
+
+    def __init__(self, lexicon: dict):
+        from nltk.sentiment.vader import VaderConstants
+
+        self.lexicon = dict(lexicon)  # private copy, never modified
+        self.negate = frozenset(VaderConstants.NEGATE)
+        self.boosters = {word: value for word, value in VaderConstants.BOOSTER_DICT.items() if " " not in word}
+        self.booster_bigrams = frozenset(
+            tuple(phrase.split(" ")) for phrase in VaderConstants.BOOSTER_DICT if " " in phrase
+        )
+        self.idioms = {tuple(phrase.split(" ")): value for phrase, value in VaderConstants.SPECIAL_CASE_IDIOMS.items()}
+        # A token outside this set can't be part of an idiom or booster bigram
+        self.idiom_words = frozenset(word for phrase in list(self.idioms) + list(self.booster_bigrams) for word in phrase)
+        self.punc_list = frozenset(VaderConstants.PUNC_LIST)
+        self.b_decr = VaderConstants.B_DECR
+        self.c_incr = VaderConstants.C_INCR
+        self.n_scalar = VaderConstants.N_SCALAR
+
+    def tokenize(self, text: str):
+        """
+        Split on whitespace, drop single characters, and strip a leading or
+        trailing punctuation run that is in PUNC_LIST from words of two or
+        more characters without other punctuation (NLTK's `SentiText`).
+        """
+        tokens = []
+        for token in text.split():
+            if len(token) < 2:
+                continue
+            if token[-1] in _PUNCTUATION:
+                end = len(token) - 1
+                while end > 0 and token[end - 1] in _PUNCTUATION:
+                    end -= 1
+                core = token[:end]
+                if len(core) > 1 and token[end:] in self.punc_list and not _HAS_PUNCTUATION.search(core):
+                    token = core
+            elif token[0] in _PUNCTUATION:
+                start = 1
+                while token[start] in _PUNCTUATION:
+                    start += 1
+                core = token[start:]
+                if len(core) > 1 and token[:start] in self.punc_list and not _HAS_PUNCTUATION.search(core):
+                    token = core
+            tokens.append(token)
+        return tokens
+
+    def _negated(self, word_lower: str) -> bool:
+        return word_lower in self.negate or "n't" in word_lower
+
+    def _idioms_check(self, valence, words, i, n):
+        if self.idiom_words.isdisjoint(words[i - 3:i + 3]):
+            return valence
+        idioms = self.idioms
+        for sequence in (
+            (words[i - 1], words[i]),
+            (words[i - 2], words[i - 1], words[i]),
+            (words[i - 2], words[i - 1]),
+            (words[i - 3], words[i - 2], words[i - 1]),
+            (words[i - 3], words[i - 2]),
+        ):
+            if sequence in idioms:
+                valence = idioms[sequence]
+                break
+        if n - 1 > i and (words[i], words[i + 1]) in idioms:
+            valence = idioms[(words[i], words[i + 1])]
+        if n - 1 > i + 1 and (words[i], words[i + 1], words[i + 2]) in idioms:
+            valence = idioms[(words[i], words[i + 1], words[i + 2])]
+        if (words[i - 3], words[i - 2]) in self.booster_bigrams or (words[i - 2], words[i - 1]) in self.booster_bigrams:
+            valence = valence + self.b_decr
+        return valence
+
+    def _valence(self, i, words, lowers, upper, in_lexicon, is_cap_diff, n):
+        """
+        Valence of the lexicon word at position i (NLTK's `sentiment_valence`).
+        """
+        boosters = self.boosters
+        c_incr = self.c_incr
+        n_scalar = self.n_scalar
+
+        valence = self.lexicon[lowers[i]]
+        if upper[i] and is_cap_diff:
+            if valence > 0:
+                valence += c_incr
+            else:
+                valence -= c_incr
+
+        for start_i in range(0, 3):
+            j = i - (start_i + 1)
+            if i > start_i and not in_lexicon[j]:
+                # scalar_inc_dec for the preceding word
+                s = 0.0
+                if lowers[j] in boosters:
+                    s = boosters[lowers[j]]
+                    if valence < 0:
+                        s *= -1
+                    if upper[j] and is_cap_diff:
+                        if valence > 0:
+                            s += c_incr
+                        else:
+                            s -= c_incr
+                if start_i == 1 and s != 0:
+                    s = s * 0.95
+                if start_i == 2 and s != 0:
+                    s = s * 0.9
+                valence = valence + s
+
+                # never_check
+                if start_i == 0:
+                    if self._negated(lowers[i - 1]):
+                        valence = valence * n_scalar
+                elif start_i == 1:
+                    if words[i - 2] == "never" and (words[i - 1] == "so" or words[i - 1] == "this"):
+                        valence = valence * 1.5
+                    elif self._negated(lowers[i - 2]):
+                        valence = valence * n_scalar
+                else:
+                    if (
+                        words[i - 3] == "never" and (words[i - 2] == "so" or words[i - 2] == "this")
+                        or (words[i - 1] == "so" or words[i - 1] == "this")
+                    ):
+                        valence = valence * 1.25
+                    elif self._negated(lowers[i - 3]):
+                        valence = valence * n_scalar
+                    valence = self._idioms_check(valence, words, i, n)
+
+        # least_check
+        if i > 1 and not in_lexicon[i - 1] and lowers[i - 1] == "least":
+            if lowers[i - 2] != "at" and lowers[i - 2] != "very":
+                valence = valence * n_scalar
+        elif i > 0 and not in_lexicon[i - 1] and lowers[i - 1] == "least":
+            valence = valence * n_scalar
+        return valence
+
+    def polarity_scores(self, text: str) -> dict:
+        """
+        Return {"neg", "neu", "pos", "compound"} exactly as NLTK does.
+        """
+        if not isinstance(text, str):
+            text = str(text.encode("utf-8"))
+        words = self.tokenize(text)
+        n = len(words)
+        lowers = [word.lower() for word in words]
+        upper = [word.isupper() for word in words]
+        lexicon = self.lexicon
+        in_lexicon = [word in lexicon for word in lowers]
+        allcaps = sum(upper)
+        is_cap_diff = 0 < n - allcaps < n
+
+        first_index = {}
+        for idx, token in enumerate(words):
+            if token not in first_index:
+                first_index[token] = idx
+
+        boosters = self.boosters
+        sentiments = []
+        for item in words:
+            i = first_index[item]
+            lower = lowers[i]
+            if (i < n - 1 and lower == "kind" and lowers[i + 1] == "of") or lower in boosters:
+                sentiments.append(0)
+            elif in_lexicon[i]:
+                sentiments.append(self._valence(i, words, lowers, upper, in_lexicon, is_cap_diff, n))
+            else:
+                sentiments.append(0)
+
+        # but_check
+        if "but" in lowers:
+            bi = lowers.index("but")
+            for sidx, sentiment in enumerate(sentiments):
+                if sidx < bi:
+                    sentiments[sidx] = sentiment * 0.5
+                elif sidx > bi:
+                    sentiments[sidx] = sentiment * 1.5
+
+        return self._score_valence(sentiments, text)
+
+    @staticmethod
+    def _score_valence(sentiments, text):
+        if sentiments:
+            sum_s = float(sum(sentiments))
+
+            # Emphasis from exclamation points (up to 4) and question marks
+            ep_count = min(text.count("!"), 4)
+            qm_count = text.count("?")
+            qm_amplifier = 0
+            if qm_count > 1:
+                qm_amplifier = qm_count * 0.18 if qm_count <= 3 else 0.96
+            punct_emph_amplifier = ep_count * 0.292 + qm_amplifier
+
+            if sum_s > 0:
+                sum_s += punct_emph_amplifier
+            elif sum_s < 0:
+                sum_s -= punct_emph_amplifier
+            compound = sum_s / math.sqrt((sum_s * sum_s) + 15)
+
+            pos_sum = 0.0
+            neg_sum = 0.0
+            neu_count = 0
+            for sentiment_score in sentiments:
+                if sentiment_score > 0:
+                    pos_sum += float(sentiment_score) + 1
+                if sentiment_score < 0:
+                    neg_sum += float(sentiment_score) - 1
+                if sentiment_score == 0:
+                    neu_count += 1
+
+            if pos_sum > math.fabs(neg_sum):
+                pos_sum += punct_emph_amplifier
+            elif pos_sum < math.fabs(neg_sum):
+                neg_sum -= punct_emph_amplifier
+            total = pos_sum + math.fabs(neg_sum) + neu_count
+            pos = math.fabs(pos_sum / total)
+            neg = math.fabs(neg_sum / total)
+            neu = math.fabs(neu_count / total)
+        else:
+            compound = 0.0
+            pos = 0.0
+            neg = 0.0
+            neu = 0.0
+
+        return {
+            "neg": round(neg, 3),
+            "neu": round(neu, 3),
+            "pos": round(pos, 3),
+            "compound": round(compound, 4),
+        }
+
+
+def build_scorer(lexicon: dict, kind: str = None):
+    """
+    Build the scorer selected by SENTIMENT_SCORER ("fast" or "nltk").
+    """
+    kind = kind or SENTIMENT_SCORER
+    if kind == "nltk":
+        return build_analyzer(lexicon)
+    if kind == "fast":
+        return FastVader(lexicon)
+    raise ValueError(f"Unknown SENTIMENT_SCORER: {kind}")
+
+
+# The VADER analyzer is created on first use (see get_analyzer), so importing
+# this module is cheap and never touches the network.
+_sia = None
+_lexicon_digest = None
+_sia_lock = threading.Lock()
+
+
+def get_analyzer():
+    """
+    Load the lexicon and build the VADER analyzer on first call.
+    """
+    global _sia, _lexicon_digest
+    if _sia is None:
+        with _sia_lock:
+            if _sia is None:
+                lexicon = load_lexicon()
+                _lexicon_digest = lexicon_digest(lexicon)
+                _sia = build_scorer(lexicon)
+    return _sia
+
+
+def preload():
+    """
+    Load the analyzer eagerly, e.g. in a server master process before it
+    forks workers, so the lexicon pages are shared copy-on-write.
+    """
+    get_analyzer()
+
+
+@stage("clean_text")
 def clean_text(text: str) -> str:
     """
     Normalize text for more reliable VADER sentiment analysis.
@@ -17,6 +342,8 @@ def clean_text(text: str) -> str:
     2. Remove URLs (both http(s) and www formats).
     3. Reduce excessive punctuation (like "!!!" → "!!").
     4. Reduce stretched words (like "soooo happy" → "soo happy").
+
+    Steps 2-4 run as a single pass of the shared `TextNormalizer`.
     
     Args:
         text (str): Raw input text.
@@ -24,18 +351,8 @@ def clean_text(text: str) -> str:
     Returns:
         str: Cleaned and normalized text.
     """
-    text = text.strip()
-
-    # Remove URLs
-    text = re.sub(r"http\S+|www\S+", "", text)
-
-    # Remove excessive punctuation (limit repeated punctuations to 2)
-    text = re.sub(r"([!?.,])\1{2,}", r"\1\1", text)
-
-    # Fix stretched words (e.g., "soooo" → "soo")
-    text = re.sub(r"(.)\1{2,}", r"\1\1", text)
-
-    return text
+    # URL removal and run-length collapsing happen in one precompiled scan
+    return normalizer(text.strip())
 
 
 def classify_sentiment(score: float) -> str:
@@ -48,30 +365,33 @@ def classify_sentiment(score: float) -> str:
     Returns:
         str: Sentiment category: Very Positive, Positive, Neutral, Negative, Very Negative.
     """
-    if score >= 0.7:
+    if score >= VERY_POSITIVE_THRESHOLD:
         return "Very Positive"
-    elif score >= 0.25:
+    elif score >= POSITIVE_THRESHOLD:
         return "Positive"
-    elif score > -0.25 and score < 0.25:
+    elif score > NEGATIVE_THRESHOLD and score < POSITIVE_THRESHOLD:
         return "Neutral"
-    elif score <= -0.25 and score > -0.7:
+    elif score <= NEGATIVE_THRESHOLD and score > VERY_NEGATIVE_THRESHOLD:
         return "Negative"
     else:
         return "Very Negative"
 
 
-def analyze_sentiment(text: str):
+def analyze_sentiment(text: str, lean: bool = False):
     """
     Analyze sentiment of a text string with preprocessing, scoring, and confidence estimation.
     
     Steps:
     1. Clean the text using `clean_text` for better accuracy on noisy inputs.
-    2. Get sentiment scores from VADER.
+    2. Get sentiment scores from VADER (or from the result cache for a
+       text that has been scored before).
     3. Classify sentiment category based on compound score.
     4. Estimate confidence as the absolute value of the compound score.
     
     Args:
         text (str): Input text to analyze.
+        lean (bool): Leave out the original and cleaned text (for callers that
+            already hold the text, and for results sent back from pool workers).
         
     Returns:
         dict: Contains original and cleaned text, sentiment label, compound score, 
@@ -80,21 +400,154 @@ def analyze_sentiment(text: str):
     # Clean text for more reliable sentiment scoring
     cleaned = clean_text(text)
 
-    # Get raw sentiment scores from VADER
-    raw_scores = sia.polarity_scores(cleaned)
-    compound = raw_scores["compound"]  # overall sentiment score
+    # Duplicate texts (after cleaning) are served from the result cache
+    sia = get_analyzer()
+    result_cache.ensure_fingerprint(cache_fingerprint())
+    key = text_key(cleaned)
+    scored = result_cache.get(key)
 
-    # Classify sentiment category
-    sentiment = classify_sentiment(compound)
+    if scored is None:
+        # Get raw sentiment scores from VADER
+        with stage("polarity_scores"):
+            raw_scores = sia.polarity_scores(cleaned)
+        compound = raw_scores["compound"]  # overall sentiment score
 
-    # Confidence estimate based on how far the score is from 0
-    confidence = round(abs(compound), 3)
+        scored = {
+            "sentiment": classify_sentiment(compound),  # classified sentiment label
+            "score": round(compound, 4),  # compound score rounded to 4 decimals
+            "confidence": round(abs(compound), 3),  # how far the score is from 0
+            "details": raw_scores,  # detailed VADER scores (pos, neg, neu, compound)
+        }
+        result_cache.set(key, scored)
 
-    return {
-        "text": text,  # original text
-        "cleaned_text": cleaned,  # cleaned/normalized text
-        "sentiment": sentiment,  # classified sentiment label
-        "score": round(compound, 4),  # compound score rounded to 4 decimals
-        "confidence": confidence,  # confidence in sentiment classification
-        "details": raw_scores  # detailed VADER scores (pos, neg, neu, compound)
+    result = {
+        "sentiment": scored["sentiment"],
+        "score": scored["score"],
+        "confidence": scored["confidence"],
+        "details": dict(scored["details"]),  # copy, callers may mutate it
     }
+    if not lean:
+        result["text"] = text  # original text
+        result["cleaned_text"] = cleaned  # cleaned/normalized text
+    return result
+
+
+def cache_fingerprint() -> str:
+    """
+    Identify the lexicon and thresholds the cached results were computed with.
+    Changing either one invalidates the result cache.
+    """
+    return (
+        f"{_lexicon_digest}:{VERY_POSITIVE_THRESHOLD}:{POSITIVE_THRESHOLD}:"
+        f"{NEGATIVE_THRESHOLD}:{VERY_NEGATIVE_THRESHOLD}"
+    )
+
+
+# ---------- Batch scoring ----------
+
+# Batches smaller than this are scored in the calling thread; larger ones are
+# split into chunks and fanned out across a process pool.
+PROCESS_POOL_MIN_BATCH = int(os.getenv("SENTIMENT_POOL_MIN_BATCH", "2000"))
+PROCESS_POOL_CHUNK_SIZE = int(os.getenv("SENTIMENT_POOL_CHUNK_SIZE", "500"))
+PROCESS_POOL_WORKERS = int(os.getenv("SENTIMENT_POOL_WORKERS", str(os.cpu_count() or 1)))
+
+_process_pool = None
+
+
+def _analyze_chunk(texts):
+    """
+    Score a chunk of texts (runs inside a pool worker). Results are lean, so
+    the texts are not pickled back to the parent.
+    """
+    return [analyze_sentiment(text, lean=True) for text in texts]
+
+
+def get_process_pool():
+    """
+    Create the scoring process pool on first use and return it.
+    Workers are forked from a forkserver that has already imported this module,
+    and each loads the lexicon once when it starts (not per task).
+    """
+    global _process_pool
+    if _process_pool is None:
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(["sentiment"])
+        _process_pool = ProcessPoolExecutor(max_workers=PROCESS_POOL_WORKERS, mp_context=ctx, initializer=preload)
+    return _process_pool
+
+
+def shutdown_process_pool():
+    """
+    Stop the scoring process pool and thread pool if they were started.
+    """
+    global _process_pool, _scoring_executor
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True, cancel_futures=True)
+        _process_pool = None
+    if _scoring_executor is not None:
+        _scoring_executor.shutdown(wait=True, cancel_futures=True)
+        _scoring_executor = None
+
+
+def analyze_batch(texts):
+    """
+    Analyze the sentiment of many texts at once.
+
+    Small batches are scored in-process. Large batches are split into chunks
+    and scored in parallel across a process pool.
+
+    Args:
+        texts (list[str]): Input texts.
+
+    Returns:
+        list[dict]: One lean `analyze_sentiment` result plus "text" per text,
+            in input order.
+    """
+    if len(texts) < PROCESS_POOL_MIN_BATCH or PROCESS_POOL_WORKERS <= 1:
+        results = _analyze_chunk(texts)
+    else:
+        size = PROCESS_POOL_CHUNK_SIZE
+        chunks = [texts[i:i + size] for i in range(0, len(texts), size)]
+        results = []
+        for chunk_results in get_process_pool().map(_analyze_chunk, chunks):
+            results.extend(chunk_results)
+
+    for result, text in zip(results, texts):
+        result["text"] = text
+    return results
+
+
+# ---------- Async scoring ----------
+
+# Scoring is CPU-bound; async handlers run it on this small dedicated pool so
+# the event loop keeps serving I/O-bound requests meanwhile.
+SCORING_THREADS = int(os.getenv("SENTIMENT_SCORING_THREADS", "4"))
+
+_scoring_executor = None
+
+
+def get_scoring_executor():
+    """
+    Create the scoring thread pool on first use and return it.
+    """
+    global _scoring_executor
+    if _scoring_executor is None:
+        _scoring_executor = ThreadPoolExecutor(max_workers=SCORING_THREADS, thread_name_prefix="scoring")
+    return _scoring_executor
+
+
+async def analyze_sentiment_async(text: str, lean: bool = False):
+    """
+    `analyze_sentiment` run on the scoring executor, for async handlers.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_scoring_executor(), analyze_sentiment, text, lean)
+
+
+async def analyze_batch_async(texts):
+    """
+    `analyze_batch` run on the scoring executor (large batches still fan out
+    to the process pool from there).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_scoring_executor(), analyze_batch, texts)
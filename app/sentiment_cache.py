@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from cache import MISSING, SQLiteConnections, TTLCache
+
+# Layout of the persistent tier, recorded in its meta table:
+# 2 = `entries` with expiry times (replaced the unbounded `results` table)
+PERSISTENT_SCHEMA_VERSION = 2
+
+
+def text_key(cleaned: str) -> str:
+    """
+    Content address of a normalized text (hex BLAKE2b digest).
+    """
+    return hashlib.blake2b(cleaned.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def lexicon_digest(lexicon: dict) -> str:
+    """
+    Stable digest of a VADER lexicon, used to detect lexicon changes.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for word, value in sorted(lexicon.items()):
+        h.update(f"{word}\t{value!r}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+class SentimentResultCache:
+    """
+    Memoizes sentiment results by the hash of the cleaned text.
+
+    Two tiers:
+    - a bounded in-memory LRU (always on);
+    - an optional SQLite file that survives restarts and can be shared by
+      several worker processes. Its entries expire after `ttl` seconds and
+      it keeps at most `max_rows` of them (pruned every `prune_every`
+      writes), so it does not grow without bound or keep hashes of texts
+      long after retention has removed them.
+
+    Every entry belongs to a fingerprint (lexicon digest + classification
+    thresholds). When the fingerprint changes, both tiers are cleared, so
+    results computed with an old lexicon or old thresholds are never served.
+
+    Args:
+        maxsize (int): Maximum number of results kept in memory.
+        path (str): SQLite file for the persistent tier (None disables it).
+        ttl (float): Lifetime of a persistent entry, in seconds.
+        max_rows (int): Maximum number of persistent entries.
+        prune_every (int): Prune the persistent tier after this many writes.
+    """
+
+    def __init__(self, maxsize: int = 100000, path: str = None, ttl: float = 604800.0,
+                 max_rows: int = 1000000, prune_every: int = 1000):
+        self.memory = TTLCache(maxsize=maxsize, ttl=float("inf"))
+        self.path = path
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.prune_every = prune_every
+        self._writes = 0
+        self.fingerprint = None
+        self._db = SQLiteConnections(path, [
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS ix_entries_expires_at ON entries (expires_at)",
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)",
+        ]) if path else None
+        self._lock = threading.Lock()
+        self.persistent_hits = 0
+        self.persistent_misses = 0
+        self.persistent_pruned = 0
+        self.invalidations = 0
+
+    # ---------- Persistent tier ----------
+
+    def _upgrade_persistent_schema(self, conn):
+        """
+        Apply one-time layout changes to the shared file, once per file: the
+        first process to see an older version applies them under the write
+        lock and records the new one, so a process that connects later never
+        drops a table that others are using.
+        """
+        row = conn.execute("SELECT value FROM meta WHERE name = 'schema'").fetchone()
+        if row is not None and int(row[0]) >= PERSISTENT_SCHEMA_VERSION:
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Checked again under the lock: another process may have upgraded
+            row = conn.execute("SELECT value FROM meta WHERE name = 'schema'").fetchone()
+            version = int(row[0]) if row is not None else 1
+            if version < 2:
+                conn.execute("DROP TABLE IF EXISTS results")  # unbounded layout without expiry times
+            if version < PERSISTENT_SCHEMA_VERSION:
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('schema', ?)", (str(PERSISTENT_SCHEMA_VERSION),))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _sync_persistent_fingerprint(self):
+        conn = self._db.get()
+        self._upgrade_persistent_schema(conn)
+        row = conn.execute("SELECT value FROM meta WHERE name = 'fingerprint'").fetchone()
+        if row is None or row[0] != self.fingerprint:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM entries")
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (self.fingerprint,))
+            conn.execute("COMMIT")
+
+    # ---------- Public API ----------
+
+    def ensure_fingerprint(self, fingerprint: str):
+        """
+        Clear every tier if the lexicon/threshold fingerprint has changed.
+        Cheap when it has not; call it before each lookup.
+        """
+        if fingerprint == self.fingerprint:
+            return
+        with self._lock:
+            if fingerprint == self.fingerprint:
+                return
+            if self.fingerprint is not None:
+                self.invalidations += 1
+            self.fingerprint = fingerprint
+            self.memory.clear()
+            if self.path:
+                self._sync_persistent_fingerprint()
+
+    def get(self, key: str):
+        """
+        Return the cached result for `key`, or None on a miss.
+        """
+        value = self.memory.get(key)
+        if value is not MISSING:
+            return value
+        if not self.path:
+            return None
+
+        row = self._db.get().execute(
+            "SELECT value FROM entries WHERE key = ? AND expires_at >= ?", (key, time.time())
+        ).fetchone()
+        if row is None:
+            self.persistent_misses += 1
+            return None
+        self.persistent_hits += 1
+        value = json.loads(row[0])
+        self.memory.set(key, value)  # promote to the memory tier
+        return value
+
+    def set(self, key: str, value: dict):
+        """
+        Store a result in every tier.
+        """
+        self.memory.set(key, value)
+        if not self.path:
+            return
+        conn = self._db.get()
+        conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, json.dumps(value), time.time() + self.ttl))
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune()
+
+    def prune(self) -> int:
+        """
+        Delete expired persistent entries, then the ones closest to expiry
+        beyond `max_rows`. Returns the number of entries deleted.
+        """
+        if not self.path:
+            return 0
+        conn = self._db.get()
+        deleted = conn.execute("DELETE FROM entries WHERE expires_at < ?", (time.time(),)).rowcount
+        deleted += conn.execute(
+            "DELETE FROM entries WHERE key IN "
+            "(SELECT key FROM entries ORDER BY expires_at DESC LIMIT -1 OFFSET ?)", (self.max_rows,)
+        ).rowcount
+        self.persistent_pruned += deleted
+        return deleted
+
+    def clear(self):
+        """
+        Drop every cached result (both tiers).
+        """
+        self.memory.clear()
+        if self.path:
+            self._db.get().execute("DELETE FROM entries")
+
+    def stats(self) -> dict:
+        """
+        Hit/miss/eviction counters for both tiers.
+        """
+        return {
+            "memory": self.memory.stats(),
+            "persistent": {
+                "enabled": bool(self.path),
+                "hits": self.persistent_hits,
+                "misses": self.persistent_misses,
+                "pruned": self.persistent_pruned,
+            },
+            "invalidations": self.invalidations,
+        }
+
+
+# Shared instance used by sentiment.analyze_sentiment
+result_cache = SentimentResultCache(
+    maxsize=int(os.getenv("SENTIMENT_CACHE_SIZE", "100000")),
+    path=os.getenv("SENTIMENT_CACHE_PATH") or None,
+    ttl=float(os.getenv("SENTIMENT_CACHE_TTL", "604800")),  # 7 days; keep it below RETENTION_DAYS
+    max_rows=int(os.getenv("SENTIMENT_CACHE_MAX_ROWS", "1000000")),
+)
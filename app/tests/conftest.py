@@ -0,0 +1,47 @@
+"""
+Test setup: the modules are imported flat from the `app` directory, and the
+database URL is read when `database` is first imported, so point it at a
+temporary SQLite file before any test module imports it. The `db` and
+`user` fixtures import the app modules when first used, for the same reason.
+
+Run from the `app` directory:
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+_tmp = tempfile.mkdtemp(prefix="chatbot-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp, 'test.db')}"
+
+
+@pytest.fixture
+def db():
+    from database import SessionLocal, engine
+    from migrations import migrate
+
+    migrate(engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        session.close()
+
+
+@pytest.fixture
+def user(db):
+    from database import Query, User
+
+    user = User(username="tester", session_token="tester-token", ip_address="127.0.0.1")
+    db.add(user)
+    db.commit()
+    yield user
+    db.query(Query).filter(Query.user_id == user.id).delete()
+    db.delete(user)
+    db.commit()
@@ -0,0 +1,76 @@
+"""
+The migration chain upgrades a database created before versioning, or one
+stopped at an earlier version, to the latest schema with its data intact.
+"""
+import json
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import Session
+from migrations import MIGRATIONS, current_version, migrate
+from search import has_search_index, search_queries
+
+LATEST = MIGRATIONS[-1][0]
+
+# The tables as the first release created them, without a schema_version table
+BASELINE_DDL = (
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR(150) NOT NULL UNIQUE, "
+    "session_token VARCHAR(150) UNIQUE, ip_address VARCHAR(50), created_at DATETIME DEFAULT CURRENT_TIMESTAMP)",
+    "CREATE TABLE queries (id INTEGER PRIMARY KEY, text VARCHAR(500) NOT NULL, sentiment VARCHAR(50) NOT NULL, "
+    "score FLOAT NOT NULL, details JSON, time DATETIME DEFAULT CURRENT_TIMESTAMP, "
+    "user_id INTEGER REFERENCES users (id), ip_address VARCHAR(50), latitude FLOAT, longitude FLOAT, "
+    "city VARCHAR(120), region VARCHAR(120), country VARCHAR(120), confidence FLOAT)",
+)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    yield engine
+    engine.dispose()
+
+
+def baseline(engine):
+    with engine.begin() as conn:
+        for statement in BASELINE_DDL:
+            conn.execute(text(statement))
+        conn.execute(text("INSERT INTO users (id, username, session_token) VALUES (1, 'old', 'old-token')"))
+        conn.execute(
+            text("INSERT INTO queries (text, sentiment, score, details, user_id, time) "
+                 "VALUES (:text, 'Positive', 0.6, :details, 1, '2025-06-01 12:00:00')"),
+            [{"text": f"saved before versioning {i}", "details": json.dumps({"pos": 0.6, "neg": 0.1, "neu": 0.3, "compound": 0.6})}
+             for i in range(3)],
+        )
+
+
+def assert_latest(engine):
+    with engine.connect() as conn:
+        assert current_version(conn) == LATEST
+        columns = {c["name"] for c in inspect(conn).get_columns("queries")}
+        assert {"pos", "neg", "neu"} <= columns
+        assert conn.execute(text("SELECT pos, neg, neu FROM queries")).all() == [(0.6, 0.1, 0.3)] * 3
+        assert conn.execute(text("SELECT count, score_sum FROM sentiment_rollups "
+                                 "WHERE scope = 'user' AND granularity = 'day'")).one() == (3, pytest.approx(1.8))
+        assert conn.execute(text("SELECT archived FROM retention_state WHERE name = 'queries'")).scalar() == 0
+
+        conn.execute(text("INSERT INTO queries (text, sentiment, score, user_id) VALUES ('saved after', 'Neutral', 0, 1)"))
+        assert conn.execute(text("SELECT data_version FROM users WHERE id = 1")).scalar() == 1
+        if has_search_index(conn):
+            results, _ = search_queries(Session(bind=conn), "versioning", user_id=1)
+            assert len(results) == 3
+            assert search_queries(Session(bind=conn), "after", user_id=1)[0][0]["text"] == "saved after"
+        conn.rollback()
+
+
+def test_unversioned_database_upgrades_to_latest(engine):
+    baseline(engine)
+    assert migrate(engine) == LATEST
+    assert_latest(engine)
+    assert migrate(engine) == LATEST  # nothing left to apply
+
+
+@pytest.mark.parametrize("stopped_at", [version for version, _, _ in MIGRATIONS[:-1]])
+def test_partly_migrated_database_upgrades_to_latest(engine, stopped_at):
+    baseline(engine)
+    assert migrate(engine, target=stopped_at) == stopped_at
+    assert migrate(engine) == LATEST
+    assert_latest(engine)
@@ -0,0 +1,115 @@
+"""
+Retention: expired and over-limit queries are archived before they are
+deleted, and a pass holds a lease that it renews per batch and gives up as
+soon as another process takes it over.
+"""
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+import pytest
+import retention
+from database import Query, RetentionState
+from retention import RetentionJob, archive_matching
+
+OLD = datetime(2020, 1, 1)
+
+
+@pytest.fixture
+def lease(db):
+    def state():
+        db.expire_all()
+        return db.get(RetentionState, retention.STATE_NAME)
+
+    yield state
+    db.rollback()
+    current = state()
+    current.holder = current.lease_until = None
+    db.commit()
+
+
+def add_queries(db, user, count, start=OLD):
+    queries = [
+        Query(user_id=user.id, text=f"retention text {i}", sentiment="Neutral", score=0.0,
+              time=start + timedelta(minutes=i))
+        for i in range(count)
+    ]
+    db.add_all(queries)
+    db.commit()
+    return [q.id for q in queries]
+
+
+def archived_ids(directory) -> list:
+    ids = []
+    for name in sorted(os.listdir(directory)):
+        with gzip.open(os.path.join(directory, name), "rt", encoding="utf-8") as fh:
+            ids.extend(json.loads(line)["id"] for line in fh)
+    return ids
+
+
+def remaining_ids(db, user) -> list:
+    return [i for (i,) in db.query(Query.id).filter(Query.user_id == user.id).order_by(Query.id)]
+
+
+def test_archive_matching_writes_before_deleting(db, user, tmp_path):
+    ids = add_queries(db, user, 5)
+
+    archived = archive_matching(db, Query.user_id == user.id, batch_size=2, directory=str(tmp_path))
+
+    assert archived == 5
+    assert len(os.listdir(tmp_path)) == 3  # one file per batch, oldest IDs first
+    assert archived_ids(tmp_path) == ids
+    assert remaining_ids(db, user) == []
+
+
+def test_run_archives_expired_and_over_limit_queries(db, user, tmp_path, lease):
+    old = add_queries(db, user, 3)
+    recent = add_queries(db, user, 4, start=retention._now() - timedelta(hours=1))
+    job = RetentionJob(max_age_days=365, max_per_user=2, archive_dir=str(tmp_path), batch_size=2)
+
+    done = job.run_once()
+
+    assert done["archived"] == 5
+    assert sorted(archived_ids(tmp_path)) == old + recent[:2]
+    assert remaining_ids(db, user) == recent[2:]  # the newest two
+    assert lease().holder == job.holder and lease().lease_until is None  # released
+    assert lease().last_run_at is not None
+
+
+def test_run_is_skipped_while_another_process_holds_the_lease(db, user, tmp_path, lease):
+    ids = add_queries(db, user, 3)
+    state = lease()
+    state.holder, state.lease_until = "other", retention._now() + timedelta(minutes=5)
+    db.commit()
+
+    assert RetentionJob(max_age_days=365, archive_dir=str(tmp_path)).run_once() == {"skipped": True}
+    assert remaining_ids(db, user) == ids
+
+    state = lease()
+    state.lease_until = retention._now() - timedelta(seconds=1)  # expired: can be taken over
+    db.commit()
+    assert RetentionJob(max_age_days=365, archive_dir=str(tmp_path)).run_once()["archived"] == 3
+
+
+def test_lease_is_renewed_per_batch_and_lost_on_takeover(db, user, tmp_path, lease, monkeypatch):
+    add_queries(db, user, 6)
+    job = RetentionJob(max_age_days=365, archive_dir=str(tmp_path), batch_size=2)
+    renewals = []
+    write = retention.write_archive
+
+    def write_then_take_over(rows, directory):
+        path = write(rows, directory)
+        renewals.append(lease().lease_until)
+        if len(renewals) == 2:
+            lease().holder = "other"  # while the second batch is being written
+            db.commit()
+        return path
+
+    monkeypatch.setattr(retention, "write_archive", write_then_take_over)
+    done = job.run_once()
+
+    assert done == {"archived": 4, "lease_lost": True}
+    assert job.leases_lost == 1
+    assert renewals[1] > renewals[0]  # renewed before the second batch
+    assert len(remaining_ids(db, user)) == 2  # the third batch was never started
+    assert lease().holder == "other"
@@ -0,0 +1,66 @@
+"""
+Removing deleted queries from the rollups must leave them as a rebuild from
+the table would, except in buckets that still cover archived rows.
+"""
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import delete, select
+from aggregates import on_queries_saved, query_values
+from crud import delete_query
+from database import Query, SentimentRollup
+from rollups import rebuild_rollups
+
+START = datetime(2026, 1, 1)
+
+
+def add_queries(db, user, specs):
+    """
+    Save queries from (time, score, sentiment, country) tuples, with their rollups.
+    """
+    queries = [
+        Query(user_id=user.id, text="rollup text", time=time, score=score, sentiment=sentiment, country=country)
+        for time, score, sentiment, country in specs
+    ]
+    db.add_all(queries)
+    db.flush()
+    on_queries_saved(db, [query_values(q) for q in queries])
+    db.commit()
+    return queries
+
+
+def user_buckets(db, user) -> dict:
+    rows = db.scalars(select(SentimentRollup).where(
+        SentimentRollup.scope == "user", SentimentRollup.scope_key == str(user.id)
+    ))
+    return {
+        (r.granularity, r.bucket_start): (r.count, round(r.score_sum, 6), r.score_min, r.score_max,
+                                          r.positive, r.neutral, r.negative)
+        for r in rows
+    }
+
+
+def test_deletes_match_rebuild(db, user):
+    rng = random.Random(0)
+    queries = add_queries(db, user, [
+        (START + timedelta(minutes=rng.randrange(3000)), round(rng.uniform(-1, 1), 2),
+         rng.choice(["Positive", "Neutral", "Negative"]), rng.choice(["India", "France", None]))
+        for _ in range(200)
+    ])
+    for query in rng.sample(queries, 100):
+        assert delete_query(db, user.id, query.id)
+    incremental = user_buckets(db, user)
+
+    rebuild_rollups(db)
+    assert incremental == user_buckets(db, user)
+
+
+def test_archived_rows_keep_bounds(db, user):
+    archived, _ = add_queries(db, user, [(START, -0.5, "Negative", None), (START, 0.5, "Positive", None)])
+    # Retention deletes archived rows without subtracting them from the rollups
+    db.execute(delete(Query).where(Query.id == archived.id))
+    db.commit()
+
+    (tie,) = add_queries(db, user, [(START, -0.5, "Negative", None)])
+    assert delete_query(db, user.id, tie.id)
+    count, _, score_min, score_max, *_ = user_buckets(db, user)[("minute", START)]
+    assert (count, score_min, score_max) == (2, -0.5, 0.5)
@@ -0,0 +1,85 @@
+"""
+The full-text index follows inserts, deletes and updates of queries through
+its triggers, including the owner column, and relevance pages reach every
+match.
+"""
+import pytest
+import search
+from database import Query, User
+from search import has_search_index, search_queries
+
+
+@pytest.fixture
+def other(db):
+    user = User(username="other", session_token="other-token", ip_address="127.0.0.1")
+    db.add(user)
+    db.commit()
+    yield user
+    db.rollback()
+    db.query(Query).filter(Query.user_id == user.id).delete()
+    db.delete(user)
+    db.commit()
+
+
+@pytest.fixture(autouse=True)
+def require_index(db):
+    if not has_search_index(db.connection()):
+        pytest.skip("SQLite was built without FTS5")
+
+
+def add(db, user, text):
+    query = Query(user_id=user.id, text=text, sentiment="Neutral", score=0.0)
+    db.add(query)
+    db.commit()
+    return query
+
+
+def found(db, user, q, **kwargs):
+    results, _ = search_queries(db, q, user.id, **kwargs)
+    return [r["id"] for r in results]
+
+
+def test_triggers_keep_the_index_in_sync(db, user, other):
+    query = add(db, user, "a zebra crossing")
+    assert found(db, user, "zebra") == [query.id]
+    assert found(db, other, "zebra") == []
+
+    query.text = "a giraffe crossing"
+    db.commit()
+    assert found(db, user, "zebra") == []
+    assert found(db, user, "giraffe") == [query.id]
+
+    query.user_id = other.id  # the owner column follows the row
+    db.commit()
+    assert found(db, user, "giraffe") == []
+    assert found(db, other, "giraffe") == [query.id]
+
+    db.delete(query)
+    db.commit()
+    assert found(db, other, "giraffe") == []
+
+
+def test_index_and_scan_agree_on_newest_first(db, user, monkeypatch):
+    ids = [add(db, user, text).id for text in ("red apple", "green apple", "apple pie", "pear")]
+    scanned = found(db, user, "apple", order="newest")
+    monkeypatch.setattr(search, "SEARCH_USER_SCAN", 0)
+    assert found(db, user, "apple", order="newest") == scanned == ids[2::-1]
+
+
+def test_relevance_pages_reach_every_match(db, user, other):
+    texts = ["kiwi"] * 3 + ["kiwi kiwi smoothie"] * 2 + [f"kiwi and {word} salad" for word in ("mango", "melon", "lime")]
+    ids = {add(db, user, text).id for text in texts}
+    add(db, other, "kiwi")
+    add(db, user, "banana")
+
+    seen, cursor = [], None
+    while True:
+        results, cursor = search_queries(db, "kiwi", user.id, cursor=cursor, limit=2)
+        seen.extend(r["id"] for r in results)
+        relevance = [r["relevance"] for r in results]
+        assert relevance == sorted(relevance, reverse=True)
+        if cursor is None:
+            break
+
+    assert len(seen) == len(set(seen))  # equal ranks do not repeat across pages
+    assert set(seen) == ids
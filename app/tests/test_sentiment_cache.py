@@ -0,0 +1,32 @@
+"""
+Layout changes of the persistent sentiment cache run once per file, not on
+every connection.
+"""
+import sqlite3
+from sentiment_cache import PERSISTENT_SCHEMA_VERSION, SentimentResultCache
+
+
+def tables(path) -> set:
+    with sqlite3.connect(path) as conn:
+        return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def test_old_results_table_dropped_once(tmp_path):
+    path = str(tmp_path / "sentiment.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE results (key TEXT PRIMARY KEY, value TEXT)")
+
+    first = SentimentResultCache(path=path)
+    first.ensure_fingerprint("lexicon-1")
+    first.set("key", {"score": 0.5})
+    assert "results" not in tables(path)
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT value FROM meta WHERE name = 'schema'").fetchone() == (str(PERSISTENT_SCHEMA_VERSION),)
+
+    # A table created after the upgrade survives processes that connect later
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE results (key TEXT PRIMARY KEY, value TEXT)")
+    late = SentimentResultCache(path=path)
+    late.ensure_fingerprint("lexicon-1")
+    assert late.get("key") == {"score": 0.5}
+    assert "results" in tables(path)
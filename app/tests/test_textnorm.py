@@ -0,0 +1,46 @@
+"""
+`clean_text` (one scan of the shared TextNormalizer) must give exactly the
+output of the original three-regex implementation.
+"""
+import random
+import pytest
+from benchmarks.bench_clean_text import legacy_clean_text, make_corpus
+from sentiment import clean_text
+from textnorm import TextNormalizer
+
+# Pieces that put runs next to URLs, and URLs between runs
+PIECES = ["h", "t", "p", "w", ".", ":", "/", " ", "  ", "\t", "\n", "\r", "a", "aa", "!", ",",
+          "http://x", "www.y", "hhttp", "wwww"]
+
+
+@pytest.mark.parametrize("text", [
+    "I love this sooooo much!!!!",
+    "see https://example.com/a?b=1 now",
+    "a  http://x  b",
+    "a \thttp://x \tb",
+    "hhhttp://x.io",
+    "wwwwww.example.org",
+    "okkkk,,,, yesss???",
+    "",
+])
+def test_examples(text):
+    assert clean_text(text) == legacy_clean_text(text)
+
+
+def test_corpus():
+    mismatches = [text for text in make_corpus(5000) if clean_text(text) != legacy_clean_text(text)]
+    assert mismatches == []
+
+
+def test_random_pieces():
+    rng = random.Random(7)
+    for _ in range(20000):
+        text = "".join(rng.choice(PIECES) for _ in range(rng.randint(0, 14)))
+        assert clean_text(text) == legacy_clean_text(text), text
+
+
+def test_rule_priority():
+    normalizer = TextNormalizer().add_rule("heart", r"<3", " love ").add_rule("lt", r"<", " less ")
+    assert normalizer("a <3 b < c") == "a  love  b  less  c"
+    with pytest.raises(ValueError):
+        normalizer.add_rule("lt", r">", "")
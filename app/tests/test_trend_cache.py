@@ -0,0 +1,47 @@
+"""
+The trend image cache key and ETag must change with any change to a user's
+queries, including ones that leave the row count and highest ID unchanged.
+"""
+from sqlalchemy import update
+from crud import delete_query
+from database import Query
+from trendplot import trend_etag, trend_watermark
+
+
+def add_query(db, user, score: float) -> int:
+    query = Query(user_id=user.id, text="trend text", sentiment="Positive", score=score, ip_address="127.0.0.1")
+    db.add(query)
+    db.commit()
+    return query.id
+
+
+def etag(db, user) -> str:
+    return trend_etag(user.id, user.session_token, trend_watermark(db, user.id))
+
+
+def test_delete_then_insert_changes_etag(db, user):
+    add_query(db, user, 0.1)
+    last_id = add_query(db, user, 0.2)
+    before = etag(db, user)
+
+    assert delete_query(db, user.id, last_id)
+    new_id = add_query(db, user, -0.9)
+
+    # SQLite hands out the deleted highest rowid again: same count, same max(id)
+    assert new_id == last_id
+    assert etag(db, user) != before
+
+
+def test_location_update_changes_etag(db, user):
+    query_id = add_query(db, user, 0.5)
+    before = etag(db, user)
+
+    db.execute(update(Query).where(Query.id == query_id).values(city="Lisbon", country="Portugal"))
+    db.commit()
+
+    assert etag(db, user) != before
+
+
+def test_unchanged_data_keeps_etag(db, user):
+    add_query(db, user, 0.5)
+    assert etag(db, user) == etag(db, user)
@@ -0,0 +1,114 @@
+"""
+Upload jobs: chunked scoring, resuming from the committed position, lease
+takeover of abandoned jobs and discarding a chunk after losing the job.
+"""
+from datetime import timedelta
+import pytest
+import uploads
+from database import Query, ScoringJob
+from uploads import UploadJobRunner, create_job, new_job_id
+
+TEXTS = [f"upload line {i} is great" for i in range(7)] + ["", "x" * 10000, "last line is bad"]
+
+
+@pytest.fixture
+def make_job(db, user, tmp_path):
+    def make(texts=TEXTS):
+        job_id = new_job_id()
+        path = tmp_path / f"{job_id}.txt"
+        path.write_text("\n".join(texts) + "\n", encoding="utf-8")
+        return create_job(db, job_id, user.id, "upload.txt", "text", "text", str(path),
+                          path.stat().st_size, "127.0.0.1")
+
+    yield make
+    db.rollback()
+    db.query(ScoringJob).filter(ScoringJob.user_id == user.id).delete()
+    db.commit()
+
+
+def reload(db, job_id):
+    db.expire_all()
+    return db.get(ScoringJob, job_id)
+
+
+def saved_texts(db, user):
+    return sorted(t for (t,) in db.query(Query.text).filter(Query.user_id == user.id))
+
+
+def test_job_scores_every_record(db, user, make_job):
+    job = make_job()
+    UploadJobRunner(chunk_size=3, lease=60).run_job(job.id)
+
+    job = reload(db, job.id)
+    assert job.status == "done"
+    assert (job.records, job.scored, job.skipped) == (9, 8, 1)  # blank line ignored, long text skipped
+    assert job.position == job.size
+    assert sum(job.labels.values()) == 8
+    assert saved_texts(db, user) == sorted(t for t in TEXTS if t and len(t) < 10000)
+
+
+def test_stopped_job_resumes_from_committed_position(db, user, make_job, monkeypatch):
+    job = make_job()
+    first = UploadJobRunner(chunk_size=3, lease=60)
+    score = uploads.analyze_batch
+
+    def score_then_stop(texts):
+        first._stopping.set()  # as on shutdown: the chunk in progress still commits
+        return score(texts)
+
+    monkeypatch.setattr(uploads, "analyze_batch", score_then_stop)
+    first.run_job(job.id)
+
+    job = reload(db, job.id)
+    assert job.status == "pending"
+    assert job.records == 3
+    assert 0 < job.position < job.size
+    assert len(saved_texts(db, user)) == 3
+
+    monkeypatch.setattr(uploads, "analyze_batch", score)
+    UploadJobRunner(chunk_size=3, lease=60).run_job(job.id)
+
+    job = reload(db, job.id)
+    assert job.status == "done"
+    assert (job.records, job.scored, job.skipped) == (9, 8, 1)
+    assert saved_texts(db, user) == sorted(t for t in TEXTS if t and len(t) < 10000)  # no duplicates
+
+
+def test_running_job_is_taken_over_only_after_the_lease(db, user, make_job):
+    job = make_job()
+    runner = UploadJobRunner(chunk_size=3, lease=60)
+    job.status = "running"
+    db.commit()
+
+    assert job.id not in runner.orphaned_jobs()
+    runner.run_job(job.id)
+    assert reload(db, job.id).records == 0  # a live runner holds it
+
+    job.updated_at = job.updated_at - timedelta(seconds=120)
+    db.commit()
+    assert job.id in runner.orphaned_jobs()
+    runner.run_job(job.id)
+    assert reload(db, job.id).status == "done"
+
+
+def test_chunk_is_discarded_when_the_job_was_taken_over(db, user, make_job, monkeypatch):
+    job = make_job()
+    score = uploads.analyze_batch
+
+    def score_while_taken_over(texts):
+        # Another runner claims the job and commits a chunk meanwhile
+        other = uploads.SessionLocal()
+        try:
+            other.query(ScoringJob).filter(ScoringJob.id == job.id).update({"position": 1})
+            other.commit()
+        finally:
+            other.close()
+        return score(texts)
+
+    monkeypatch.setattr(uploads, "analyze_batch", score_while_taken_over)
+    UploadJobRunner(chunk_size=3, lease=60).run_job(job.id)
+
+    job = reload(db, job.id)
+    assert job.position == 1
+    assert job.status == "running"  # left to the runner that owns it
+    assert saved_texts(db, user) == []
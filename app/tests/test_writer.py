@@ -0,0 +1,117 @@
+"""
+The group-commit writer: IDs, durability modes, per-row failures and draining
+on stop.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import crud
+from database import Query
+from worker import BatchWorker
+from writer import QueryWriter
+
+DETAILS = {"pos": 0.5, "neg": 0.0, "neu": 0.5, "compound": 0.5}
+
+
+class GatedWriter(QueryWriter):
+    """
+    A writer whose batches wait for `gate` before they are inserted.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.gate = threading.Event()
+
+    def _insert(self, rows):
+        self.gate.wait(5)
+        return super()._insert(rows)
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    writers = []
+
+    def start(cls=QueryWriter, **kwargs):
+        instance = cls(**kwargs)
+        instance.start()
+        writers.append(instance)
+        monkeypatch.setattr(crud, "query_writer", instance)
+        return instance
+
+    yield start
+    for instance in writers:
+        if isinstance(instance, GatedWriter):
+            instance.gate.set()
+        instance.stop()
+
+
+def submit(user, text="writer text"):
+    return crud._submit_query(user, text, "Positive", 0.5, "127.0.0.1", 0.5, DETAILS, loc=None)
+
+
+def test_subclass_must_handle_batches():
+    class Incomplete(BatchWorker):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete(10, 5, 0.01)
+
+
+def test_concurrent_submits_get_distinct_ids(db, user, writer):
+    writer(batch_size=16, max_wait=0.01)
+    with ThreadPoolExecutor(8) as pool:
+        futures = list(pool.map(lambda i: submit(user, f"text {i}"), range(200)))
+    ids = [future.result(5) for future in futures]
+
+    assert len(set(ids)) == 200
+    texts = dict(db.query(Query.id, Query.text).filter(Query.id.in_(ids)))
+    assert [texts[query_id] for query_id in ids] == [f"text {i}" for i in range(200)]
+
+
+@pytest.mark.parametrize("durability", ["queued", "commit"])
+def test_durability(db, user, writer, monkeypatch, durability):
+    gated = writer(GatedWriter)
+    monkeypatch.setattr(crud, "WRITE_DURABILITY", durability)
+    done = threading.Event()
+    saved = []
+
+    def save():
+        saved.append(crud.save_query(db, user, "durable", "Positive", 0.5, "127.0.0.1", 0.5, DETAILS))
+        done.set()
+
+    thread = threading.Thread(target=save)
+    thread.start()
+    if durability == "queued":
+        # Returns while the row is still waiting for its batch
+        assert done.wait(5)
+        assert not saved[0].done()
+    else:
+        # Waits for the commit
+        assert not done.wait(0.2)
+    gated.gate.set()
+    thread.join(5)
+    assert db.get(Query, saved[0].result(5)).text == "durable"
+
+
+def test_poisoned_row_fails_alone(db, user, writer):
+    gated = writer(GatedWriter, batch_size=8, max_wait=0.05)
+    futures = [submit(user, "good 1"), submit(user, None), submit(user, "good 2")]
+    gated.gate.set()
+
+    with pytest.raises(Exception):
+        futures[1].result(5)
+    ids = [futures[0].result(5), futures[2].result(5)]
+    assert [db.get(Query, query_id).text for query_id in ids] == ["good 1", "good 2"]
+    assert gated.failed == 1
+
+
+def test_stop_drains_queue(db, user, writer):
+    gated = writer(GatedWriter, batch_size=4)
+    futures = [submit(user, f"queued {i}") for i in range(20)]
+    assert gated.depth() > 0
+    gated.gate.set()
+    gated.stop()
+
+    assert not gated.running
+    assert all(future.done() for future in futures)
+    assert len({future.result() for future in futures}) == 20
@@ -0,0 +1,109 @@
+import re
+
+
+class TextNormalizer:
+    """
+    Single-pass text normalizer built from pluggable regex rules.
+
+    All rules are compiled into one alternation and applied with a single
+    `re.sub` scan. At any position, rules added earlier take priority.
+    Rule patterns may use named groups but not numbered backreferences,
+    since group numbers shift when the rules are combined.
+
+    When a rule deletes text, characters on either side of the deletion become
+    neighbours. Rules marked `rejoin=True` (e.g. run-length collapsing) are then
+    applied once more over the result, so the output matches running each rule
+    as its own pass.
+
+    Example:
+        normalizer.add_rule("heart", r"<3", " love ")
+    """
+
+    def __init__(self):
+        self._rules = []  # (name, pattern, replacement, rejoin)
+        self._pattern = None
+        self._rejoin_pattern = None
+        self._handlers = {}
+        self._deleting = set()
+
+    def add_rule(self, name: str, pattern: str, replacement, rejoin: bool = False):
+        """
+        Register a normalization step.
+
+        Args:
+            name (str): Unique rule name (must be a valid regex group name).
+            pattern (str): Regular expression to match.
+            replacement (str or callable): Replacement text, or a function
+                taking the match object and returning the replacement.
+            rejoin (bool): Re-apply this rule where a deletion joined text.
+
+        Returns:
+            TextNormalizer: self, so calls can be chained.
+        """
+        if any(rule[0] == name for rule in self._rules):
+            raise ValueError(f"Duplicate normalization rule: {name}")
+        self._rules.append((name, pattern, replacement, rejoin))
+        self._compile()
+        return self
+
+    def _compile(self):
+        self._pattern = re.compile("|".join(f"(?P<{name}>{pattern})" for name, pattern, _, _ in self._rules))
+
+        rejoin = [(name, pattern) for name, pattern, _, flag in self._rules if flag]
+        self._rejoin_pattern = (
+            re.compile("|".join(f"(?P<{name}>{pattern})" for name, pattern in rejoin)) if rejoin else None
+        )
+
+        self._handlers = {}
+        self._deleting = set()  # rules whose replacement is empty
+        for name, _, replacement, _ in self._rules:
+            if callable(replacement):
+                self._handlers[name] = replacement
+            else:
+                self._handlers[name] = lambda m, text=replacement: text
+                if replacement == "":
+                    self._deleting.add(name)
+
+    def __call__(self, text: str) -> str:
+        """
+        Normalize `text` in one scan (two if a deletion joined neighbours).
+        """
+        if self._pattern is None:
+            return text
+
+        handlers = self._handlers
+        deleting = self._deleting
+        deleted = False
+
+        def replace(match):
+            nonlocal deleted
+            name = match.lastgroup
+            if name in deleting:
+                deleted = True
+            return handlers[name](match)
+
+        text = self._pattern.sub(replace, text)
+        if deleted and self._rejoin_pattern is not None:
+            text = self._rejoin_pattern.sub(replace, text)
+        return text
+
+
+def build_default_normalizer() -> TextNormalizer:
+    """
+    Build the normalizer used by `sentiment.clean_text`:
+
+    1. Remove URLs (both http(s) and www formats).
+    2. Reduce any character repeated 3+ times to 2 ("soooo" → "soo",
+       "!!!" → "!!"). This also covers repeated punctuation.
+    """
+    normalizer = TextNormalizer()
+    normalizer.add_rule("url", r"http\S+|www\S+", "")
+    normalizer.add_rule(
+        "run",
+        # A run of "h" must not swallow the "h" that starts an "http" URL,
+        # otherwise the URL would no longer be recognised.
+        r"(?P<run_char>.)(?P=run_char){2,}(?!(?<=h)ttp\S)",
+        lambda m: m.group("run_char") * 2,
+        rejoin=True,
+    )
+    return normalizer
@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from cache import TTLCache
+from database import Query, User
+
+# Rendering runs in this bounded pool, off the event loop
+TREND_RENDER_WORKERS = int(os.getenv("TREND_RENDER_WORKERS", "2"))
+TREND_DPI = int(os.getenv("TREND_DPI", "150"))
+
+_render_pool = None
+
+# Rendered PNGs keyed by (user_id, session token, watermark); any change to the
+# user's queries changes the watermark
+png_cache = TTLCache(
+    maxsize=int(os.getenv("TREND_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("TREND_CACHE_TTL", "3600")),
+)
+
+
+def trend_watermark(db: Session, user_id: int):
+    """
+    Return (query count, data version) for a user. The database bumps the
+    version on every insert, update (e.g. geolocation) and delete of the
+    user's queries, so it identifies the exact data a plot was drawn from.
+    """
+    count = db.scalar(select(func.count(Query.id)).where(Query.user_id == user_id))
+    version = db.scalar(select(User.data_version).where(User.id == user_id))
+    return count, version
+
+
+def trend_etag(user_id: int, token: str, watermark) -> str:
+    """
+    Strong ETag for a user's trend image at a given watermark. The session
+    token tells apart a new user who reuses a deleted user's ID.
+    """
+    raw = f"{user_id}:{token}:{watermark[0]}:{watermark[1]}:{TREND_DPI}"
+    return '"' + hashlib.blake2b(raw.encode(), digest_size=12).hexdigest() + '"'
+
+
+def trend_points(db: Session, user_id: int):
+    """
+    Fetch only the columns the plot needs, oldest first.
+    """
+    return (
+        db.query(Query.time, Query.score, Query.country, Query.city)
+        .filter(Query.user_id == user_id)
+        .order_by(Query.time.asc(), Query.id.asc())
+        .all()
+    )
+
+
+def preload():
+    """
+    Import matplotlib and load its font cache eagerly, e.g. in a server master
+    process before it forks workers, so those pages are shared copy-on-write.
+    """
+    import matplotlib.font_manager  # noqa: F401 (loads the font list)
+    from matplotlib.backends.backend_agg import FigureCanvasAgg  # noqa: F401
+    from matplotlib.figure import Figure  # noqa: F401
+
+
+def render_trend_png(rows) -> bytes:
+    """
+    Plot scores over time with points colored by location and return PNG bytes.
+
+    Uses the object-oriented Figure API (no pyplot global state), so it is safe
+    to call from several threads. Each location is drawn with one scatter call.
+    """
+    # Imported here so worker startup does not pay for matplotlib
+    import matplotlib
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    times = [r.time for r in rows]
+    scores = [r.score for r in rows]
+
+    # Group points by "Country - City", keeping first-appearance order
+    groups = {}
+    for r in rows:
+        loc = f"{r.country or 'Unknown'} - {r.city or 'Unknown'}"
+        group = groups.setdefault(loc, ([], []))
+        group[0].append(r.time)
+        group[1].append(r.score)
+
+    cmap = matplotlib.colormaps["tab10"].resampled(len(groups))
+
+    fig = Figure(figsize=(12, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.set_title("Sentiment Trend Colored by Location")
+    ax.set_xlabel("Time")
+    ax.set_ylabel("Sentiment Score (Compound)")
+    ax.grid(True)
+
+    for i, (loc, (loc_times, loc_scores)) in enumerate(groups.items()):
+        ax.scatter(loc_times, loc_scores, color=cmap(i), s=60, label=loc)
+
+    ax.plot(times, scores, linestyle="--", color="gray", alpha=0.4)
+    ax.legend(title="Country - City", fontsize=8)
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=TREND_DPI, bbox_inches="tight")
+    return buf.getvalue()
+
+
+async def render_trend_png_async(rows) -> bytes:
+    """
+    Render in the bounded worker pool without blocking the event loop.
+    """
+    global _render_pool
+    if _render_pool is None:
+        _render_pool = ThreadPoolExecutor(max_workers=TREND_RENDER_WORKERS, thread_name_prefix="trend-render")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_render_pool, render_trend_png, rows)
+
+
+def shutdown_render_pool():
+    """
+    Wait for in-flight renders to finish (called on app shutdown).
+    """
+    global _render_pool
+    if _render_pool is not None:
+        _render_pool.shutdown(wait=True, cancel_futures=True)
+        _render_pool = None
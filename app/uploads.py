@@ -0,0 +1,431 @@
+"""
+Background scoring of large uploaded files.
+
+An upload is streamed to disk (`UPLOAD_DIR`) and recorded as a ScoringJob.
+`UploadJobRunner` then reads the file record by record, scores
+`UPLOAD_CHUNK_SIZE` records at a time with `analyze_batch` (across the
+process pool for large chunks) and saves each chunk with one bulk INSERT.
+The job's byte offset and summary statistics are updated in the same
+transaction, so memory stays flat whatever the file size, and a job that was
+interrupted resumes from its last committed chunk:
+- on a clean shutdown the job is handed back ("pending") and resumed on the
+  next start;
+- if the process was killed, the job stays "running" without a heartbeat,
+  and any runner takes it over once `UPLOAD_JOB_LEASE` seconds have passed.
+
+Supported formats: "text" (one text per line), "jsonl" (one
+`{"text": ...}` object per line) and "csv" (texts in the `column` column,
+header on the first line). Records without a text, or with a text longer
+than TEXT_MAX_LENGTH, are counted as skipped.
+"""
+import asyncio
+import csv
+import itertools
+import json
+import os
+import queue
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.orm import Session
+from crud import UserRecord, save_queries_bulk
+from database import ScoringJob, SessionLocal
+from models import TEXT_MAX_LENGTH
+from sentiment import analyze_batch
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "./uploads")
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", "5000"))  # records per scored, committed chunk
+UPLOAD_JOB_LEASE = float(os.getenv("UPLOAD_JOB_LEASE", "60"))  # seconds without progress before takeover
+UPLOAD_POLL_INTERVAL = float(os.getenv("UPLOAD_POLL_INTERVAL", "15"))  # how often idle runners look for orphaned jobs
+UPLOAD_FORMATS = ("text", "jsonl", "csv")
+COPY_BUFFER_SIZE = 1024 * 1024
+
+_STOP = object()  # sentinel that tells the worker to exit
+
+
+class JobLost(Exception):
+    """
+    The job was taken over by another runner (our lease had expired).
+    """
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# ---------- Jobs ----------
+
+def detect_format(filename: str, requested: str = "auto") -> str:
+    """
+    Return the upload format: `requested`, or guessed from the file extension.
+    Raises ValueError for unknown formats.
+    """
+    if requested != "auto":
+        if requested not in UPLOAD_FORMATS:
+            raise ValueError(f"format must be one of auto, {', '.join(UPLOAD_FORMATS)}")
+        return requested
+    extension = os.path.splitext(filename or "")[1].lower()
+    return {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}.get(extension, "text")
+
+
+def new_job_id() -> str:
+    return str(uuid.uuid4())
+
+
+def new_upload_path(job_id: str) -> str:
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    return os.path.join(UPLOAD_DIR, f"{job_id}.upload")
+
+
+async def spool_upload(upload, path: str) -> int:
+    """
+    Copy an UploadFile to `path` in fixed-size blocks; return its size in bytes.
+    """
+    size = 0
+    try:
+        with open(path, "wb") as out:
+            while True:
+                block = await upload.read(COPY_BUFFER_SIZE)
+                if not block:
+                    break
+                await asyncio.to_thread(out.write, block)
+                size += len(block)
+    except BaseException:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
+    return size
+
+
+def create_job(db: Session, job_id: str, user_id: int, filename: str, fmt: str, column: str,
+               path: str, size: int, ip_address: str) -> ScoringJob:
+    """
+    Record a spooled upload as a pending job.
+    """
+    now = _now()
+    job = ScoringJob(
+        id=job_id, user_id=user_id, filename=filename, format=fmt, text_column=column,
+        path=path, size=size, ip_address=ip_address, status="pending", labels={},
+        created_at=now, updated_at=now,
+    )
+    db.add(job)
+    db.commit()
+    return job
+
+
+def get_job(db: Session, job_id: str, user_id: int):
+    """
+    Return a user's job, or None if it does not exist or belongs to someone else.
+    """
+    job = db.get(ScoringJob, job_id)
+    if job is None or job.user_id != user_id:
+        return None
+    return job
+
+
+def job_dict(job: ScoringJob) -> dict:
+    """
+    Progress and summary of a job, as returned by the API.
+    """
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "filename": job.filename,
+        "format": job.format,
+        "size": job.size,
+        "position": job.position,
+        "progress": round(job.position / job.size, 4) if job.size else 1.0,
+        "records": job.records,
+        "scored": job.scored,
+        "skipped": job.skipped,
+        "summary": {
+            "mean_score": round(job.score_sum / job.scored, 4) if job.scored else None,
+            "labels": job.labels or {},
+        },
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+    }
+
+
+# ---------- Parsing ----------
+
+def read_records(path: str, fmt: str, column: str = "text", position: int = 0):
+    """
+    Yield (text or None, byte offset after the record) from `position` on.
+
+    The file is read line by line in binary mode so offsets are exact; None
+    marks a record without a usable text (bad JSON, missing CSV column).
+    Blank lines are ignored.
+    """
+    with open(path, "rb") as fh:
+        index = None
+        if fmt == "csv":
+            header = next(csv.reader([fh.readline().decode("utf-8-sig")]), [])
+            if column not in header:
+                raise ValueError(f"CSV has no {column!r} column")
+            index = header.index(column)
+            position = max(position, fh.tell())
+        fh.seek(position)
+        offset = position
+
+        def lines():
+            nonlocal offset
+            for line in fh:
+                text = line.decode("utf-8-sig" if offset == 0 else "utf-8", errors="replace")
+                offset += len(line)
+                yield text
+
+        if fmt == "csv":
+            # csv.reader pulls more lines for quoted fields that span lines;
+            # each record ends at a line end, so `offset` is exact after it
+            for row in csv.reader(lines()):
+                if not row:
+                    continue
+                text = row[index] if index < len(row) else None
+                yield (text or None), offset
+            return
+
+        for line in lines():
+            line = line.rstrip("\r\n")
+            if not line.strip():
+                continue
+            if fmt == "jsonl":
+                try:
+                    item = json.loads(line)
+                    text = item.get("text") if isinstance(item, dict) else None
+                except ValueError:
+                    text = None
+                yield (text if isinstance(text, str) and text.strip() else None), offset
+            else:
+                yield line, offset
+
+
+# ---------- Runner ----------
+
+class UploadJobRunner:
+    """
+    Background worker that scores uploaded files one job at a time.
+
+    Args:
+        session_factory (callable): Creates the worker's database sessions.
+        chunk_size (int): Records scored and committed per transaction.
+        lease (float): Seconds a "running" job may go without progress before
+                       another runner takes it over.
+        poll_interval (float): Seconds between scans for orphaned jobs while idle.
+    """
+
+    def __init__(self, session_factory=SessionLocal, chunk_size: int = 5000, lease: float = 60.0,
+                 poll_interval: float = 15.0):
+        self.session_factory = session_factory
+        self.chunk_size = chunk_size
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+        # Metrics
+        self.completed = 0
+        self.failed = 0
+        self.chunks = 0
+        self.records = 0
+
+    # ---------- Lifecycle ----------
+
+    def start(self):
+        """
+        Start the worker thread (no-op if already running). Jobs left over by
+        a previous run are picked up right away.
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name="upload-jobs", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        """
+        Stop after the chunk in progress; the current job is handed back and
+        resumes on the next start.
+        """
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is None or not thread.is_alive():
+            return
+        self._stopping.set()
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, job_id: str):
+        """
+        Schedule a newly created job.
+        """
+        self._queue.put(job_id)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queued": self._queue.qsize(),
+            "completed": self.completed,
+            "failed": self.failed,
+            "chunks": self.chunks,
+            "records": self.records,
+        }
+
+    # ---------- Worker side ----------
+
+    def _claimable(self):
+        stale = _now() - timedelta(seconds=self.lease)
+        return or_(
+            ScoringJob.status == "pending",
+            and_(ScoringJob.status == "running", ScoringJob.updated_at < stale),
+        )
+
+    def orphaned_jobs(self):
+        """
+        IDs of jobs nobody is working on, oldest first.
+        """
+        db = self.session_factory()
+        try:
+            stmt = select(ScoringJob.id).where(self._claimable()).order_by(ScoringJob.created_at)
+            return list(db.scalars(stmt))
+        finally:
+            db.close()
+
+    def _claim(self, db: Session, job_id: str):
+        # Compare-and-set, so only one runner (thread or process) gets the job
+        claimed = db.execute(
+            update(ScoringJob)
+            .where(ScoringJob.id == job_id, self._claimable())
+            .values(status="running", updated_at=_now())
+        ).rowcount
+        db.commit()
+        return db.get(ScoringJob, job_id) if claimed else None
+
+    def _run(self):
+        backlog = self.orphaned_jobs()
+        while not self._stopping.is_set():
+            if backlog:
+                job_id = backlog.pop(0)
+            else:
+                try:
+                    job_id = self._queue.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    backlog = self.orphaned_jobs()
+                    continue
+                if job_id is _STOP:
+                    break
+            try:
+                self.run_job(job_id)
+            except Exception as e:
+                print("Upload job runner error:", e)
+
+    def run_job(self, job_id: str):
+        """
+        Claim a job and score it chunk by chunk from its committed position.
+        """
+        db = self.session_factory()
+        try:
+            job = self._claim(db, job_id)
+            if job is None:
+                return  # finished, or another runner has it
+            try:
+                finished = self._process(db, job)
+            except JobLost:
+                db.rollback()
+                print(f"Upload job {job_id} was taken over by another runner")
+                return
+            except Exception as e:
+                db.rollback()
+                self._finish(db, job, "failed", error=str(e)[:500])
+                self.failed += 1
+                print(f"Upload job {job_id} failed:", e)
+                return
+
+            if finished:
+                self._finish(db, job, "done")
+                self.completed += 1
+                try:
+                    os.remove(job.path)
+                except OSError:
+                    pass
+            else:
+                self._finish(db, job, "pending")  # stopping: resume on the next start
+        finally:
+            db.close()
+
+    def _finish(self, db: Session, job: ScoringJob, status: str, error: str = None):
+        db.execute(
+            update(ScoringJob)
+            .where(ScoringJob.id == job.id, ScoringJob.status == "running")
+            .values(status=status, error=error, updated_at=_now())
+        )
+        db.commit()
+
+    def _process(self, db: Session, job: ScoringJob) -> bool:
+        """
+        Score the rest of a job's file. Returns False if stopped before the end.
+        """
+        user = UserRecord(job.user_id, None, None)
+        state = {
+            "position": job.position, "records": job.records, "scored": job.scored,
+            "skipped": job.skipped, "score_sum": job.score_sum, "labels": dict(job.labels or {}),
+        }
+        records = read_records(job.path, job.format, job.text_column, job.position)
+
+        while not self._stopping.is_set():
+            chunk = list(itertools.islice(records, self.chunk_size))
+            if not chunk:
+                return True
+
+            texts = [text for text, _ in chunk if text and len(text) <= TEXT_MAX_LENGTH]
+            results = analyze_batch(texts) if texts else []
+
+            new = dict(state, position=chunk[-1][1], labels=dict(state["labels"]))
+            new["records"] += len(chunk)
+            new["scored"] += len(results)
+            new["skipped"] += len(chunk) - len(texts)
+            for r in results:
+                new["score_sum"] += r["score"]
+                new["labels"][r["sentiment"]] = new["labels"].get(r["sentiment"], 0) + 1
+
+            def advance(session, old=state["position"], values=new):
+                # Only move forward from the position we resumed from; if
+                # another runner took the job over, nothing of this chunk is kept
+                moved = session.execute(
+                    update(ScoringJob)
+                    .where(ScoringJob.id == job.id, ScoringJob.position == old, ScoringJob.status == "running")
+                    .values(updated_at=_now(), **values)
+                ).rowcount
+                if not moved:
+                    raise JobLost(job.id)
+
+            if results:
+                # Background work: geolocate the (single) client IP inline
+                save_queries_bulk(db, user, results, job.ip_address, before_commit=advance, defer_geo=False)
+            else:
+                advance(db)
+                db.commit()
+
+            state = new
+            self.chunks += 1
+            self.records += len(chunk)
+        return False
+
+
+# Shared instance used by the /upload endpoints and started by the FastAPI lifespan
+upload_jobs = UploadJobRunner(
+    chunk_size=UPLOAD_CHUNK_SIZE,
+    lease=UPLOAD_JOB_LEASE,
+    poll_interval=UPLOAD_POLL_INTERVAL,
+)
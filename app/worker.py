@@ -0,0 +1,119 @@
+import abc
+import queue
+import threading
+import time
+
+_STOP = object()  # sentinel that tells the worker to exit
+
+
+class BatchWorker(abc.ABC):
+    """
+    Background thread that drains a bounded queue in batches.
+
+    Producers queue items with `_put`; a single worker thread blocks for the
+    first item, collects more until the batch holds `batch_size` items or
+    `max_wait` has elapsed, and hands each batch to `handle_batch`, which
+    subclasses must implement (a subclass without it cannot be created).
+    `stop` lets the worker finish everything queued before it.
+
+    Args:
+        capacity (int): Maximum number of queued items (backpressure bound).
+        batch_size (int): Maximum number of items per batch.
+        max_wait (float): Seconds to wait for a batch to fill up before handling it.
+    """
+
+    thread_name = "batch-worker"
+
+    def __init__(self, capacity: int, batch_size: int, max_wait: float):
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue(maxsize=capacity)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    # ---------- Lifecycle ----------
+
+    def start(self):
+        """
+        Start the worker thread (no-op if already running).
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """
+        Handle the queued items, then stop the worker thread.
+
+        Args:
+            timeout (float): Maximum seconds to wait for the drain to finish.
+        """
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(_STOP)  # queued after everything already submitted
+        thread.join(timeout)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    # ---------- Producer side ----------
+
+    def _put(self, item, timeout: float) -> bool:
+        """
+        Queue an item, blocking up to `timeout` seconds (0 never blocks).
+        Returns False if the queue stayed full.
+        """
+        try:
+            if timeout > 0:
+                self._queue.put(item, timeout=timeout)
+            else:
+                self._queue.put_nowait(item)
+        except queue.Full:
+            return False
+        return True
+
+    # ---------- Worker side ----------
+
+    @abc.abstractmethod
+    def handle_batch(self, items):
+        """
+        Handle one batch of queued items.
+        """
+
+    def _next_batch(self):
+        """
+        Block for the first item, then collect more until the batch is full
+        or `max_wait` has elapsed. Returns (items, stop_requested).
+        """
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+
+        items = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return items, True
+            items.append(item)
+        return items, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            items, stop = self._next_batch()
+            if items:
+                self.handle_batch(items)
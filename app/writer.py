@@ -0,0 +1,153 @@
+import os
+from concurrent.futures import Future
+from sqlalchemy import insert
+from database import Query, SessionLocal
+from enrichment import geo_queue
+from aggregates import on_queries_saved
+from metrics import stage
+from worker import BatchWorker
+
+# "commit": save_query waits until the batch holding the row is committed
+# "queued": save_query returns as soon as the row is queued (rows still queued
+#           are lost if the process dies; the returned future reports the ID)
+WRITE_DURABILITY = os.getenv("WRITE_DURABILITY", "commit")
+
+
+class QueryWriter(BatchWorker):
+    """
+    Group-commit writer for the queries table.
+
+    Concurrent requests submit rows; a single worker thread collects them into
+    batches bounded by size and time, and writes each batch with one
+    executemany INSERT in one transaction. The cost of a commit (and its fsync)
+    is shared by the whole batch instead of paid per request.
+
+    How durable a committed batch is depends on the engine profile
+    (e.g. SQLITE_SYNCHRONOUS=FULL fsyncs every commit).
+
+    Args:
+        session_factory (callable): Creates the worker's database sessions.
+        batch_size (int): Maximum number of rows per transaction.
+        max_wait (float): Seconds to wait for a batch to fill up before committing.
+        capacity (int): Maximum number of queued rows (backpressure bound).
+        put_timeout (float): Seconds `submit` may block when the queue is full.
+    """
+
+    thread_name = "query-writer"
+
+    def __init__(self, session_factory=SessionLocal, batch_size: int = 256, max_wait: float = 0.005,
+                 capacity: int = 10000, put_timeout: float = 1.0):
+        super().__init__(capacity, batch_size, max_wait)
+        self.session_factory = session_factory
+        self.put_timeout = put_timeout
+
+        # Metrics
+        self.submitted = 0
+        self.rejected = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.max_batch = 0
+
+    # ---------- Producer side ----------
+
+    def submit(self, row: dict, geolocate: bool = False, timeout: float = None):
+        """
+        Queue a row (column name -> value) for insertion.
+
+        Args:
+            row (dict): Values for a new Query row.
+            geolocate (bool): Queue the row for background geolocation once written.
+            timeout (float): Override `put_timeout` (0 never blocks, e.g. on an event loop).
+
+        Returns:
+            Future or None: Resolves to the new query ID once the batch is
+            committed; None if the queue stayed full for the timeout.
+        """
+        future = Future()
+        timeout = self.put_timeout if timeout is None else timeout
+        if not self._put((row, future, geolocate), timeout):
+            self.rejected += 1
+            return None
+        self.submitted += 1
+        return future
+
+    def stats(self) -> dict:
+        """
+        Return queue depth and batching counters.
+        """
+        return {
+            "running": self.running,
+            "depth": self.depth(),
+            "capacity": self.capacity,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "written": self.written,
+            "failed": self.failed,
+            "batches": self.batches,
+            "mean_batch": round(self.written / self.batches, 2) if self.batches else 0,
+            "max_batch": self.max_batch,
+        }
+
+    # ---------- Worker side ----------
+
+    def _insert(self, rows):
+        """
+        Insert rows and update the aggregates in one transaction.
+        Returns the new IDs in input order.
+        """
+        db = self.session_factory()
+        try:
+            with stage("writer_batch"):
+                stmt = insert(Query).returning(Query.id, sort_by_parameter_order=True)
+                ids = list(db.scalars(stmt, rows))
+                on_queries_saved(db, rows)
+                db.commit()
+            return ids
+        finally:
+            db.close()
+
+    def handle_batch(self, items):
+        """
+        Write a batch of (row, future, geolocate) items and resolve the futures.
+        If the batch fails, its rows are retried one per transaction so a
+        single bad row does not fail the others.
+        """
+        try:
+            ids = self._insert([row for row, _, _ in items])
+        except Exception as e:
+            print("Query write batch failed, retrying rows one by one:", e)
+            for item in items:
+                self._write_one(item)
+            return
+
+        for (row, future, geolocate), query_id in zip(items, ids):
+            future.set_result(query_id)
+            if geolocate:
+                geo_queue.submit(query_id, row["ip_address"])
+        self.written += len(items)
+        self.batches += 1
+        self.max_batch = max(self.max_batch, len(items))
+
+    def _write_one(self, item):
+        row, future, geolocate = item
+        try:
+            (query_id,) = self._insert([row])
+        except Exception as e:
+            self.failed += 1
+            future.set_exception(e)
+            return
+        future.set_result(query_id)
+        if geolocate:
+            geo_queue.submit(query_id, row["ip_address"])
+        self.written += 1
+        self.batches += 1
+
+
+# Shared instance used by crud.save_query and started by the FastAPI lifespan
+query_writer = QueryWriter(
+    batch_size=int(os.getenv("WRITE_BATCH_SIZE", "256")),
+    max_wait=float(os.getenv("WRITE_BATCH_WAIT", "0.005")),
+    capacity=int(os.getenv("WRITE_QUEUE_CAPACITY", "10000")),
+    put_timeout=float(os.getenv("WRITE_PUT_TIMEOUT", "1.0")),
+)